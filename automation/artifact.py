@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Build the Next.js app once and package it as a content-hashed release tarball
+
+deployment.mode "artifact" packages the standalone server, run by PM2 on the
+instance. "static" packages a static export instead, which Nginx serves from
+disk without a Node server.
+"""
+
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import logging
+import argparse
+import platform
+import tarfile
+import subprocess
+from pathlib import Path
+
+from cdn_offload import build_env as cdn_build_env, offload_enabled, offload_release
+from image_variants import VARIANTS_DIR, build_variants, image_settings
+from precompress import compression_settings, precompress, release_roots
+from releases import release_root, switch_script
+from session import get_session
+
+logger = logging.getLogger(__name__)
+
+# Repository root (the Next.js app) relative to this directory
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class Release:
+    """A packaged release tarball"""
+
+    def __init__(self, path, digest):
+        self.path = Path(path)
+        self.digest = digest
+
+    @property
+    def id(self):
+        return self.digest[:12]
+
+    @property
+    def filename(self):
+        return self.path.name
+
+    def __repr__(self):
+        return f"Release({self.filename})"
+
+
+def artifact_mode(config):
+    """Check whether deployments ship a prebuilt release instead of building on the VM"""
+    return config['deployment'].get('mode', 'source') in ('artifact', 'static')
+
+
+def static_mode(config):
+    """Check whether Nginx serves a static export with no Node server behind it"""
+    return config['deployment'].get('mode', 'source') == 'static'
+
+
+def _reset_tarinfo(info):
+    """Strip ownership and timestamps so identical trees produce identical tarballs"""
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    info.mtime = 0
+    return info
+
+
+def build_app(repo_root=REPO_ROOT, output='standalone', extra_env=None):
+    """Run the Next.js production build with the given output ("standalone" or "export")"""
+    if output == 'standalone' and (platform.system() != 'Linux' or platform.machine() not in ('x86_64', 'AMD64')):
+        logger.warning("Building on a non linux-x64 host; native modules may not run on the VM")
+
+    env = dict(os.environ, NEXT_OUTPUT=output, NEXT_TELEMETRY_DISABLED='1', **(extra_env or {}))
+    for cmd in (['npm', 'ci'], ['npm', 'run', 'build']):
+        logger.info(f"  → {' '.join(cmd)}")
+        subprocess.run(cmd, cwd=repo_root, env=env, check=True)
+
+
+def stage_release(repo_root, staging):
+    """Lay out the standalone server with its static assets beside it"""
+    standalone = repo_root / '.next' / 'standalone'
+    if not (standalone / 'server.js').exists():
+        raise FileNotFoundError(f"{standalone}/server.js missing; was the build run with NEXT_OUTPUT=standalone?")
+
+    if staging.exists():
+        shutil.rmtree(staging)
+    shutil.copytree(standalone, staging, symlinks=True)
+    shutil.copytree(repo_root / '.next' / 'static', staging / '.next' / 'static')
+    if (repo_root / 'public').exists():
+        shutil.copytree(repo_root / 'public', staging / 'public')
+
+
+def stage_export(repo_root, staging):
+    """Lay out the static export (pages, assets and public files) as the release"""
+    export = repo_root / 'out'
+    if not (export / 'index.html').exists():
+        raise FileNotFoundError(f"{export}/index.html missing; was the build run with NEXT_OUTPUT=export?")
+
+    if staging.exists():
+        shutil.rmtree(staging)
+    shutil.copytree(export, staging)
+
+
+def render_image_variants(config, repo_root, staging, cache_dir):
+    """Pre-render next/image variants into the release for Nginx to serve"""
+    settings = image_settings(config)
+    if not settings['enabled'] or not (repo_root / 'public' / 'images').exists():
+        return
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        logger.warning("Pillow is not installed; images will be optimized by Next.js at runtime")
+        return
+
+    stats = build_variants(repo_root / 'public' / 'images', staging / VARIANTS_DIR, cache_dir,
+                           settings['widths'], settings['qualities'], settings['formats'],
+                           settings['workers'] or None)
+    logger.info(f"✓ Image variants: {stats['images']} images, {stats['reused']} unchanged, "
+                f"{stats['encoded']} encoded ({', '.join(stats['formats'])}) in {stats['seconds']}s")
+
+
+def compress_assets(config, staging, cache_dir):
+    """Write .gz/.br siblings of the assets Nginx serves from the release"""
+    settings = compression_settings(config)
+    if not settings['enabled']:
+        return
+
+    stats = precompress(release_roots(staging, static_mode(config)), cache_dir, settings['encodings'],
+                        settings['workers'] or None, settings['min_size'])
+    ratios = ", ".join(f"{e} {r:.0%}" for e, r in stats['ratios'].items())
+    logger.info(f"✓ Pre-compressed {stats['files']} assets, {stats['reused']} unchanged "
+                f"({ratios} of original size) in {stats['seconds']}s")
+    if 'br' in settings['encodings'] and 'br' not in stats['encodings']:
+        logger.warning("brotli is not installed; only .gz siblings were written")
+
+
+def package_release(staging, out_dir):
+    """Write a reproducible .tar.gz of the staging tree named after its content hash"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_dir / 'release.tar.gz.partial'
+
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w') as tar:
+                for path in sorted(staging.rglob('*')):
+                    tar.add(path, arcname=str(path.relative_to(staging)), recursive=False, filter=_reset_tarinfo)
+
+    digest = hashlib.sha256(tmp_path.read_bytes()).hexdigest()
+    path = out_dir / f"release-{digest[:12]}.tar.gz"
+    os.replace(tmp_path, path)
+    return Release(path, digest)
+
+
+def build_release(config, repo_root=REPO_ROOT, skip_build=False):
+    """Build the app once and return the packaged Release"""
+    artifact_cfg = config.get('artifact', {})
+    out_dir = Path(artifact_cfg.get('output_dir', 'releases'))
+
+    static = static_mode(config)
+    offload = offload_enabled(config)
+    if not skip_build:
+        logger.info(f"Building Next.js {'static export' if static else 'standalone bundle'}...")
+        # Offloaded assets are linked from the bucket instead of the instance
+        build_app(repo_root, 'export' if static else 'standalone',
+                  cdn_build_env(config, repo_root) if offload else None)
+
+    staging = out_dir / 'staging'
+    if static:
+        stage_export(repo_root, staging)
+    else:
+        stage_release(repo_root, staging)
+    render_image_variants(config, repo_root, staging, out_dir / 'image-cache')
+    compress_assets(config, staging, out_dir / 'compress-cache')
+    if offload:
+        offload_release(config, staging, static)
+    release = package_release(staging, out_dir)
+    shutil.rmtree(staging)
+
+    size_mb = release.path.stat().st_size / (1024 * 1024)
+    logger.info(f"✓ Packaged {release.filename} ({size_mb:.1f} MB)")
+    return release
+
+
+def publish_release(config, credentials, release):
+    """Upload the tarball to the artifact bucket once; return its gs:// URL"""
+    from google.cloud import storage
+
+    bucket_name = config['artifact']['bucket']
+    blob_name = f"{config['application']['name']}/releases/{release.filename}"
+    client = storage.Client(project=config['gcp']['project_id'], credentials=credentials)
+    blob = client.bucket(bucket_name).blob(blob_name)
+
+    # The name is content-addressed, so an existing object is already this release
+    if blob.exists():
+        logger.info(f"Release {release.filename} already in gs://{bucket_name}")
+    else:
+        logger.info(f"Uploading {release.filename} to gs://{bucket_name}...")
+        blob.upload_from_filename(str(release.path), content_type='application/gzip')
+
+    return f"gs://{bucket_name}/{blob_name}"
+
+
+def release_dir(config, release):
+    """Directory on the instance a release is unpacked into"""
+    return f"{release_root(config)}/releases/{release.id}"
+
+
+def release_install_script(config, release, tarball=None, sudo=''):
+    """Shell steps that unpack a release (unless already in place) and switch to it"""
+    root = release_root(config)
+
+    unpack = cleanup = ""
+    if tarball:
+        unpack = f"""{sudo}mkdir -p $RELEASE_DIR
+{sudo}tar -xzf {tarball} -C $RELEASE_DIR
+"""
+        cleanup = f"rm -f {tarball}\n"
+
+    return f"""RELEASE_DIR={release_dir(config, release)}
+{unpack}{sudo}chown -R $(id -un):$(id -gn) {root}
+{cleanup}
+{switch_script(config, '$RELEASE_DIR', artifact=True, sudo=sudo)}"""
+
+
+def main():
+    """Build and package a release without deploying it"""
+    parser = argparse.ArgumentParser(description="Build and package a release without deploying it")
+    parser.add_argument('--skip-build', action='store_true', help='package the existing build output without rebuilding')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    os.chdir(Path(__file__).parent)
+    config = get_session().config
+
+    try:
+        release = build_release(config, skip_build=args.skip_build)
+        logger.info(f"Release: {release.path} ({release.digest})")
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logger.error(f"Release build failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Exercise the load test harness against a local stand-in server
+
+The stand-in serves the storefront routes over keep-alive HTTP/1.1 with an
+injected per-request latency. The run checks the histogram's percentiles
+against exact ones, load tests the stand-in closed- and open-loop, then
+slows it down and shows the baseline comparison catching the regression.
+Exits non-zero when the comparison misses it.
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from loadtest import Histogram, LoadTest, compare, render_report  # noqa: E402
+
+PAGE = (b'<html><head><link rel="stylesheet" href="/_next/static/css/app.css">'
+        b'<script src="/_next/static/chunks/main.js"></script></head><body>' + b'x' * 20000 + b'</body></html>')
+
+
+def make_handler(latency):
+    """Request handler sleeping latency['ms'] (with jitter) before answering"""
+
+    class StandIn(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(random.uniform(0.5, 1.5) * latency['ms'] / 1000)
+            body = PAGE if self.path == '/' else b'\0' * (40000 if 'image' in self.path else 8000)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StandIn
+
+
+def check_histogram(samples=100_000):
+    """Compare histogram percentiles with exact ones on a long-tailed sample"""
+    values = sorted(random.lognormvariate(-4, 0.8) for _ in range(samples))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+
+    print(f"{'pct':<6} {'exact ms':>10} {'hdr ms':>10} {'error':>8}")
+    for pct in (50, 95, 99, 99.9):
+        exact = values[max(0, int(pct / 100 * samples) - 1)] * 1000
+        approx = histogram.percentile(pct)
+        print(f"p{pct:<5} {exact:>10.3f} {approx:>10.3f} {(approx / exact - 1) * 100:>7.2f}%")
+    print(f"{len(histogram.counts)} buckets for {samples} samples\n")
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=5.0, help='stand-in latency in ms')
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rps', type=float, default=300.0)
+    args = parser.parse_args()
+
+    check_histogram()
+
+    latency = {'ms': args.latency}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+
+    def run(**kwargs):
+        test = LoadTest(host, port, duration=args.duration, warmup=0.5, seed=1, **kwargs)
+
+        async def go():
+            await test.discover_static()
+            return await test.run()
+
+        return asyncio.run(go())
+
+    baseline = run(concurrency=args.concurrency)
+    print(render_report(baseline) + "\n")
+
+    open_loop = run(concurrency=args.concurrency, rps=args.rps)
+    print(render_report(open_loop) + "\n")
+
+    latency['ms'] = args.latency * 3
+    slower = run(concurrency=args.concurrency)
+    print(f"After tripling stand-in latency: p95 {slower['latency_ms']['p95']}ms, {slower['rps']} req/s")
+    regressions = compare(slower, baseline)
+    for regression in regressions:
+        print(f"  regression: {regression}")
+
+    server.shutdown()
+    if not regressions:
+        print("FAIL  the baseline comparison missed the slowdown")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Time the asset offload against an in-memory bucket
+
+Builds a synthetic staged release (hashed JS/CSS chunks with .gz siblings,
+public images and their variants), then offloads it to a FakeBucket (see
+fake_gcp.py) three times: into an empty bucket, again unchanged, and after a
+share of the chunks changed. Each run reports wall time, objects uploaded
+and storage API calls, for every worker count given.
+
+    python benchmarks/bench_offload.py
+    python benchmarks/bench_offload.py --chunks 2000 --latency 60 --workers 1 8 32
+"""
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+import time
+import random
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+AUTOMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, AUTOMATION_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gcp import FakeBucket, FakeCloud  # noqa: E402
+from cdn_offload import release_objects, upload  # noqa: E402
+from image_variants import VARIANTS_DIR, file_digest  # noqa: E402
+
+
+def write_chunk(static_dir, index, rng, size):
+    """One hashed chunk with its .gz sibling, as the build and precompress.py leave it"""
+    body = "".join(f"function f{index}_{i}(){{return {rng.random()}}}\n" for i in range(size // 40)).encode()
+    path = static_dir / 'chunks' / f"{index}-{hashlib.sha256(body).hexdigest()[:16]}.js"
+    path.write_bytes(body)
+    path.with_name(path.name + '.gz').write_bytes(gzip.compress(body, 9, mtime=0))
+    return path
+
+
+def make_release(root, chunks, images, variants, seed):
+    """Standalone-layout staging tree; returns the chunk paths"""
+    rng = random.Random(seed)
+    static_dir = root / '.next' / 'static'
+    (static_dir / 'chunks').mkdir(parents=True)
+    paths = [write_chunk(static_dir, i, rng, rng.randint(2_000, 60_000)) for i in range(chunks)]
+
+    images_dir = root / 'public' / 'images'
+    images_dir.mkdir(parents=True)
+    manifest = {}
+    for i in range(images):
+        image = images_dir / f"image-{i}.jpg"
+        image.write_bytes(rng.randbytes(rng.randint(100_000, 400_000)))
+        manifest[image.name] = file_digest(image)
+        entry = root / VARIANTS_DIR / image.name
+        entry.mkdir(parents=True)
+        for v in range(variants):
+            (entry / f"{640 + v * 100}-75.webp").write_bytes(rng.randbytes(rng.randint(10_000, 80_000)))
+    (root / VARIANTS_DIR / 'manifest.json').write_text(json.dumps(manifest))
+    return paths
+
+
+def change_chunks(paths, share, seed):
+    """A new build: a share of the chunks get new content, so new hashed names"""
+    rng = random.Random(seed)
+    for index, path in enumerate(paths):
+        if rng.random() < share:
+            path.unlink()
+            path.with_name(path.name + '.gz').unlink()
+            write_chunk(path.parent.parent, 100_000 + index, rng, rng.randint(2_000, 60_000))
+
+
+def timed(cloud, bucket, root, workers):
+    started = time.perf_counter()
+    calls = sum(cloud.calls.values())
+    stats = upload(bucket, 'assets', release_objects(root, static=False), workers)
+    return time.perf_counter() - started, stats, sum(cloud.calls.values()) - calls
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=400)
+    parser.add_argument('--images', type=int, default=12)
+    parser.add_argument('--variants', type=int, default=8, help='variants per image')
+    parser.add_argument('--changed', type=float, default=0.1, help='share of chunks a rebuild changes')
+    parser.add_argument('--latency', type=float, default=30.0, help='storage request round trip in ms')
+    parser.add_argument('--upload-mbps', type=float, default=200.0)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 16])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"{args.chunks} chunks, {args.images} images x {args.variants} variants, "
+          f"latency {args.latency:.0f}ms, {args.upload_mbps:.0f} Mbit/s\n")
+    print(f"{'WORKERS':>7} {'RUN':<10} {'TIME':>8} {'OBJECTS':>8} {'UPLOADED':>9} {'MB':>7} {'CALLS':>6}")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            paths = make_release(root, args.chunks, args.images, args.variants, seed=1)
+            cloud = FakeCloud(api_latency=args.latency / 1000, upload_mbps=args.upload_mbps)
+            bucket = FakeBucket(cloud)
+
+            for run in ('empty', 'unchanged', 'rebuilt'):
+                if run == 'rebuilt':
+                    change_chunks(paths, args.changed, seed=2)
+                seconds, stats, calls = timed(cloud, bucket, root, workers)
+                print(f"{workers:>7} {run:<10} {seconds:>7.2f}s {stats['objects']:>8} {stats['uploaded']:>9} "
+                      f"{stats['bytes'] / (1024 * 1024):>7.1f} {calls:>6}")
+
+
+if __name__ == "__main__":
+    main()
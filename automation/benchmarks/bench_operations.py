@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark the operation waiter against a fake compute client
+
+Operations finish after a random duration and every API call pays an
+injected round-trip latency. wait() blocks server-side for up to two minutes
+and fails with DeadlineExceeded when its RPC deadline expires first. Time is simulated, so the benchmark runs
+instantly and compares the waiter with the old fixed 5 second polling loop.
+"""
+
+import os
+import sys
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from google.api_core.exceptions import DeadlineExceeded  # noqa: E402
+
+from operations import OperationWaiter  # noqa: E402
+
+
+class FakeClock:
+    """Simulated monotonic clock"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeOperation:
+    """Minimal stand-in for compute_v1.Operation"""
+
+    def __init__(self, name, zone, status):
+        self.name = name
+        self.zone = zone
+        self.status = status
+        self.error = None
+
+
+class FakeOperationsClient:
+    """Zone operations client whose operations finish at a scheduled time"""
+
+    def __init__(self, clock, finish_at, latency, max_server_wait=120):
+        self.clock = clock
+        self.finish_at = finish_at
+        self.latency = latency
+        self.max_server_wait = max_server_wait
+        self.calls = 0
+        self.expired = 0
+
+    def _snapshot(self):
+        status = 'DONE' if self.clock() >= self.finish_at else 'RUNNING'
+        return FakeOperation('op-bench', 'zones/us-central1-f', status)
+
+    def get(self, **kwargs):
+        self.calls += 1
+        self.clock.sleep(self.latency)
+        return self._snapshot()
+
+    def wait(self, timeout=None, **kwargs):
+        self.calls += 1
+        started = self.clock()
+        self.clock.sleep(self.latency)
+        self.clock.sleep(min(max(0.0, self.finish_at - self.clock()), self.max_server_wait))
+        if timeout is not None and self.clock() - started > timeout:
+            self.clock.now = started + timeout
+            self.expired += 1
+            raise DeadlineExceeded("wait() exceeded its deadline")
+        return self._snapshot()
+
+
+def legacy_wait(client, clock, operation):
+    """The original loop: sleep 5 seconds, then poll"""
+    while operation.status != 'DONE':
+        clock.sleep(5)
+        operation = client.get()
+    return operation
+
+
+def run(iterations, latency, seed, max_duration=90):
+    """Run both strategies over the same operation durations"""
+    rng = random.Random(seed)
+    durations = [rng.uniform(5, max_duration) for _ in range(iterations)]
+    results = {'legacy': [], 'waiter': []}
+    calls = {'legacy': 0, 'waiter': 0}
+    expired = {'legacy': 0, 'waiter': 0}
+
+    for duration in durations:
+        for strategy in results:
+            clock = FakeClock()
+            client = FakeOperationsClient(clock, duration, latency)
+            operation = FakeOperation('op-bench', 'zones/us-central1-f', 'RUNNING')
+
+            if strategy == 'legacy':
+                legacy_wait(client, clock, operation)
+            else:
+                waiter = OperationWaiter('bench', zone_client=client, sleep=clock.sleep, clock=clock)
+                waiter.wait(operation)
+
+            results[strategy].append(clock() - duration)
+            calls[strategy] += client.calls
+            expired[strategy] += client.expired
+
+    print(f"{iterations} operations, {latency * 1000:.0f} ms injected latency per call")
+    print(f"{'strategy':<10} {'mean overshoot':>15} {'p95 overshoot':>14} {'api calls':>10} {'expired':>8}")
+    for strategy, overshoot in results.items():
+        p95 = sorted(overshoot)[int(len(overshoot) * 0.95) - 1]
+        print(f"{strategy:<10} {statistics.mean(overshoot):>14.2f}s {p95:>13.2f}s {calls[strategy]:>10} {expired[strategy]:>8}")
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.15, help='seconds per API call')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--max-duration', type=float, default=90, help='longest operation, in seconds')
+    args = parser.parse_args()
+
+    run(args.iterations, args.latency, args.seed, args.max_duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Time the deployment flows end to end against the fake Compute Engine backend
+
+Each run gets a fresh FakeCloud (see fake_gcp.py), so no GCP project or SSH
+host is needed. The API latency, operation durations, transient failures and
+quotas are set from the command line. The flows run the real code paths:
+GCPDeployment.deploy(), the fleet, a fleet redeploy with nothing changed,
+deploy_to_existing and update.py --rollback over the pooled-SSH transport,
+an instance group rerun over a drifted earlier deploy, status and a destroy
+that also tears down a deployed group.
+Every run reports wall time and API calls.
+
+    python benchmarks/bench_orchestration.py
+    python benchmarks/bench_orchestration.py --latency 80 --failure-rate 0.1
+    python benchmarks/bench_orchestration.py --flows deploy --instance-quota 0
+"""
+
+import os
+import sys
+import copy
+import time
+import logging
+import argparse
+import statistics
+from unittest import mock
+
+AUTOMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, AUTOMATION_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yaml  # noqa: E402
+from google.cloud import compute_v1  # noqa: E402
+from fake_gcp import FakeCloud, FakeSSHPool, install  # noqa: E402
+
+FLOWS = ['deploy', 'fleet', 'redeploy', 'existing', 'rollback', 'group', 'status', 'destroy']
+
+
+def bench_config(fleet_size):
+    """config.yaml pointed at the fake project, with side effects switched off"""
+    with open(os.path.join(AUTOMATION_DIR, 'config.yaml')) as f:
+        config = yaml.safe_load(f)
+    config = copy.deepcopy(config)
+    config['gcp']['project_id'] = 'fake-project'
+    config['deployment']['mode'] = 'source'
+    config['deployment']['readiness_timeout'] = 60
+    config['golden_image']['image'] = ''
+    config.setdefault('ssh', {})['transport'] = 'paramiko'
+    config.setdefault('loadtest', {})['gate'] = False
+    config['tracing'] = {'enabled': False}
+    zones = ['us-central1-a', 'us-central1-b', 'us-central1-c', 'us-central1-f']
+    config['fleet']['instances'] = [
+        {'name': f"bench-web-{i}", 'zone': zones[i % len(zones)]} for i in range(fleet_size)
+    ]
+    return config
+
+
+def run_deploy(cloud, config):
+    import deploy
+
+    with mock.patch.object(deploy, 'ReadinessProbe', cloud.probe_class()):
+        return deploy.GCPDeployment().deploy()
+
+
+def run_fleet(cloud, config):
+    import deploy
+    import fleet
+
+    with mock.patch.object(deploy, 'ReadinessProbe', cloud.probe_class()):
+        return fleet.FleetDeployment().deploy()
+
+
+def run_existing(cloud, config):
+    import deploy_to_existing
+
+    cloud.add_instance(config['instance']['name'], config['gcp']['zone'])
+    pool = FakeSSHPool(cloud, app=config['application']['name'])
+    with mock.patch.object(deploy_to_existing, 'SSHPool', pool.bind()):
+        return deploy_to_existing.deploy_to_existing()
+
+
+def run_rollback(cloud, config):
+    import update
+
+    cloud.add_instance(config['instance']['name'], config['gcp']['zone'])
+    pool = FakeSSHPool(cloud, app=config['application']['name'])
+    with mock.patch('ssh_pool.SSHPool', pool.bind()), \
+            mock.patch.object(update, 'ReadinessProbe', cloud.probe_class()):
+        return update.update_application(rollback=True)
+
+
+def run_group(cloud, config):
+    import instance_group
+
+    # The fake does not boot group instances: the load balancer counts as serving
+    with mock.patch.object(instance_group, 'ReadinessProbe'):
+        ok = instance_group.ManagedGroupDeployment().deploy()
+    settings = instance_group.group_settings(config)
+    check = cloud.resources['health_check'][f"{settings['group_name']}-http"]
+    service = cloud.resources['backend_service'][f"{settings['group_name']}-backend"]
+    return (ok and check.http_health_check.request_path == settings['health_check_path']
+            and abs(service.backends[0].max_utilization - settings['lb_utilization_target']) < 1e-3
+            and len(cloud.resources['instance_template']) == settings['keep_templates'])
+
+
+def seed_group(cloud, config):
+    """Earlier group deploys: three older templates, another health check path and utilization target"""
+    old = copy.deepcopy(config)
+    old['autoscaling'] = {**(old.get('autoscaling') or {}), 'health_check_path': '/healthz',
+                          'lb_utilization_target': 0.5, 'keep_templates': 10}
+    for machine_type in ('e2-small', 'e2-medium', 'e2-standard-2'):
+        old['instance']['machine_type'] = machine_type
+        install(cloud, old)
+        run_group(cloud, old)
+    install(cloud, config)
+
+
+def run_status(cloud, config):
+    import status
+
+    for member in config['fleet']['instances']:
+        cloud.add_instance(member['name'], member['zone'])
+    session = install(cloud, config)
+    with mock.patch.object(status, 'probe_once', cloud.probe_once):
+        rows = status.list_instances(session, status.tracked_names(config))
+        status.check_health(rows, config)
+    return len(rows) == len(config['fleet']['instances']) and all(
+        r['health'].get('nginx', {}).get('status') == 200 for r in rows)
+
+
+def run_destroy(cloud, config):
+    import destroy
+
+    cloud.add_instance(config['instance']['name'], config['gcp']['zone'])
+    for member in config['fleet']['instances']:
+        cloud.add_instance(member['name'], member['zone'])
+    firewalls = cloud.resources.setdefault('firewall', {})
+    for rule in config['firewall']:
+        name = f"{config['application']['name']}-{rule['name']}"
+        firewalls[name] = compute_v1.Firewall(name=name)
+    with mock.patch('builtins.input', return_value='DELETE'):
+        return destroy.destroy_resources() and not cloud.instances and not any(cloud.resources.values())
+
+
+RUNNERS = {
+    'deploy': run_deploy,
+    'fleet': run_fleet,
+    'redeploy': run_fleet,
+    'existing': run_existing,
+    'rollback': run_rollback,
+    'group': run_group,
+    'status': run_status,
+    'destroy': run_destroy,
+}
+
+# Untimed state a flow starts from: redeploy reruns the fleet deploy with nothing changed,
+# destroy tears down a deployed group and its load balancer as well
+SETUPS = {
+    'redeploy': run_fleet,
+    'group': seed_group,
+    'destroy': run_group,
+}
+
+
+def measure(flow, args, config):
+    """Run a flow args.runs times on fresh clouds; return timings and API call counts"""
+    times, calls, errors, failures = [], [], 0, 0
+    for run in range(args.runs):
+        cloud = FakeCloud(
+            api_latency=args.latency / 1000,
+            operation_seconds={'instance': args.instance_op, 'default': args.op},
+            boot_phase=args.boot_phase,
+            failure_rate=args.failure_rate,
+            rate_quota=args.rate_quota,
+            instance_quota=args.instance_quota,
+            seed=run,
+        )
+        install(cloud, config)
+        started = time.perf_counter()
+        try:
+            if flow in SETUPS:
+                SETUPS[flow](cloud, config)
+                cloud.calls.clear()
+                cloud.errors.clear()
+                started = time.perf_counter()
+            ok = RUNNERS[flow](cloud, config)
+        except SystemExit as e:
+            ok = e.code == 0
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"{flow}: {type(e).__name__}: {e}")
+            ok = False
+        times.append(time.perf_counter() - started)
+        calls.append(sum(n for name, n in cloud.calls.items() if name != 'http'))
+        errors += sum(cloud.errors.values())
+        failures += 0 if ok else 1
+    return times, calls, errors, failures
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--flows', nargs='+', choices=FLOWS, default=FLOWS)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=20.0, help='API round trip in ms')
+    parser.add_argument('--op', type=float, default=0.2, help='seconds until non-instance operations finish')
+    parser.add_argument('--instance-op', type=float, default=0.4, help='seconds until instance operations finish')
+    parser.add_argument('--boot-phase', type=float, default=0.05, help='seconds per startup script phase')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of API calls failing with 503')
+    parser.add_argument('--rate-quota', type=int, help='API calls per second before 429s')
+    parser.add_argument('--instance-quota', type=int, help='instances the project may hold')
+    parser.add_argument('--fleet-size', type=int, default=4)
+    parser.add_argument('--verbose', action='store_true', help='show the tooling log')
+    args = parser.parse_args()
+
+    os.chdir(AUTOMATION_DIR)
+    config = bench_config(args.fleet_size)
+    # Importing the flows configures logging; keep their output out of the table
+    import deploy, deploy_to_existing, destroy, fleet, instance_group, status, update  # noqa: E401,F401
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    print(f"latency {args.latency:.0f}ms, operations {args.op}s/{args.instance_op}s (instance), "
+          f"boot phase {args.boot_phase}s, failure rate {args.failure_rate:.0%}, {args.runs} run(s)\n")
+    print(f"{'FLOW':<10} {'MEDIAN':>8} {'MIN':>8} {'MAX':>8} {'API':>7} {'ERRORS':>7} {'FAILED':>7}")
+    for flow in args.flows:
+        times, calls, errors, failures = measure(flow, args, config)
+        print(f"{flow:<10} {statistics.median(times):>7.2f}s {min(times):>7.2f}s {max(times):>7.2f}s "
+              f"{statistics.median(calls):>7.0f} {errors:>7} {failures:>4}/{args.runs}")
+
+
+if __name__ == "__main__":
+    main()
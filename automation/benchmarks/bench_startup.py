@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Measure CLI startup cost: interpreter start plus each subcommand's imports
+
+Every sample runs in a fresh interpreter, so module caches do not hide the
+cost of heavy imports such as google.cloud.compute_v1.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+AUTOMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, AUTOMATION_DIR)
+
+from cli import COMMANDS  # noqa: E402
+
+
+def sample(code, runs):
+    """Median and minimum wall time of running code in a fresh interpreter"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=AUTOMATION_DIR, capture_output=True)
+        times.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            return None, result.stderr.decode(errors='replace').strip().splitlines()[-1]
+    return statistics.median(times), min(times)
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [('python (baseline)', 'pass'), ('cli.py --help', 'import cli; cli.build_parser().format_help()')]
+    rows += [(f"cli.py {name}", f"import {module}") for name, (module, _) in COMMANDS.items()]
+
+    print(f"{'target':<22} {'median':>9} {'min':>9}")
+    for label, code in rows:
+        median, best = sample(code, args.runs)
+        if median is None:
+            print(f"{label:<22} {'error':>9}  {best}")
+        else:
+            print(f"{label:<22} {median * 1000:>7.0f}ms {best * 1000:>7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Validate the generated Nginx site for each deployment mode with nginx -t
+
+The site is rendered from config.yaml for source, artifact and static mode,
+and with image variants or pre-compression switched off, then checked with
+nginx_config.validate(). Braces are checked to balance even without nginx.
+Exits 1 when nginx rejects a config, and 2 when nginx is not installed, so
+nothing was validated.
+
+    python benchmarks/check_nginx.py
+"""
+
+import os
+import sys
+import copy
+
+import yaml
+
+AUTOMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, AUTOMATION_DIR)
+
+from nginx_config import generate_site, validate  # noqa: E402
+
+# Variant name -> (deployment.mode, sections merged over config.yaml)
+VARIANTS = {
+    'source': ('source', {}),
+    'artifact': ('artifact', {}),
+    'static': ('static', {}),
+    'source, images off': ('source', {'images': {'enabled': False}}),
+    'static, images off': ('static', {'images': {'enabled': False}}),
+    'source, compression off': ('source', {'compression': {'enabled': False}}),
+}
+
+
+def variant_config(base, mode, sections):
+    """config.yaml in the given mode with sections overridden"""
+    config = copy.deepcopy(base)
+    config['deployment']['mode'] = mode
+    for name, values in sections.items():
+        config[name] = {**(config.get(name) or {}), **values}
+    return config
+
+
+def balanced(site):
+    """Check that every block opens and closes, ignoring comments"""
+    depth = 0
+    for line in site.splitlines():
+        line = line.split('#', 1)[0]
+        depth += line.count('{') - line.count('}')
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def main():
+    """Main entry point"""
+    with open(os.path.join(AUTOMATION_DIR, 'config.yaml')) as f:
+        base = yaml.safe_load(f)
+
+    failed = skipped = 0
+    for name, (mode, sections) in VARIANTS.items():
+        config = variant_config(base, mode, sections)
+        if not balanced(generate_site(config)):
+            print(f"FAIL  {name:<26} unbalanced braces")
+            failed += 1
+            continue
+
+        ok, output = validate(config)
+        if ok is None:
+            print(f"SKIP  {name:<26} {output}")
+            skipped += 1
+        elif ok:
+            print(f"PASS  {name:<26} nginx -t")
+        else:
+            print(f"FAIL  {name:<26} nginx -t")
+            print("\n".join(f"      {line}" for line in output.splitlines()))
+            failed += 1
+
+    sys.exit(1 if failed else 2 if skipped else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Check ReadinessProbe against local http.server stand-ins
+
+Each stand-in answers 503 until its ready time, then 200, over keep-alive
+HTTP/1.1, and counts the connections and requests it serves. The checks
+cover the 5xx to 200 transition, probing two endpoints concurrently,
+keep-alive reuse across polls, reconnecting when the server closes the
+connection, and the timeout. Exits non-zero when a check fails.
+
+    python benchmarks/check_readiness.py
+"""
+
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from readiness import Endpoint, ReadinessProbe, ReadinessTimeoutError  # noqa: E402
+
+
+class StandIn:
+    """HTTP server that turns healthy ready_after seconds after it starts"""
+
+    def __init__(self, ready_after, close_unready=False):
+        self.ready_at = time.monotonic() + ready_after
+        self.counts = {'connections': 0, 'requests': 0}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler(close_unready))
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def handler(self, close_unready):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                stand_in.count('connections')
+
+            def do_GET(self):
+                stand_in.count('requests')
+                ready = time.monotonic() >= stand_in.ready_at
+                body = b'ok' if ready else b'starting'
+                self.send_response(200 if ready else 503)
+                self.send_header('Content-Length', str(len(body)))
+                if close_unready and not ready:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    """Main entry point"""
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'PASS' if ok else 'FAIL'}  {name:<38} {detail}")
+        if not ok:
+            failures.append(name)
+
+    host = '127.0.0.1'
+
+    nginx, nextjs = StandIn(ready_after=0.6), StandIn(ready_after=1.0)
+    probe = ReadinessProbe(host, [Endpoint('nginx', nginx.port), Endpoint('nextjs', nextjs.port)],
+                           timeout=10, initial_interval=0.05, max_interval=0.2)
+    seconds = probe.wait()
+    check("503 until ready, then 200", 0.6 <= seconds['nginx'] < 1.0 and 1.0 <= seconds['nextjs'] < 1.5,
+          f"nginx {seconds['nginx']:.2f}s, nextjs {seconds['nextjs']:.2f}s")
+    check("polls reuse one keep-alive connection",
+          nginx.counts['connections'] == 1 and nginx.counts['requests'] > 2 and nextjs.counts['connections'] == 1,
+          f"nginx {nginx.counts['requests']} requests on {nginx.counts['connections']} connection(s), "
+          f"nextjs {nextjs.counts['requests']} on {nextjs.counts['connections']}")
+    nginx.close()
+    nextjs.close()
+
+    closing = StandIn(ready_after=0.5, close_unready=True)
+    probe = ReadinessProbe(host, [Endpoint('nginx', closing.port)], timeout=10, initial_interval=0.05, max_interval=0.2)
+    seconds = probe.wait()
+    check("reconnects when the server closes", closing.counts['connections'] > 1 and seconds['nginx'] >= 0.5,
+          f"{closing.counts['requests']} requests on {closing.counts['connections']} connections")
+    closing.close()
+
+    never = StandIn(ready_after=3600)
+    probe = ReadinessProbe(host, [Endpoint('nginx', never.port)], timeout=0.5, initial_interval=0.05, max_interval=0.2)
+    started = time.monotonic()
+    try:
+        probe.wait()
+        check("times out on a server that stays 5xx", False, "no error")
+    except ReadinessTimeoutError as e:
+        elapsed = time.monotonic() - started
+        check("times out on a server that stays 5xx", e.pending == ['nginx'] and elapsed < 1.0,
+              f"raised after {elapsed:.2f}s, pending {e.pending}")
+    never.close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Check SSHPool against a local paramiko stand-in server
+
+The stand-in accepts the pool's public key, runs exec requests with bash,
+streaming stdout and stderr back as the command writes them, and serves
+SFTP from a temporary directory. It counts the transports and channels it
+accepts. The checks cover transport reuse across concurrent commands,
+line streaming, stdin, exit status errors, SFTP uploads and reconnecting
+after the server drops the session. Exits non-zero when a check fails.
+
+    python benchmarks/check_ssh_pool.py
+"""
+
+import os
+import sys
+import time
+import socket
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ssh_pool import RemoteCommandError, SSHPool  # noqa: E402
+
+
+class StandInServer(paramiko.ServerInterface):
+    """Authenticates the client key and runs exec requests locally"""
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL if key == self.stand_in.client_key else paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind != 'session':
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        self.stand_in.count('channels')
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=execute, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+def execute(channel, command):
+    """Run a command with bash, relaying stdin, stdout and stderr as they flow"""
+    process = subprocess.Popen(['bash', '-c', command], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+
+    def feed():
+        for data in iter(lambda: channel.recv(32768), b''):
+            process.stdin.write(data)
+        process.stdin.close()
+
+    def relay(stream, send):
+        for data in iter(lambda: os.read(stream.fileno(), 32768), b''):
+            send(data)
+
+    threads = [threading.Thread(target=feed, daemon=True),
+               threading.Thread(target=relay, args=(process.stdout, channel.sendall), daemon=True),
+               threading.Thread(target=relay, args=(process.stderr, channel.sendall_stderr), daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads[1:]:
+        thread.join()
+    channel.send_exit_status(process.wait())
+    channel.close()
+
+
+class JailedSFTP(paramiko.SFTPServerInterface):
+    """SFTP confined to a local directory: enough for uploads"""
+
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self._local(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = paramiko.SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, 'r+b' if flags & (os.O_WRONLY | os.O_RDWR) else 'rb')
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+
+class StandIn:
+    """SSH server on a local port, one transport per accepted connection"""
+
+    def __init__(self, root):
+        self.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.client_key = paramiko.RSAKey.generate(2048)
+        self.counts = {'transports': 0, 'channels': 0}
+        self.transports = []
+        self._lock = threading.Lock()
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _accept(self):
+        while True:
+            sock, _ = self.listener.accept()
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, JailedSFTP, self.root)
+            transport.start_server(server=StandInServer(self))
+            self.count('transports')
+            self.transports.append(transport)
+
+    def drop(self):
+        """Close every session, as a rebooted instance would"""
+        for transport in self.transports:
+            transport.close()
+
+
+def main():
+    """Main entry point"""
+    # Dropping the sessions makes paramiko log the reset it expects
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    failures = []
+
+    def check(name, ok, detail=''):
+        print(f"{'PASS' if ok else 'FAIL'}  {name:<38} {detail}")
+        if not ok:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as root:
+        stand_in = StandIn(root)
+        key_file = os.path.join(root, 'id_rsa')
+        stand_in.client_key.write_private_key_file(key_file)
+        host = '127.0.0.1'
+
+        with SSHPool(username='deploy', key_filename=key_file, port=stand_in.port) as pool:
+            started = time.monotonic()
+            results = pool.run_many([(host, f"sleep 0.5; echo {i}") for i in range(4)], echo=False)
+            elapsed = time.monotonic() - started
+            check("concurrent commands share a transport",
+                  stand_in.counts['transports'] == 1 and [r[1] for r in results] == [b"0\n", b"1\n", b"2\n", b"3\n"],
+                  f"{stand_in.counts['transports']} transport, {stand_in.counts['channels']} channels")
+            check("channels run concurrently", elapsed < 1.5, f"4 x 0.5s in {elapsed:.2f}s")
+
+            arrivals = []
+            started = time.monotonic()
+            pool.run(host, "echo first; sleep 0.5; echo second", echo=False,
+                     on_line=lambda line: arrivals.append((time.monotonic() - started, line)))
+            finished = time.monotonic() - started
+            check("output streams line by line",
+                  [line for _, line in arrivals] == [b"first\n", b"second\n"] and finished - arrivals[0][0] > 0.4,
+                  f"first line at {arrivals[0][0]:.2f}s, command done at {finished:.2f}s" if arrivals else "no lines")
+
+            payload = os.urandom(1 << 20)
+            _, out, _ = pool.run(host, "sha256sum | cut -c1-64", stdin=payload, echo=False)
+            check("stdin reaches the command", out.strip().decode() == hashlib.sha256(payload).hexdigest(),
+                  "1 MiB")
+
+            try:
+                pool.run(host, "echo oops >&2; exit 3", echo=False)
+                check("non-zero exit raises", False, "no error")
+            except RemoteCommandError as e:
+                check("non-zero exit raises", e.exit_status == 3 and e.stderr.strip() == 'oops',
+                      f"exit {e.exit_status}, stderr {e.stderr.strip()!r}")
+
+            local = os.path.join(root, 'release.tar.gz')
+            with open(local, 'wb') as f:
+                f.write(os.urandom(3 << 20))
+            pool.put(host, local, '/uploaded.tar.gz')
+            with open(local, 'rb') as a, open(os.path.join(root, 'uploaded.tar.gz'), 'rb') as b:
+                same = a.read() == b.read()
+            check("SFTP upload on the same transport", same and stand_in.counts['transports'] == 1,
+                  f"3 MiB, {stand_in.counts['transports']} transport")
+
+            stand_in.drop()
+            time.sleep(0.2)
+            _, out, _ = pool.run(host, "echo back", echo=False)
+            check("reconnects after the session drops", out == b"back\n" and stand_in.counts['transports'] == 2,
+                  f"{stand_in.counts['transports']} transports")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
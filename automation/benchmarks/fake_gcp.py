@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+"""
+In-process fake of the Compute Engine APIs and SSH that the tooling uses
+
+FakeCloud keeps instances, firewall rules and other global or regional
+resources in memory. It serves them through stand-ins for the compute_v1
+clients, the operations clients and Session.compute_api. Every call pays an
+injected latency. Calls can fail with transient errors at a configured rate,
+and rate and instance quotas are enforced like the real API enforces them:
+429 for calls per second, a QUOTA_EXCEEDED operation error for instances.
+Deleting a resource that another one still links to (a health check used by
+a backend service, a URL map used by a proxy, ...) fails with a 400.
+
+An instance "boots" by running the phases of its startup script, one per
+boot_phase seconds. A phase running a step graph instead takes boot_phase per
+step along its critical path, with concurrent steps overlapping. The markers
+appear on the serial console, and its health endpoints answer once the last
+phase is done. FakeSSHPool plays remote scripts the same way, streaming the
+markers to on_line.
+
+FakeBucket stands in for a Cloud Storage bucket (listing, conditional
+uploads) with the same latency, faults and upload bandwidth.
+
+    cloud = FakeCloud(api_latency=0.02)
+    install(cloud, config)          # get_session() now returns the fake session
+"""
+
+import os
+import re
+import json
+import time
+import shlex
+import random
+import itertools
+import threading
+from pathlib import Path
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from google.api_core import exceptions
+from google.cloud import compute_v1
+
+import session as session_module
+
+PHASE_LINE = re.compile(r'^\s*phase "(.*)"', re.MULTILINE)
+STEP_NEEDS = re.compile(r'^STEP_NEEDS\[(\w+)\]="(.*)"$', re.MULTILINE)
+STEP_LABEL = re.compile(r"^STEP_LABEL\[(\w+)\]='(.*)'$", re.MULTILINE)
+
+
+def timeline(script, unit):
+    """(offset, marker line) pairs a script prints and its total run time, unit seconds per phase or step"""
+    phases = list(PHASE_LINE.finditer(script))
+    events, clock = [], 0.0
+    for index, match in enumerate(phases, 1):
+        events.append((clock, f"[{index}/{len(phases)}] {{at}} {match.group(1)}"))
+        body = script[match.end():phases[index].start() if index < len(phases) else len(script)]
+        labels = dict(STEP_LABEL.findall(body))
+        finished = {}
+        for name, needs in STEP_NEEDS.findall(body):
+            # Rendered in dependency order, so every need is already scheduled
+            start = max([finished[n] for n in needs.split()], default=clock)
+            finished[name] = start + unit
+            events.append((start, f"[step start] {{at}} {name} {labels.get(name, name)}"))
+            events.append((finished[name], f"[step done] {{at}} {name}"))
+        clock = max(finished.values(), default=clock + unit)
+    return sorted(events, key=lambda e: e[0]), clock
+
+# Client name -> (resource field prefix, scope); instances are handled separately
+RESOURCE_CLIENTS = {
+    'FirewallsClient': ('firewall', 'global'),
+    'ImagesClient': ('image', 'global'),
+    'InstanceTemplatesClient': ('instance_template', 'global'),
+    'HealthChecksClient': ('health_check', 'global'),
+    'BackendServicesClient': ('backend_service', 'global'),
+    'BackendBucketsClient': ('backend_bucket', 'global'),
+    'UrlMapsClient': ('url_map', 'global'),
+    'TargetHttpProxiesClient': ('target_http_proxy', 'global'),
+    'GlobalForwardingRulesClient': ('forwarding_rule', 'global'),
+    'RegionInstanceGroupManagersClient': ('instance_group_manager', 'region'),
+    'RegionAutoscalersClient': ('autoscaler', 'region'),
+}
+
+# Resource field prefix -> the links a resource of that kind holds; deleting a
+# resource that another one still links to fails, as it does in the real API
+REFERENCES = {
+    'backend_service': lambda r: [b.group for b in r.backends] + list(r.health_checks),
+    'url_map': lambda r: [r.default_service] + [link for m in r.path_matchers for link in
+                                                [m.default_service] + [rule.service for rule in m.path_rules]],
+    'target_http_proxy': lambda r: [r.url_map],
+    'forwarding_rule': lambda r: [r.target],
+    'instance_group_manager': lambda r: ([r.instance_template] + [v.instance_template for v in r.versions]
+                                         + [p.health_check for p in r.auto_healing_policies]),
+    'autoscaler': lambda r: [r.target],
+}
+
+OPERATION_CLIENTS = {
+    'ZoneOperationsClient': 'zone',
+    'RegionOperationsClient': 'region',
+    'GlobalOperationsClient': 'global',
+}
+
+
+def _copy(message):
+    """Independent copy of a compute_v1 message"""
+    return type(message).deserialize(type(message).serialize(message))
+
+
+def _assign(target, source):
+    """PATCH semantics: fields set in source replace those in target (lists included)"""
+    target_pb, source_pb = type(target).pb(target), type(source).pb(source)
+    for field, value in source_pb.ListFields():
+        target_pb.ClearField(field.name)
+        if hasattr(value, 'extend'):
+            getattr(target_pb, field.name).extend(value)
+        elif field.message_type is not None:
+            getattr(target_pb, field.name).CopyFrom(value)
+        else:
+            setattr(target_pb, field.name, value)
+
+
+class FakeOperation:
+    """A compute operation that finishes duration seconds after it starts"""
+
+    def __init__(self, name, scope, location, duration, on_done=None, error=None):
+        self.name = name
+        self.zone = f"zones/{location}" if scope == 'zone' else None
+        self.region = f"regions/{location}" if scope == 'region' else None
+        self.done_at = time.time() + duration
+        self.http_error_status_code = 0
+        self._on_done = on_done
+        self._error = error
+        self._lock = threading.Lock()
+
+    @property
+    def status(self):
+        if time.time() < self.done_at:
+            return 'RUNNING'
+        with self._lock:
+            if self._on_done:
+                on_done, self._on_done = self._on_done, None
+                on_done()
+        return 'DONE'
+
+    @property
+    def error(self):
+        if self.status != 'DONE' or not self._error:
+            return None
+        code, message = self._error
+        return compute_v1.Error(errors=[compute_v1.Errors(code=code, message=message)])
+
+
+class FakeCloud:
+    """Shared state and behavior behind every fake client"""
+
+    def __init__(self, project='fake-project', api_latency=0.02, jitter=0.5, operation_seconds=None,
+                 boot_phase=0.05, failure_rate=0.0, failing=None, rate_quota=None, instance_quota=None,
+                 upload_mbps=200.0, seed=0):
+        self.project = project
+        self.api_latency = api_latency
+        self.jitter = jitter
+        # Seconds until operations on each resource kind are DONE
+        self.operation_seconds = {'instance': 0.4, 'firewall': 0.15, 'default': 0.2, **(operation_seconds or {})}
+        self.boot_phase = boot_phase
+        self.failure_rate = failure_rate
+        # Only calls named here ("InstancesClient.insert", "ZoneOperationsClient.wait") fail; None = all
+        self.failing = set(failing) if failing else None
+        self.rate_quota = rate_quota
+        self.instance_quota = instance_quota
+        self.upload_mbps = upload_mbps
+        self.random = random.Random(seed)
+
+        self.instances = {}
+        self.resources = {}
+        self.operations = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self._recent = deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._clients = {}
+
+    # API plumbing
+
+    def call(self, name, faults=True):
+        """Account for one API call: latency, rate quota and injected failures"""
+        with self._lock:
+            self.calls[name] += 1
+            now = time.monotonic()
+            self._recent.append(now)
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            over_quota = faults and self.rate_quota is not None and len(self._recent) > self.rate_quota
+            fail = (faults and self.failure_rate and (self.failing is None or name in self.failing)
+                    and self.random.random() < self.failure_rate)
+            delay = self.api_latency * (1 + self.jitter * (self.random.random() - 0.5))
+
+        time.sleep(delay)
+        if over_quota:
+            self.errors['rate quota'] += 1
+            raise exceptions.TooManyRequests(f"Quota exceeded for quota metric 'Queries' ({name})")
+        if fail:
+            self.errors['injected'] += 1
+            raise exceptions.ServiceUnavailable(f"Injected failure in {name}")
+
+    def operation(self, kind, scope, location, on_done=None, error=None):
+        """Start an operation; on_done applies its effect when it finishes"""
+        name = f"operation-{next(self._ids)}-{kind}"
+        duration = self.operation_seconds.get(kind, self.operation_seconds['default'])
+        op = FakeOperation(name, scope, location, duration, on_done, error)
+        with self._lock:
+            self.operations[name] = op
+        return op
+
+    def client(self, name):
+        """Fake client by compute_v1 class name"""
+        with self._lock:
+            if name not in self._clients:
+                if name == 'InstancesClient':
+                    self._clients[name] = FakeInstancesClient(self)
+                elif name in OPERATION_CLIENTS:
+                    self._clients[name] = FakeOperationsClient(self, name)
+                elif name in RESOURCE_CLIENTS:
+                    self._clients[name] = FakeResourceClient(self, name, *RESOURCE_CLIENTS[name])
+                else:
+                    raise AttributeError(f"FakeCloud has no {name}")
+            return self._clients[name]
+
+    # Instances
+
+    def add_instance(self, name, zone, machine_type='e2-medium', status='RUNNING'):
+        """An instance that already exists and serves, as deploy_to_existing expects"""
+        resource = compute_v1.Instance(
+            name=name,
+            machine_type=f"zones/{zone}/machineTypes/{machine_type}",
+            network_interfaces=[compute_v1.NetworkInterface(access_configs=[compute_v1.AccessConfig()])],
+        )
+        ip = self._next_ip()
+        resource.network_interfaces[0].access_configs[0].nat_i_p = ip
+        with self._lock:
+            self.instances[name] = {'name': name, 'zone': zone, 'status': status, 'ip': ip, 'resource': resource,
+                                    'startup_script': '', 'phases': [], 'booted_at': time.time(),
+                                    'ready_at': time.time() if status == 'RUNNING' else float('inf')}
+
+    def _next_ip(self):
+        number = next(self._ids)
+        return f"10.{number // 250}.{number % 250 + 1}.1"
+
+    def instance(self, name):
+        with self._lock:
+            if name not in self.instances:
+                raise exceptions.NotFound(f"The resource 'instances/{name}' was not found")
+            return self.instances[name]
+
+    def instance_resource(self, record):
+        """compute_v1.Instance as the API returns it; stopped instances have no external IP"""
+        resource = _copy(record['resource'])
+        resource.status = record['status']
+        if record['status'] != 'RUNNING' and resource.network_interfaces:
+            resource.network_interfaces[0].access_configs[0].nat_i_p = ''
+        return resource
+
+    def by_ip(self, host):
+        with self._lock:
+            return next((i for i in self.instances.values() if i['ip'] == host), None)
+
+    def boot(self, record):
+        """Start running the startup script's phases from now"""
+        record['status'] = 'RUNNING'
+        record['booted_at'] = time.time()
+        record['phases'], duration = timeline(record['startup_script'], self.boot_phase)
+        record['ready_at'] = record['booted_at'] + duration
+
+    def serving(self, host):
+        """True once an instance's startup script (or a remote deploy) has finished"""
+        record = self.by_ip(host)
+        return bool(record and record['status'] == 'RUNNING' and time.time() >= record['ready_at'])
+
+    def serial_output(self, record):
+        """Serial console with the phase and step markers printed so far"""
+        lines = [f"{record['name']} google_metadata_script_runner: starting startup script"]
+        now = time.time()
+        for offset, marker in record['phases']:
+            at = record['booted_at'] + offset
+            if at > now:
+                return "\n".join(lines)
+            lines.append(f"startup-script: {marker.format(at=f'@{at:.6f}')}")
+        if record['ready_at'] <= now:
+            lines.append(f"startup-script: [done] @{record['ready_at']:.6f}")
+        return "\n".join(lines)
+
+    # HTTP stand-ins
+
+    def probe_once(self, host, endpoint, timeout=3.0):
+        """Answer a health probe from the instance's state (readiness.probe_once)"""
+        self.call('http', faults=False)
+        if self.serving(host):
+            return {'status': 200, 'ms': round(self.api_latency * 1000, 1), 'error': None}
+        return {'status': None, 'ms': None, 'error': 'ConnectionRefusedError'}
+
+    def probe_class(self):
+        """readiness.ReadinessProbe stand-in bound to this cloud"""
+        return make_probe_class(self)
+
+
+class FakeInstancesClient:
+    """compute_v1.InstancesClient stand-in"""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def insert(self, request=None, project=None, zone=None, instance_resource=None):
+        self.cloud.call('InstancesClient.insert')
+        zone = request.zone if request else zone
+        resource = _copy(request.instance_resource if request else instance_resource)
+        name = resource.name
+
+        with self.cloud._lock:
+            if name in self.cloud.instances:
+                raise exceptions.Conflict(f"The resource 'instances/{name}' already exists")
+            quota = self.cloud.instance_quota
+            if quota is not None and len(self.cloud.instances) >= quota:
+                return self.cloud.operation('instance', 'zone', zone, error=(
+                    'QUOTA_EXCEEDED', f"Quota 'INSTANCES' exceeded. Limit: {quota}.0 in region"))
+
+            ip = self.cloud._next_ip()
+            resource.status = 'PROVISIONING'
+            resource.metadata.fingerprint = f"fp-{next(self.cloud._ids)}"
+            if resource.network_interfaces and resource.network_interfaces[0].access_configs:
+                resource.network_interfaces[0].access_configs[0].nat_i_p = ip
+            metadata = {item.key: item.value for item in resource.metadata.items}
+            record = {'name': name, 'zone': zone, 'status': 'PROVISIONING', 'ip': ip, 'resource': resource,
+                      'startup_script': metadata.get('startup-script', ''), 'phases': [],
+                      'booted_at': None, 'ready_at': float('inf')}
+            self.cloud.instances[name] = record
+
+        return self.cloud.operation('instance', 'zone', zone, on_done=lambda: self.cloud.boot(record))
+
+    def get(self, request=None, project=None, zone=None, instance=None):
+        self.cloud.call('InstancesClient.get')
+        return self.cloud.instance_resource(self.cloud.instance(request.instance if request else instance))
+
+    def delete(self, request=None, project=None, zone=None, instance=None):
+        self.cloud.call('InstancesClient.delete')
+        name = request.instance if request else instance
+        record = self.cloud.instance(name)
+        record['status'] = 'STOPPING'
+
+        def remove():
+            with self.cloud._lock:
+                self.cloud.instances.pop(name, None)
+
+        return self.cloud.operation('instance', 'zone', record['zone'], on_done=remove)
+
+    def start(self, request=None, project=None, zone=None, instance=None):
+        self.cloud.call('InstancesClient.start')
+        record = self.cloud.instance(request.instance if request else instance)
+        record['status'] = 'STAGING'
+        return self.cloud.operation('instance', 'zone', record['zone'], on_done=lambda: self.cloud.boot(record))
+
+    def stop(self, request=None, project=None, zone=None, instance=None):
+        self.cloud.call('InstancesClient.stop')
+        record = self.cloud.instance(request.instance if request else instance)
+
+        def stopped():
+            record['status'] = 'TERMINATED'
+            record['ready_at'] = float('inf')
+
+        return self.cloud.operation('instance', 'zone', record['zone'], on_done=stopped)
+
+    def set_metadata(self, project=None, zone=None, instance=None, metadata_resource=None):
+        self.cloud.call('InstancesClient.set_metadata')
+        record = self.cloud.instance(instance)
+        with self.cloud._lock:
+            current = record['resource'].metadata
+            if metadata_resource.fingerprint != current.fingerprint:
+                raise exceptions.PreconditionFailed("Supplied fingerprint does not match current metadata fingerprint")
+            record['resource'].metadata = compute_v1.Metadata(
+                items=list(metadata_resource.items), fingerprint=f"fp-{next(self.cloud._ids)}")
+            items = {item.key: item.value for item in metadata_resource.items}
+            # Runs on the next boot
+            record['startup_script'] = items.get('startup-script', '')
+        return self.cloud.operation('metadata', 'zone', record['zone'])
+
+    def set_machine_type(self, project=None, zone=None, instance=None,
+                         instances_set_machine_type_request_resource=None):
+        self.cloud.call('InstancesClient.set_machine_type')
+        record = self.cloud.instance(instance)
+        if record['status'] != 'TERMINATED':
+            raise exceptions.BadRequest(f"The instance '{instance}' must be stopped to change its machine type")
+        machine_type = instances_set_machine_type_request_resource.machine_type
+
+        def resized():
+            record['resource'].machine_type = machine_type
+
+        return self.cloud.operation('metadata', 'zone', record['zone'], on_done=resized)
+
+    def get_serial_port_output(self, request=None, project=None, zone=None, instance=None):
+        self.cloud.call('InstancesClient.get_serial_port_output')
+        record = self.cloud.instance(request.instance if request else instance)
+        return compute_v1.SerialPortOutput(contents=self.cloud.serial_output(record))
+
+    def list(self, request=None, project=None, zone=None, **kwargs):
+        self.cloud.call('InstancesClient.list')
+        zone = request.zone if request else zone
+        with self.cloud._lock:
+            names = [n for n, r in self.cloud.instances.items() if r['zone'] == zone]
+        return [self.get(instance=n) for n in names]
+
+
+class FakeResourceClient:
+    """Stand-in for the global and regional resource clients (firewalls, templates, ...)"""
+
+    def __init__(self, cloud, client_name, field, scope):
+        self.cloud = cloud
+        self.client_name = client_name
+        self.field = field
+        self.scope = scope
+
+    def _arg(self, kwargs, key):
+        request = kwargs.get('request')
+        return getattr(request, key) if request is not None else kwargs.get(key)
+
+    def _store(self):
+        return self.cloud.resources.setdefault(self.field, {})
+
+    def _location(self, kwargs):
+        return self._arg(kwargs, 'region') if self.scope == 'region' else None
+
+    def _self_link(self, name, location):
+        where = f"regions/{location}" if self.scope == 'region' else 'global'
+        return f"https://www.googleapis.com/compute/v1/projects/{self.cloud.project}/{where}/{self.field}s/{name}"
+
+    def insert(self, **kwargs):
+        self.cloud.call(f"{self.client_name}.insert")
+        resource = _copy(self._arg(kwargs, f"{self.field}_resource"))
+        location = self._location(kwargs)
+        with self.cloud._lock:
+            if resource.name in self._store():
+                raise exceptions.Conflict(f"The resource '{self.field}s/{resource.name}' already exists")
+            resource.self_link = self._self_link(resource.name, location)
+            resource.creation_timestamp = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+            if self.field == 'instance_group_manager':
+                resource.instance_group = resource.self_link.replace('instanceGroupManagers', 'instanceGroups')
+            if self.field == 'forwarding_rule':
+                resource.I_p_address = f"34.120.0.{len(self._store()) + 1}"
+            # Visible once the operation is done
+            done = lambda: self._store().__setitem__(resource.name, resource)  # noqa: E731
+        return self.cloud.operation(self.field, self.scope, location, on_done=done)
+
+    def get(self, **kwargs):
+        self.cloud.call(f"{self.client_name}.get")
+        name = self._arg(kwargs, self.field)
+        with self.cloud._lock:
+            if name not in self._store():
+                raise exceptions.NotFound(f"The resource '{self.field}s/{name}' was not found")
+            return _copy(self._store()[name])
+
+    def list(self, **kwargs):
+        self.cloud.call(f"{self.client_name}.list")
+        with self.cloud._lock:
+            return [_copy(r) for r in self._store().values()]
+
+    def _user(self, resource):
+        """Name of a resource that links to this one, if any (caller holds the lock)"""
+        links = {resource.self_link}
+        if self.field == 'instance_group_manager':
+            links.add(resource.instance_group)
+        links.discard('')
+        for field, references in REFERENCES.items():
+            for other in self.cloud.resources.get(field, {}).values():
+                if other is not resource and links & set(references(other)):
+                    return f"{field}s/{other.name}"
+        return None
+
+    def delete(self, **kwargs):
+        self.cloud.call(f"{self.client_name}.delete")
+        name = self._arg(kwargs, self.field)
+        with self.cloud._lock:
+            if name not in self._store():
+                raise exceptions.NotFound(f"The resource '{self.field}s/{name}' was not found")
+            user = self._user(self._store()[name])
+            if user:
+                raise exceptions.BadRequest(f"The resource '{self.field}s/{name}' is already being used by '{user}'",
+                                            errors=[{'reason': 'resourceInUseByAnotherResource'}])
+        return self.cloud.operation(self.field, self.scope, self._location(kwargs),
+                                    on_done=lambda: self._store().pop(name, None))
+
+    def _merge(self, kwargs, method):
+        self.cloud.call(f"{self.client_name}.{method}")
+        patch = self._arg(kwargs, f"{self.field}_resource")
+        name = self._arg(kwargs, self.field) or patch.name
+        with self.cloud._lock:
+            if name not in self._store():
+                raise exceptions.NotFound(f"The resource '{self.field}s/{name}' was not found")
+            if method == 'patch':
+                _assign(self._store()[name], patch)
+            else:
+                updated = _copy(patch)
+                updated.self_link = self._store()[name].self_link
+                self._store()[name] = updated
+        return self.cloud.operation(self.field, self.scope, self._location(kwargs))
+
+    def patch(self, **kwargs):
+        return self._merge(kwargs, 'patch')
+
+    def update(self, **kwargs):
+        return self._merge(kwargs, 'update')
+
+
+class FakeOperationsClient:
+    """Zone, region and global operations clients"""
+
+    def __init__(self, cloud, client_name):
+        self.cloud = cloud
+        self.client_name = client_name
+
+    def _lookup(self, operation):
+        with self.cloud._lock:
+            if operation not in self.cloud.operations:
+                raise exceptions.NotFound(f"The resource 'operations/{operation}' was not found")
+            return self.cloud.operations[operation]
+
+    def get(self, project=None, operation=None, **kwargs):
+        self.cloud.call(f"{self.client_name}.get")
+        return self._lookup(operation)
+
+    def wait(self, project=None, operation=None, timeout=None, **kwargs):
+        """Block until the operation is done or the server-side wait expires"""
+        self.cloud.call(f"{self.client_name}.wait")
+        op = self._lookup(operation)
+        remaining = op.done_at - time.time()
+        if remaining > 0:
+            time.sleep(min(remaining, timeout or remaining))
+        return op
+
+
+class FakeSession(session_module.Session):
+    """Session whose clients and REST calls are served by a FakeCloud"""
+
+    def __init__(self, cloud, config, config_path='config.yaml'):
+        super().__init__(config_path)
+        self.cloud = cloud
+        self._config = config
+
+    def credentials(self):
+        return None
+
+    def access_token(self, force_refresh=False):
+        return 'fake-token'
+
+    def client(self, name):
+        return self.cloud.client(name)
+
+    def compute_api(self, path, method='GET', body=None, timeout=30):
+        """The REST paths status.py and update.py read"""
+        self.cloud.call(f"compute_api {method}")
+        path = path.split('compute/v1/')[-1].lstrip('/')
+        route, _, query = path.partition('?')
+
+        if route.endswith('/aggregated/instances'):
+            wanted = set(re.findall(r'name%20%3D%20%22([^%]+)%22', query))
+            items = {}
+            with self.cloud._lock:
+                records = list(self.cloud.instances.values())
+            for record in records:
+                if wanted and record['name'] not in wanted:
+                    continue
+                items.setdefault(f"zones/{record['zone']}", {'instances': []})['instances'].append(
+                    self._instance_json(record))
+            return {'items': items}
+
+        match = re.search(r'/zones/([^/]+)/instances/([^/]+)$', route)
+        if match:
+            try:
+                return self._instance_json(self.cloud.instance(match.group(2)))
+            except exceptions.NotFound as e:
+                raise session_module.ApiError(404, str(e), path) from None
+        raise session_module.ApiError(404, f"FakeSession does not serve {route}", path)
+
+    def _instance_json(self, record):
+        return json.loads(compute_v1.Instance.to_json(self.cloud.instance_resource(record)))
+
+
+def install(cloud, config, config_path='config.yaml'):
+    """Make get_session(config_path) return a FakeSession on cloud"""
+    fake = FakeSession(cloud, config, config_path)
+    with session_module._sessions_lock:
+        session_module._sessions[os.path.abspath(config_path)] = fake
+    return fake
+
+
+class FakeBlob:
+    """storage.Blob stand-in: uploads pay latency and bandwidth"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+        self.content_encoding = None
+        self.content_type = None
+        self.size = None
+
+    def upload_from_filename(self, filename, content_type=None, if_generation_match=None):
+        self.bucket.cloud.call('storage.objects.insert')
+        data = Path(filename).read_bytes()
+        time.sleep(len(data) / (self.bucket.cloud.upload_mbps * 125_000))
+        with self.bucket.lock:
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise exceptions.PreconditionFailed(f"{self.name} already exists")
+            self.content_type = content_type
+            self.size = len(data)
+            self.bucket.objects[self.name] = self
+
+
+class FakeBucket:
+    """storage.Bucket stand-in holding objects in memory"""
+
+    def __init__(self, cloud, name='fake-assets'):
+        self.cloud = cloud
+        self.name = name
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=''):
+        with self.lock:
+            blobs = [blob for name, blob in sorted(self.objects.items()) if name.startswith(prefix)]
+        # One request per page of 1000 objects
+        for _ in range(len(blobs) // 1000 + 1):
+            self.cloud.call('storage.objects.list')
+        return blobs
+
+
+def make_probe_class(cloud):
+    """ReadinessProbe stand-in that polls the cloud instead of the network"""
+    from readiness import ReadinessTimeoutError
+
+    class FakeProbe:
+        def __init__(self, host, endpoints, timeout=900, initial_interval=0.02, **kwargs):
+            self.host = host
+            self.endpoints = endpoints
+            self.timeout = timeout
+            self.interval = initial_interval
+
+        def wait(self):
+            started = time.monotonic()
+            while not cloud.serving(self.host):
+                if time.monotonic() - started > self.timeout:
+                    raise ReadinessTimeoutError(self.host, [e.name for e in self.endpoints], self.timeout)
+                cloud.call('http', faults=False)
+                time.sleep(self.interval)
+            elapsed = time.monotonic() - started
+            return {e.name: elapsed for e in self.endpoints}
+
+    return FakeProbe
+
+
+# Commands that write to a path; a bare path argument under ROOT_OWNED needs sudo
+WRITES = re.compile(r'^(?:tee|mkdir|rm|find|ln|mv|cp|chown|chmod)\b')
+ROOT_OWNED = ('/etc/', '/var/cache/nginx/', '/opt/{app}/ecosystem.config.js')
+
+
+def unprivileged_writes(script, app):
+    """Script lines that write root-owned paths without sudo, as the instance user cannot"""
+    owned = [path.format(app=app) for path in ROOT_OWNED]
+    lines = []
+    for line in script.splitlines():
+        command = line.strip()
+        if WRITES.match(command) and any(path in command for path in owned):
+            if command.startswith('find') and '-delete' not in command:
+                continue
+            lines.append(command)
+    return lines
+
+
+class FakeSSHPool:
+    """ssh_pool.SSHPool stand-in: uploads cost bandwidth, scripts play their phases
+
+    Scripts that write root-owned paths (Nginx config and cache, the PM2
+    ecosystem file) without sudo fail, as they do for the login user.
+    """
+
+    def __init__(self, cloud, phase_seconds=0.03, connect_seconds=0.05, app='aathira-trendz'):
+        self.cloud = cloud
+        self.app = app
+        self.phase_seconds = phase_seconds
+        self.connect_seconds = connect_seconds
+        self.uploads = {}
+        self.connected = set()
+        self.commands = []
+
+    def bind(self):
+        """Object with from_config, to stand in for the SSHPool class"""
+        pool = self
+
+        class Factory:
+            @classmethod
+            def from_config(cls, config):
+                return pool
+
+        return Factory
+
+    def _connect(self, host):
+        if host not in self.connected:
+            time.sleep(self.connect_seconds)
+            self.connected.add(host)
+
+    def put(self, host, local_path, remote_path):
+        self._connect(host)
+        data = Path(local_path).read_bytes()
+        time.sleep(len(data) / (self.cloud.upload_mbps * 125_000))
+        self.uploads[remote_path] = data
+
+    def _script(self, host, command):
+        """Script text behind `bash <file>`, `bash -c '<script>'` or a startup script rerun"""
+        args = shlex.split(command)
+        if args[-2:] == ['google_metadata_script_runner', 'startup']:
+            record = self.cloud.by_ip(host)
+            return record['startup_script'] if record else ''
+
+        if args[:2] == ['bash', '-c']:
+            return args[2]
+        if args[0] == 'bash' and args[1] in self.uploads:
+            return self.uploads[args[1]].decode()
+        return ''
+
+    def run(self, host, command, stdin=None, echo=True, check=True, timeout=None, on_line=None):
+        self._connect(host)
+        self.commands.append(command)
+        script = self._script(host, command)
+        # `sudo <runner>` runs the whole script as root
+        denied = [] if command.startswith('sudo ') else unprivileged_writes(script, self.app)
+        if denied:
+            from ssh_pool import RemoteCommandError
+
+            stderr = "".join(f"Permission denied: {line}\n" for line in denied)
+            if check:
+                raise RemoteCommandError(host, command, 1, stderr)
+            return 1, b'', stderr.encode()
+        phases, duration = timeline(script, self.phase_seconds)
+        out = []
+
+        started = time.time()
+        for offset, marker in phases + [(duration, None)]:
+            time.sleep(max(0.0, started + offset - time.time()))
+            if marker is None:
+                break
+            line = f"{marker.format(at=f'@{time.time():.6f}')}\n".encode()
+            out.append(line)
+            if on_line:
+                on_line(line)
+        if 'phase_done' in script:
+            line = f"[done] @{time.time():.6f}\n".encode()
+            out.append(line)
+            if on_line:
+                on_line(line)
+
+        # A deployed instance serves from now on
+        record = self.cloud.by_ip(host)
+        if record and phases:
+            record['ready_at'] = min(record['ready_at'], time.time())
+        return 0, b''.join(out), b''
+
+    def close(self):
+        self.connected.clear()
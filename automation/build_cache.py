@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Next.js build cache on the instance, kept outside the working tree
+
+    /var/cache/<app>/next/cache        .next/cache, moved in before a build and out after
+    /var/cache/<app>/next/output       copy of the last successful .next (without cache)
+    /var/cache/<app>/next/last-build   build key of that output
+
+The build key hashes the git tree ids of the build inputs, so when none of
+them changed since the last successful build the previous output is reused
+and `npm run build` is skipped. Every run prints one `BUILD_CACHE` line.
+"""
+
+DEFAULT_INPUTS = [
+    'app', 'components', 'public',
+    'next.config.ts', 'image-loader.ts', 'package.json', 'package-lock.json', 'tsconfig.json', 'postcss.config.mjs',
+]
+
+
+def cache_dir(config):
+    """Directory on the instance holding the build cache"""
+    return f"/var/cache/{config['application']['name']}/next"
+
+
+def build_script(config, app_dir='.', git_dir=None, rev='HEAD', sudo=''):
+    """Shell steps that build app_dir, or reuse the last output when its inputs are unchanged
+
+    git_dir/rev name the commit app_dir was exported from; by default app_dir is
+    itself a checkout.
+    """
+    cache = config.get('build_cache', {})
+    if not cache.get('enabled', True):
+        return f"cd {app_dir}\nnpm run build\n"
+
+    store = cache_dir(config)
+    inputs = " ".join(cache.get('inputs', DEFAULT_INPUTS))
+    git = f"git -C {git_dir or app_dir}"
+
+    return f"""# Build key: git tree ids of the build inputs plus the Node version
+cd {app_dir}
+{sudo}mkdir -p {store}
+{sudo}chown $(id -un):$(id -gn) {store}
+BUILD_KEY=$( ({git} ls-tree {rev} -- {inputs}; node --version) | sha256sum | cut -c1-16)
+BUILD_START=$(date +%s)
+if [ -f {store}/output/BUILD_ID ] && [ "$(cat {store}/last-build 2>/dev/null)" = "$BUILD_KEY" ]; then
+    if ! cmp -s .next/BUILD_ID {store}/output/BUILD_ID; then
+        rm -rf .next
+        cp -a {store}/output .next
+    fi
+    echo "BUILD_CACHE hit $BUILD_KEY took=$(( $(date +%s) - BUILD_START ))s (build skipped)"
+else
+    # Restore the incremental cache, build, then move the cache back out
+    rm -f {store}/last-build
+    mkdir -p .next
+    if [ -d {store}/cache ]; then
+        rm -rf .next/cache
+        mv -T {store}/cache .next/cache
+    fi
+    BUILD_STATUS=0
+    npm run build || BUILD_STATUS=$?
+    if [ -d .next/cache ]; then
+        mv -T .next/cache {store}/cache
+    fi
+    [ $BUILD_STATUS -eq 0 ] || exit $BUILD_STATUS
+
+    # Keep a copy of the output for the next unchanged deploy
+    rm -rf {store}/output.tmp
+    cp -a .next {store}/output.tmp
+    rm -rf {store}/output
+    mv -T {store}/output.tmp {store}/output
+    echo "$BUILD_KEY" > {store}/last-build
+    echo "BUILD_CACHE miss $BUILD_KEY took=$(( $(date +%s) - BUILD_START ))s"
+fi
+"""
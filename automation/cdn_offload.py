@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Offload hashed build assets and images to a bucket fronted by Cloud CDN
+
+With cdn.enabled (artifact and static releases), the release build points
+Next.js at the bucket: `assetPrefix` moves every /_next/static URL there, and
+the custom image loader (image-loader.ts) resolves public/images to objects
+keyed by content hash, pre-rendered variants first. The instances then only
+serve HTML. Objects are laid out under cdn.prefix as
+
+    _next/static/...                         names Next.js already hashes
+    images/<sha256[:16]>/<name>              originals
+    image-variants/<sha256[:16]>/<w>-<q>.<fmt>
+
+so an object that exists never changes: the bucket is listed once and only
+missing objects are uploaded, in parallel, with immutable cache headers. Text
+assets go up gzip-encoded when precompress.py wrote a .gz sibling.
+
+Cloud CDN fronting needs a load balancer, so only instance_group.py creates
+the backend bucket, when it routes /<prefix>/* on its URL map. Single VMs and
+fleets load assets from cdn.base_url, by default the bucket itself.
+
+    python cdn_offload.py     # create the bucket
+"""
+
+import json
+import logging
+import mimetypes
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from image_variants import VARIANTS_DIR, file_digest, image_settings
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+DEFAULTS = {
+    'enabled': False,
+    'bucket': '',
+    'prefix': 'assets',
+    'base_url': '',
+    'workers': 16,
+    'endpoint': '',
+}
+
+
+def cdn_settings(config):
+    """The cdn section merged over the defaults"""
+    return {**DEFAULTS, **(config.get('cdn') or {})}
+
+
+def offload_enabled(config):
+    """Assets are offloaded only for releases built here, not on the instance"""
+    # artifact imports this module for the release build
+    from artifact import artifact_mode
+
+    settings = cdn_settings(config)
+    if not settings['enabled']:
+        return False
+    if not settings['bucket']:
+        raise ValueError("cdn.enabled needs cdn.bucket")
+    if not artifact_mode(config):
+        logger.warning("cdn.enabled only applies to deployment.mode artifact or static; serving assets from the VM")
+        return False
+    return True
+
+
+def asset_base(config):
+    """URL prefix browsers load offloaded assets from"""
+    settings = cdn_settings(config)
+    prefix = settings['prefix'].strip('/')
+    return (settings['base_url'] or f"https://storage.googleapis.com/{settings['bucket']}/{prefix}").rstrip('/')
+
+
+def log_asset_source(config):
+    """Say where a single VM or fleet loads offloaded assets from: there is no CDN in front of them"""
+    if offload_enabled(config):
+        logger.info(f"Assets load from {asset_base(config)}; Cloud CDN fronting only applies to "
+                    f"instance_group.py deploys")
+
+
+def image_manifest(config, repo_root):
+    """What image-loader.ts needs to build variant URLs: rendered sizes, format and image hashes"""
+    settings = image_settings(config)
+    images_dir = Path(repo_root) / 'public' / 'images'
+    images = {}
+    if images_dir.exists():
+        images = {p.name: file_digest(p)[:16] for p in sorted(images_dir.iterdir()) if p.is_file()}
+
+    # A bucket cannot negotiate on Accept, so offloaded variants are WebP only
+    rendered = settings['enabled'] and 'webp' in settings['formats']
+    return {
+        'widths': settings['widths'] if rendered else [],
+        'qualities': settings['qualities'] if rendered else [],
+        'format': 'webp' if rendered else None,
+        'images': images,
+    }
+
+
+def build_env(config, repo_root):
+    """Environment for `next build` that points asset URLs at the bucket"""
+    return {
+        'NEXT_PUBLIC_ASSET_BASE': asset_base(config),
+        'NEXT_PUBLIC_IMAGE_MANIFEST': json.dumps(image_manifest(config, repo_root), separators=(',', ':')),
+    }
+
+
+def release_objects(staging, static):
+    """(object name under the prefix, local file) for every offloaded file of a staged release"""
+    staging = Path(staging)
+    static_dir = staging / '_next' / 'static' if static else staging / '.next' / 'static'
+    public = staging if static else staging / 'public'
+
+    if static_dir.exists():
+        for path in sorted(static_dir.rglob('*')):
+            if path.is_file() and path.suffix not in ('.gz', '.br'):
+                yield f"_next/static/{path.relative_to(static_dir).as_posix()}", path
+
+    images_dir = public / 'images'
+    if images_dir.exists():
+        for path in sorted(images_dir.iterdir()):
+            if path.is_file() and path.suffix not in ('.gz', '.br'):
+                yield f"images/{file_digest(path)[:16]}/{path.name}", path
+
+    variants = staging / VARIANTS_DIR
+    manifest = variants / 'manifest.json'
+    if manifest.exists():
+        for name, digest in json.loads(manifest.read_text()).items():
+            for path in sorted((variants / name).iterdir()):
+                yield f"image-variants/{digest[:16]}/{path.name}", path
+
+
+def upload_object(bucket, name, path):
+    """Upload one file unless an object of that name appeared meanwhile; return bytes sent"""
+    from google.api_core.exceptions import PreconditionFailed
+
+    blob = bucket.blob(name)
+    blob.cache_control = IMMUTABLE
+    content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    gz = path.with_name(f"{path.name}.gz")
+    if gz.exists():
+        # Served decompressed to clients that do not accept gzip
+        blob.content_encoding = 'gzip'
+        path = gz
+    try:
+        blob.upload_from_filename(str(path), content_type=content_type, if_generation_match=0)
+    except PreconditionFailed:
+        return 0
+    return path.stat().st_size
+
+
+def upload(bucket, prefix, objects, workers=DEFAULTS['workers']):
+    """Upload the objects the bucket does not have yet; return run stats"""
+    prefix = prefix.strip('/')
+    objects = {f"{prefix}/{name}": path for name, path in objects}
+    # Names are content-addressed, so one listing tells what is already there
+    present = {blob.name for blob in bucket.list_blobs(prefix=f"{prefix}/")}
+    missing = {name: path for name, path in objects.items() if name not in present}
+
+    sent = 0
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            sent = sum(pool.map(lambda item: upload_object(bucket, *item), missing.items()))
+    return {'objects': len(objects), 'present': len(objects) - len(missing),
+            'uploaded': len(missing), 'bytes': sent}
+
+
+def storage_client(config, credentials=None):
+    """Cloud Storage client, or one for the GCS-compatible stand-in at cdn.endpoint"""
+    from google.cloud import storage
+
+    endpoint = cdn_settings(config)['endpoint']
+    if endpoint:
+        from google.auth.credentials import AnonymousCredentials
+
+        return storage.Client(project=config['gcp']['project_id'], credentials=AnonymousCredentials(),
+                              client_options={'api_endpoint': endpoint})
+    if credentials is None:
+        from session import get_session
+
+        credentials = get_session().credentials()
+    return storage.Client(project=config['gcp']['project_id'], credentials=credentials)
+
+
+def offload_release(config, staging, static, bucket=None):
+    """Upload a staged release's assets; the release itself keeps them as a fallback"""
+    settings = cdn_settings(config)
+    bucket = bucket or storage_client(config).bucket(settings['bucket'])
+    stats = upload(bucket, settings['prefix'], release_objects(staging, static), settings['workers'])
+    logger.info(f"✓ Offloaded assets to gs://{settings['bucket']}/{settings['prefix'].strip('/')}: "
+                f"{stats['uploaded']} uploaded ({stats['bytes'] / (1024 * 1024):.1f} MB), "
+                f"{stats['present']} already there")
+    return stats
+
+
+def ensure_bucket(config, client):
+    """Create the asset bucket with public read access if it does not exist"""
+    from google.cloud.exceptions import NotFound
+
+    settings = cdn_settings(config)
+    try:
+        return client.get_bucket(settings['bucket'])
+    except NotFound:
+        pass
+
+    bucket = client.bucket(settings['bucket'])
+    bucket.iam_configuration.uniform_bucket_level_access_enabled = True
+    bucket = client.create_bucket(bucket, location=config['gcp']['region'])
+    policy = bucket.get_iam_policy(requested_policy_version=3)
+    policy.bindings.append({'role': 'roles/storage.objectViewer', 'members': {'allUsers'}})
+    bucket.set_iam_policy(policy)
+    logger.info(f"Bucket gs://{bucket.name} created with public read access")
+    return bucket
+
+
+def backend_bucket_name(config):
+    return f"{config['application']['name']}-assets"
+
+
+def ensure_backend_bucket(session, waiter):
+    """Cloud CDN backend bucket for the asset bucket; return it"""
+    from google.cloud import compute_v1
+
+    config = session.config
+    project_id = config['gcp']['project_id']
+    client = session.client('BackendBucketsClient')
+
+    backend = compute_v1.BackendBucket()
+    backend.name = backend_bucket_name(config)
+    backend.bucket_name = cdn_settings(config)['bucket']
+    backend.enable_cdn = True
+    # Objects carry immutable max-age headers; the CDN keeps them as long
+    backend.cdn_policy = compute_v1.BackendBucketCdnPolicy(cache_mode="CACHE_ALL_STATIC")
+
+    description = f"Backend bucket {backend.name}"
+    try:
+        waiter.wait(waiter.call(lambda: client.insert(project=project_id, backend_bucket_resource=backend),
+                                description), description=description)
+        logger.info(f"Backend bucket {backend.name} created with Cloud CDN")
+    except Exception as e:
+        if getattr(e, 'code', None) != 409:
+            raise
+        logger.info(f"Backend bucket {backend.name} already exists")
+    return waiter.call(lambda: client.get(project=project_id, backend_bucket=backend.name), description)
+
+
+def main():
+    """Main entry point"""
+    from session import get_session
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = get_session().config
+    if not cdn_settings(config)['bucket']:
+        logger.error("Set cdn.bucket in config.yaml first")
+        raise SystemExit(1)
+
+    ensure_bucket(config, storage_client(config))
+    # A backend bucket without a URL map routing to it would serve nothing
+    logger.info(f"Assets will be served from {asset_base(config)}")
+    logger.info("instance_group.py creates the Cloud CDN backend bucket and routes its load balancer to it")
+
+
+if __name__ == "__main__":
+    main()
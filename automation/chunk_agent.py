@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Remote side of the delta transfer: a content-addressed chunk store
+
+Runs on the instance with the system python3 (standard library only):
+
+    chunk_agent.py missing <store>          chunk ids on stdin -> ids not in the store
+    chunk_agent.py store <store>            framed, compressed chunks on stdin
+    chunk_agent.py assemble <store> <dest>  release manifest (JSON) on stdin
+"""
+
+import os
+import sys
+import json
+import zlib
+import shutil
+import hashlib
+
+
+def chunk_path(store, chunk_id):
+    """Chunks are fanned out by the first two hex digits of their id"""
+    return os.path.join(store, chunk_id[:2], chunk_id)
+
+
+def missing(store):
+    """Print the ids read from stdin that are not in the store"""
+    for line in sys.stdin:
+        chunk_id = line.strip()
+        if chunk_id and not os.path.exists(chunk_path(store, chunk_id)):
+            sys.stdout.write(chunk_id + "\n")
+
+
+def store_chunks(store):
+    """Read '<id> <length>' frames of zlib data from stdin into the store"""
+    stream = sys.stdin.buffer
+    count = 0
+
+    while True:
+        header = stream.readline()
+        if not header:
+            break
+        chunk_id, length = header.decode().split()
+        data = zlib.decompress(stream.read(int(length)))
+
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            sys.exit(f"chunk {chunk_id} failed verification")
+
+        path = chunk_path(store, chunk_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        count += 1
+
+    sys.stdout.write(f"{count}\n")
+
+
+def complete(store, dest, manifest):
+    """Whether dest already holds every file of the manifest, at its size"""
+    for entry in manifest["files"]:
+        path = os.path.join(dest, entry["path"])
+        size = sum(os.path.getsize(chunk_path(store, chunk_id)) for chunk_id in entry["chunks"])
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+    return True
+
+
+def assemble(store, dest):
+    """Rebuild a release tree from the manifest on stdin"""
+    manifest = json.load(sys.stdin)
+
+    # Release ids are content hashes: an existing release is this one, and may be live
+    if os.path.isdir(dest) and complete(store, dest, manifest):
+        sys.stdout.write("present\n")
+        return
+
+    staging = dest + ".partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for directory in manifest["dirs"]:
+        os.makedirs(os.path.join(staging, directory), exist_ok=True)
+
+    for entry in manifest["files"]:
+        path = os.path.join(staging, entry["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            for chunk_id in entry["chunks"]:
+                with open(chunk_path(store, chunk_id), "rb") as chunk:
+                    shutil.copyfileobj(chunk, out)
+        os.chmod(path, entry["mode"])
+
+    for link in manifest["symlinks"]:
+        path = os.path.join(staging, link["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.symlink(link["target"], path)
+
+    # An incomplete tree left by an interrupted unpack is moved aside before it is removed
+    if os.path.isdir(dest):
+        stale = dest + ".stale"
+        shutil.rmtree(stale, ignore_errors=True)
+        os.replace(dest, stale)
+        os.replace(staging, dest)
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.replace(staging, dest)
+
+
+def main():
+    command, store = sys.argv[1], sys.argv[2]
+    os.makedirs(store, exist_ok=True)
+
+    if command == "missing":
+        missing(store)
+    elif command == "store":
+        store_chunks(store)
+    elif command == "assemble":
+        assemble(store, sys.argv[3])
+    else:
+        sys.exit(f"unknown command: {command}")
+
+
+if __name__ == "__main__":
+    main()
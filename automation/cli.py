@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the Aathira Trendz deployment tooling
+
+Subcommand modules are imported only when their command runs, so cheap
+commands like status never load the Compute client libraries.
+
+    python cli.py status
+    python cli.py deploy
+    python cli.py bake --force
+"""
+
+import os
+import sys
+import argparse
+import importlib
+from pathlib import Path
+
+# command -> (module, description)
+COMMANDS = {
+    'deploy': ('deploy', 'Create firewall rules and a new instance, then wait until it serves'),
+    'fleet': ('fleet', 'Deploy every instance listed under fleet.instances'),
+    'group': ('instance_group', 'Deploy an autoscaled instance group behind a load balancer'),
+    'existing': ('deploy_to_existing', 'Deploy the app to the existing instance'),
+    'plan': ('reconcile', 'Show (or --apply) the changes config.yaml needs'),
+    'status': ('status', 'Show instance status and URLs'),
+    'update': ('update', 'Update the deployed application'),
+    'destroy': ('destroy', 'Delete the instances, firewall rules and group resources'),
+    'verify': ('verify_permissions', 'Verify service account permissions'),
+    'bake': ('image_bake', 'Bake the golden image'),
+    'release': ('artifact', 'Build and package a release tarball'),
+    'cdn': ('cdn_offload', 'Create the asset bucket'),
+    'nginx': ('nginx_config', 'Print or validate the generated Nginx site'),
+    'pm2': ('pm2_config', 'Show the PM2 worker plan and ecosystem file'),
+    'steps': ('provision', 'Show the provisioning step graph'),
+    'loadtest': ('loadtest', 'Load test the instance and compare with the baseline'),
+    'trace': ('tracing', 'List deploy traces and compare phase timings'),
+}
+
+
+def build_parser():
+    """Top-level parser; subcommand arguments are left to the subcommand"""
+    parser = argparse.ArgumentParser(
+        prog='cli.py',
+        description='Aathira Trendz deployment tooling',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<10} {desc}" for name, (_, desc) in COMMANDS.items())
+    )
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    """Main entry point"""
+    args = build_parser().parse_args(argv)
+
+    # Every script resolves config.yaml relative to this directory
+    script_dir = Path(__file__).resolve().parent
+    os.chdir(script_dir)
+    sys.path.insert(0, str(script_dir))
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    sys.argv = [f"cli.py {args.command}"] + args.args
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Content-addressed delta transfer of release trees to instances
+
+Release files are split into chunks named by their SHA-256. The instance
+keeps a chunk store across releases, so only chunks it has never seen are
+compressed and sent; the release directory is then assembled remotely.
+"""
+
+import sys
+import json
+import time
+import zlib
+import base64
+import shlex
+import hashlib
+import logging
+import tarfile
+import threading
+import subprocess
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+AGENT_PATH = Path(__file__).resolve().parent / 'chunk_agent.py'
+
+
+class GcloudRemote:
+    """Runs commands on an instance through gcloud compute ssh"""
+
+    def __init__(self, instance_name, project_id, zone):
+        self.instance_name = instance_name
+        self.project_id = project_id
+        self.zone = zone
+
+    def run(self, command, stdin=b'', timeout=600, echo=False, on_line=None):
+        """Run a command remotely, feeding stdin; return its stdout (nothing when echoed live)
+
+        on_line, if given, is called with each stdout line as it arrives.
+        """
+        cmd = [
+            'gcloud', 'compute', 'ssh',
+            self.instance_name,
+            f'--project={self.project_id}',
+            f'--zone={self.zone}',
+            '--command', command
+        ]
+        if on_line:
+            return self._stream(cmd, stdin, timeout, echo, on_line)
+        if echo:
+            result = subprocess.run(cmd, input=stdin, timeout=timeout)
+            if result.returncode != 0:
+                raise RuntimeError(f"Remote command exited with {result.returncode}")
+            return b''
+
+        result = subprocess.run(cmd, input=stdin, capture_output=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"Remote command failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+    def _stream(self, cmd, stdin, timeout, echo, on_line):
+        """Run cmd handing each stdout line to on_line as it arrives"""
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        lines = []
+        try:
+            process.stdin.write(stdin or b'')
+            process.stdin.close()
+            for line in iter(process.stdout.readline, b''):
+                lines.append(line)
+                on_line(line)
+                if echo:
+                    sys.stdout.write(line.decode(errors='replace'))
+                    sys.stdout.flush()
+            process.wait()
+        finally:
+            timer.cancel()
+        if process.returncode != 0:
+            raise RuntimeError(f"Remote command exited with {process.returncode}")
+        return b'' if echo else b''.join(lines)
+
+
+class TransferStats:
+    """Bytes and chunks sent versus the full release"""
+
+    def __init__(self):
+        self.total_chunks = 0
+        self.sent_chunks = 0
+        self.total_bytes = 0
+        self.sent_bytes = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        saved = 100 * (1 - self.sent_bytes / self.total_bytes) if self.total_bytes else 0
+        return (
+            f"sent {self.sent_chunks}/{self.total_chunks} chunks, "
+            f"{self.sent_bytes / 1024:.0f} KB of {self.total_bytes / 1024:.0f} KB "
+            f"({saved:.0f}% saved) in {self.seconds:.1f}s"
+        )
+
+
+def chunk_release(tarball, chunk_size=CHUNK_SIZE):
+    """Split a release tarball's files into chunks; return (manifest, chunks)"""
+    manifest = {'dirs': [], 'files': [], 'symlinks': []}
+    chunks = {}
+
+    with tarfile.open(tarball, 'r:gz') as tar:
+        for member in tar:
+            if member.isdir():
+                manifest['dirs'].append(member.name)
+            elif member.issym():
+                manifest['symlinks'].append({'path': member.name, 'target': member.linkname})
+            elif member.isfile() or member.islnk():
+                # Cache entries are hardlinked into the release: tar stores every
+                # path after the first as a link to it, which extractfile resolves
+                data = tar.extractfile(member).read()
+                ids = []
+                for offset in range(0, len(data), chunk_size):
+                    piece = data[offset:offset + chunk_size]
+                    chunk_id = hashlib.sha256(piece).hexdigest()
+                    chunks[chunk_id] = piece
+                    ids.append(chunk_id)
+                manifest['files'].append({'path': member.name, 'mode': member.mode, 'chunks': ids})
+
+    return manifest, chunks
+
+
+def agent_command(*args):
+    """Command line running chunk_agent.py remotely without copying it first"""
+    source = base64.b64encode(AGENT_PATH.read_bytes()).decode()
+    quoted = " ".join(shlex.quote(a) for a in args)
+    return f'sudo python3 -c "$(echo {source} | base64 -d)" {quoted}'
+
+
+def encode_chunks(chunk_ids, chunks, level=6):
+    """Frame and compress chunks for the agent's store command"""
+    frames = []
+    for chunk_id in chunk_ids:
+        data = zlib.compress(chunks[chunk_id], level)
+        frames.append(f"{chunk_id} {len(data)}\n".encode() + data)
+    return b''.join(frames)
+
+
+class DeltaTransfer:
+    """Pushes release tarballs to an instance's chunk store"""
+
+    def __init__(self, remote, store):
+        self.remote = remote
+        self.store = store
+
+    def push(self, tarball, dest):
+        """Send the chunks the instance lacks and assemble the release at dest"""
+        started = time.monotonic()
+        stats = TransferStats()
+
+        manifest, chunks = chunk_release(tarball)
+        stats.total_chunks = len(chunks)
+        stats.total_bytes = sum(len(c) for c in chunks.values())
+
+        wanted = "\n".join(chunks).encode()
+        missing = self.remote.run(agent_command('missing', self.store), stdin=wanted).decode().split()
+
+        if missing:
+            payload = encode_chunks(missing, chunks)
+            self.remote.run(agent_command('store', self.store), stdin=payload)
+            stats.sent_chunks = len(missing)
+            stats.sent_bytes = len(payload)
+
+        self.remote.run(agent_command('assemble', self.store, dest), stdin=json.dumps(manifest).encode())
+
+        stats.seconds = time.monotonic() - started
+        logger.info(f"✓ Delta transfer: {stats}")
+        return stats
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Dependency layer cache on the instance, keyed by lockfile and Node version
+
+    /var/cache/<app>/deps/<key>/node_modules   one installed layer per key
+
+A layer is filled once with `npm ci` and then hardlinked into each checkout
+whose package-lock.json (and Node runtime) match, so content-only deploys skip
+the install entirely. Every run prints one `DEPS_CACHE hit|miss` line with the
+time spent and, on a hit, the time saved against the original install.
+On a miss, warm_script can fill the npm cache beforehand, while the system
+packages the install needs are still being set up.
+"""
+
+
+def cache_dir(config):
+    """Directory on the instance holding dependency layers"""
+    return f"/var/cache/{config['application']['name']}/deps"
+
+
+def deps_key(app_dir='.'):
+    """Shell expression for the layer key of the checkout in app_dir"""
+    return f"$( (cat {app_dir}/package-lock.json; node --version; uname -m) | sha256sum | cut -c1-16)"
+
+
+def install_script(config, app_dir='.', sudo=''):
+    """Shell steps that restore node_modules from a matching layer or install and store it"""
+    cache = config.get('dependency_cache', {})
+    if not cache.get('enabled', True):
+        return f"cd {app_dir}\nnpm ci\n"
+
+    store = cache_dir(config)
+    keep = cache.get('keep_layers', 3)
+
+    return f"""# Dependency layer keyed by lockfile, Node version and architecture
+cd {app_dir}
+{sudo}mkdir -p {store}
+{sudo}chown $(id -un):$(id -gn) {store}
+DEPS_KEY={deps_key()}
+DEPS_LAYER={store}/$DEPS_KEY
+DEPS_START=$(date +%s)
+if [ -f "$DEPS_LAYER/.complete" ]; then
+    rm -rf node_modules
+    # Hardlinks share the files; fall back to a copy where links are not allowed
+    cp -al "$DEPS_LAYER/node_modules" node_modules 2>/dev/null || {{ rm -rf node_modules; cp -a "$DEPS_LAYER/node_modules" node_modules; }}
+    rm -rf node_modules/.cache
+    touch "$DEPS_LAYER"
+    DEPS_TOOK=$(( $(date +%s) - DEPS_START ))
+    DEPS_SAVED=$(( $(cat "$DEPS_LAYER/.install-seconds" 2>/dev/null || echo 0) - DEPS_TOOK ))
+    echo "DEPS_CACHE hit $DEPS_KEY took=${{DEPS_TOOK}}s saved=${{DEPS_SAVED}}s"
+else
+    npm ci --prefer-offline
+    DEPS_TOOK=$(( $(date +%s) - DEPS_START ))
+    # Build the layer aside and rename it in, so a partial layer is never used
+    rm -rf "$DEPS_LAYER.tmp"
+    mkdir -p "$DEPS_LAYER.tmp"
+    cp -al node_modules "$DEPS_LAYER.tmp/node_modules"
+    echo $DEPS_TOOK > "$DEPS_LAYER.tmp/.install-seconds"
+    touch "$DEPS_LAYER.tmp/.complete"
+    rm -rf "$DEPS_LAYER"
+    mv -T "$DEPS_LAYER.tmp" "$DEPS_LAYER"
+    echo "DEPS_CACHE miss $DEPS_KEY took=${{DEPS_TOOK}}s"
+fi
+
+# Keep the {keep} most recently used layers
+ls -1dt {store}/*/ | tail -n +{keep + 1} | xargs -r rm -rf
+"""
+
+
+def warm_script(config, app_dir):
+    """Download the locked packages into the npm cache unless a matching layer exists
+
+    Lifecycle scripts are skipped, so nothing is compiled and build tools are
+    not needed yet; the real install then resolves everything offline.
+    """
+    store = cache_dir(config)
+    return f"""if [ -f "{store}/{deps_key(app_dir)}/.complete" ]; then
+    echo "Dependency layer present, nothing to fetch"
+else
+    WARM_DIR=$(mktemp -d)
+    cp {app_dir}/package.json {app_dir}/package-lock.json $WARM_DIR/
+    (cd $WARM_DIR && npm ci --ignore-scripts --no-audit --no-fund)
+    rm -rf $WARM_DIR
+fi
+"""
@@ -6,13 +6,20 @@ Deploys Next.js application to Google Cloud Compute Engine
 
 import os
 import sys
-import time
-import yaml
+import hashlib
 import logging
 from pathlib import Path
 from google.cloud import compute_v1
-from google.oauth2 import service_account
-import paramiko
+from artifact import artifact_mode, build_release, publish_release, release_install_script, static_mode
+from cdn_offload import log_asset_source
+from loadtest import gate as loadtest_gate, loadtest_settings
+from operations import OperationWaiter
+from readiness import ReadinessProbe, ReadinessTimeoutError, default_endpoints
+from reconcile import Reconciler, apply, render_plan
+from provision import firewall_step, nginx_step, provision_script, source_steps, system_steps
+from session import get_session
+from step_graph import StepGraph
+from tracing import Tracer, phase_preamble
 
 # Setup logging
 logging.basicConfig(
@@ -25,43 +32,53 @@ logger = logging.getLogger(__name__)
 class GCPDeployment:
     """Handles deployment to Google Cloud Platform"""
 
-    def __init__(self, config_path='config.yaml'):
+    def __init__(self, config_path='config.yaml', config=None, tracer=None):
         """Initialize GCP deployment with configuration"""
-        self.config = self.load_config(config_path)
+        self.session = get_session(config_path)
+        self.config = config if config is not None else self.load_config(config_path)
         self.credentials = self.load_credentials()
-        self.compute_client = compute_v1.InstancesClient(credentials=self.credentials)
-        self.firewall_client = compute_v1.FirewallsClient(credentials=self.credentials)
+        self.release = None
+        self.release_url = None
+        self.compute_client = self.session.client('InstancesClient')
+        self.firewall_client = self.session.client('FirewallsClient')
+        self.waiter = OperationWaiter(
+            self.config['gcp']['project_id'],
+            credentials=self.credentials,
+            zone_client=self.session.client('ZoneOperationsClient'),
+            region_client=self.session.client('RegionOperationsClient'),
+            global_client=self.session.client('GlobalOperationsClient'),
+            timeout=self.config['deployment'].get('operation_timeout', 600)
+        )
+        self.tracer = tracer or Tracer('deploy', self.config)
+        self._golden_image_current = None
+
+    def span(self, name, category='gcp', **attrs):
+        """Trace a step on this instance's track"""
+        return self.tracer.span(name, category, track=self.config['instance']['name'], **attrs)
 
     def load_config(self, config_path):
         """Load configuration from YAML file"""
         logger.info(f"Loading configuration from {config_path}")
-        with open(config_path, 'r') as f:
-            return yaml.safe_load(f)
+        return self.session.config
 
     def load_credentials(self):
         """Load GCP service account credentials with required scopes"""
-        creds_path = self.config['gcp']['credentials_path']
-        logger.info(f"Loading GCP credentials from {creds_path}")
-
-        # Add required scopes for Compute Engine
-        scopes = [
-            'https://www.googleapis.com/auth/compute',
-            'https://www.googleapis.com/auth/cloud-platform'
-        ]
-
-        credentials = service_account.Credentials.from_service_account_file(
-            creds_path,
-            scopes=scopes
+        logger.info(f"Loading GCP credentials from {self.session.config['gcp']['credentials_path']}")
+        return self.session.credentials()
+
+    def source_image(self):
+        """Return the boot image: the recorded golden image if current, else the stock OS"""
+        if self.uses_golden_image():
+            return f"projects/{self.config['gcp']['project_id']}/global/images/{self.config['golden_image']['image']}"
+
+        return (
+            f"projects/{self.config['instance']['image_project']}/global/images/family/"
+            f"{self.config['instance']['image_family']}"
         )
-        return credentials
 
-    def create_instance(self):
-        """Create a new Compute Engine instance"""
-        project_id = self.config['gcp']['project_id']
+    def build_instance(self, instance_name, source_image, startup_script):
+        """Build the compute_v1.Instance spec for the configured machine"""
         zone = self.config['gcp']['zone']
-        instance_name = self.config['instance']['name']
-
-        logger.info(f"Creating instance {instance_name} in {zone}")
 
         # Define instance configuration
         machine_type = f"zones/{zone}/machineTypes/{self.config['instance']['machine_type']}"
@@ -70,13 +87,15 @@ class GCPDeployment:
         instance.name = instance_name
         instance.machine_type = machine_type
 
+        # Firewall rules target instances by this tag
+        tags = compute_v1.Tags()
+        tags.items = [instance_name]
+        instance.tags = tags
+
         # Boot disk configuration
         boot_disk = compute_v1.AttachedDisk()
         initialize_params = compute_v1.AttachedDiskInitializeParams()
-        initialize_params.source_image = (
-            f"projects/{self.config['instance']['image_project']}/global/images/family/"
-            f"{self.config['instance']['image_family']}"
-        )
+        initialize_params.source_image = source_image
         initialize_params.disk_size_gb = self.config['instance']['boot_disk_size']
         initialize_params.disk_type = f"zones/{zone}/diskTypes/{self.config['instance']['boot_disk_type']}"
 
@@ -101,10 +120,29 @@ class GCPDeployment:
         metadata = compute_v1.Metadata()
         metadata_items = compute_v1.Items()
         metadata_items.key = "startup-script"
-        metadata_items.value = self.generate_startup_script()
+        metadata_items.value = startup_script
         metadata.items = [metadata_items]
         instance.metadata = metadata
 
+        # Artifact mode instances pull their release from the artifact bucket
+        if artifact_mode(self.config):
+            service_account_ref = compute_v1.ServiceAccount()
+            service_account_ref.email = "default"
+            service_account_ref.scopes = ["https://www.googleapis.com/auth/devstorage.read_only"]
+            instance.service_accounts = [service_account_ref]
+
+        return instance
+
+    def create_instance(self):
+        """Create a new Compute Engine instance"""
+        project_id = self.config['gcp']['project_id']
+        zone = self.config['gcp']['zone']
+        instance_name = self.config['instance']['name']
+
+        logger.info(f"Creating instance {instance_name} in {zone}")
+
+        instance = self.build_instance(instance_name, self.source_image(), self.generate_startup_script())
+
         # Create the instance
         request = compute_v1.InsertInstanceRequest()
         request.project = project_id
@@ -112,129 +150,103 @@ class GCPDeployment:
         request.instance_resource = instance
 
         try:
-            operation = self.compute_client.insert(request=request)
+            with self.span('instance insert'):
+                operation = self.waiter.call(lambda: self.compute_client.insert(request=request),
+                                             f"Instance {instance_name} creation")
             logger.info(f"Instance creation initiated. Waiting for completion...")
-            self.wait_for_operation(operation, zone)
+            self.wait_for_operation(operation, f"Instance {instance_name} creation")
             logger.info(f"Instance {instance_name} created successfully!")
             return True
         except Exception as e:
+            # A retried insert may have gone through the first time
+            if getattr(e, 'code', None) == 409:
+                logger.info(f"Instance {instance_name} already exists")
+                return True
             logger.error(f"Error creating instance: {e}")
             return False
 
+    def generate_base_script(self):
+        """Generate the system layer: packages that do not depend on the app"""
+        graph = StepGraph()
+        system_steps(graph, self.config)
+        return provision_script(graph, "Installing system packages...")
+
+    def bake_fingerprint(self):
+        """Hash the golden image inputs: base image and system layer script"""
+        inputs = "\n".join([
+            self.config['instance']['image_project'],
+            self.config['instance']['image_family'],
+            self.generate_base_script(),
+        ])
+        return hashlib.sha256(inputs.encode()).hexdigest()[:12]
+
+    def uses_golden_image(self):
+        """Check whether the golden image recorded in config was baked from the current inputs"""
+        golden = self.config.get('golden_image', {})
+        if not golden.get('image'):
+            return False
+        if self._golden_image_current is None:
+            self._golden_image_current = golden.get('fingerprint') == self.bake_fingerprint()
+            # A stale image lacks part of the system layer the startup script would skip
+            if not self._golden_image_current:
+                logger.warning(f"Golden image inputs changed since {golden['image']} was baked; booting "
+                               f"the stock image with the full system layer. Run: python image_bake.py")
+        return self._golden_image_current
+
+    def app_steps(self, graph):
+        """Add the steps that put the application in place and start it"""
+        if artifact_mode(self.config):
+            tarball = f"/tmp/{self.release.filename}"
+            graph.add('download', "Downloading release...", f"gcloud storage cp {self.release_url} {tarball}")
+            # Static releases have no server for PM2 to bring back after a reboot
+            startup = "" if static_mode(self.config) else "pm2 startup systemd\npm2 save"
+            graph.add('release', "Starting release...",
+                      f"{release_install_script(self.config, self.release, tarball)}{startup}",
+                      needs=['download'], after=['pm2', 'packages'])
+            return
+
+        source_steps(graph, self.config, f"/var/www/{self.config['application']['name']}")
+
+    def startup_graph(self):
+        """Step graph of the startup script"""
+        graph = StepGraph()
+        # A golden image already contains the system layer
+        if not self.uses_golden_image():
+            system_steps(graph, self.config)
+        firewall_step(graph, self.config)
+        self.app_steps(graph)
+        nginx_step(graph, self.config)
+        return graph
+
     def generate_startup_script(self):
         """Generate startup script for instance initialization"""
-        script = f"""#!/bin/bash
-set -e
-
-# Update system
-apt-get update
-apt-get upgrade -y
-
-# Install Node.js
-curl -fsSL https://deb.nodesource.com/setup_{self.config['deployment']['nodejs_version']} | bash -
-apt-get install -y nodejs
-
-# Install build essentials
-apt-get install -y build-essential git
-
-# Install Nginx
-apt-get install -y nginx
-
-# Configure firewall
-ufw allow 22
-ufw allow 80
-ufw allow 443
-ufw allow {self.config['application']['port']}
-ufw --force enable
-
-# Create application directory
-mkdir -p /var/www/{self.config['application']['name']}
-cd /var/www/{self.config['application']['name']}
-
-# Clone repository
-git clone {self.config['application']['github_repo']} .
-git checkout {self.config['application']['branch']}
-
-# Install dependencies
-npm install
-
-# Build application
-npm run build
-
-# Install PM2 for process management
-npm install -g pm2
-
-# Start application with PM2
-pm2 start npm --name "{self.config['application']['name']}" -- start
-pm2 startup systemd
-pm2 save
-
-# Configure Nginx
-cat > /etc/nginx/sites-available/{self.config['application']['name']} << 'EOF'
-server {{
-    listen 80;
-    server_name _;
-
-    location / {{
-        proxy_pass http://localhost:{self.config['application']['port']};
-        proxy_http_version 1.1;
-        proxy_set_header Upgrade $http_upgrade;
-        proxy_set_header Connection 'upgrade';
-        proxy_set_header Host $host;
-        proxy_cache_bypass $http_upgrade;
-    }}
-}}
-EOF
-
-ln -sf /etc/nginx/sites-available/{self.config['application']['name']} /etc/nginx/sites-enabled/
-rm -f /etc/nginx/sites-enabled/default
-nginx -t && systemctl restart nginx
-
+        body = f"""{provision_script(self.startup_graph())}
+phase_done
 echo "Deployment completed successfully!"
 """
-        return script
-
-    def setup_firewall_rules(self):
-        """Create firewall rules for the application"""
-        project_id = self.config['gcp']['project_id']
-
-        for rule in self.config['firewall']:
-            logger.info(f"Creating firewall rule: {rule['name']}")
-
-            firewall_rule = compute_v1.Firewall()
-            firewall_rule.name = f"{self.config['application']['name']}-{rule['name']}"
-            firewall_rule.direction = "INGRESS"
-            firewall_rule.priority = 1000
-
-            allowed = compute_v1.Allowed()
-            allowed.I_p_protocol = rule['protocol']
-            allowed.ports = [str(rule['port'])]
-            firewall_rule.allowed = [allowed]
-
-            firewall_rule.source_ranges = ["0.0.0.0/0"]
-            firewall_rule.target_tags = [self.config['instance']['name']]
-
-            request = compute_v1.InsertFirewallRequest()
-            request.project = project_id
-            request.firewall_resource = firewall_rule
-
-            try:
-                self.firewall_client.insert(request=request)
-                logger.info(f"Firewall rule {rule['name']} created successfully")
-            except Exception as e:
-                logger.warning(f"Firewall rule might already exist: {e}")
-
-    def wait_for_operation(self, operation, zone):
+        # Phase and step markers reach the serial console, where deploy() reads them back
+        return f"#!/bin/bash\nset -e\n\n{phase_preamble(body)}\n{body}"
+
+    def build_firewall_rule(self, rule, target_tags):
+        """Build the compute_v1.Firewall for one rule of the firewall section"""
+        firewall_rule = compute_v1.Firewall()
+        firewall_rule.name = f"{self.config['application']['name']}-{rule['name']}"
+        firewall_rule.direction = "INGRESS"
+        firewall_rule.priority = 1000
+
+        allowed = compute_v1.Allowed()
+        allowed.I_p_protocol = rule['protocol']
+        allowed.ports = [str(rule['port'])]
+        firewall_rule.allowed = [allowed]
+
+        firewall_rule.source_ranges = ["0.0.0.0/0"]
+        firewall_rule.target_tags = target_tags
+        return firewall_rule
+
+    def wait_for_operation(self, operation, description=None):
         """Wait for a GCP operation to complete"""
-        project_id = self.config['gcp']['project_id']
-
-        while operation.status != compute_v1.Operation.Status.DONE:
-            time.sleep(5)
-            operation = self.compute_client.get(
-                project=project_id,
-                zone=zone,
-                instance=self.config['instance']['name']
-            )
+        with self.span('operation wait', operation=description):
+            return self.waiter.wait(operation, description=description)
 
     def get_instance_ip(self):
         """Get the external IP address of the instance"""
@@ -243,11 +255,11 @@ echo "Deployment completed successfully!"
         instance_name = self.config['instance']['name']
 
         try:
-            instance = self.compute_client.get(
+            instance = self.waiter.call(lambda: self.compute_client.get(
                 project=project_id,
                 zone=zone,
                 instance=instance_name
-            )
+            ), f"Instance {instance_name} lookup")
 
             if instance.network_interfaces:
                 access_configs = instance.network_interfaces[0].access_configs
@@ -258,43 +270,112 @@ echo "Deployment completed successfully!"
 
         return None
 
+    def prepare_release(self):
+        """Build the release tarball once and publish it to the artifact bucket"""
+        self.release = build_release(self.config)
+        self.release_url = publish_release(self.config, self.credentials, self.release)
+        return self.release
+
+    def trace_startup_phases(self):
+        """Recover the startup script's phase timings from the serial console"""
+        try:
+            output = self.compute_client.get_serial_port_output(
+                project=self.config['gcp']['project_id'],
+                zone=self.config['gcp']['zone'],
+                instance=self.config['instance']['name']
+            )
+        except Exception as e:
+            logger.warning(f"Could not read serial output for phase timings: {e}")
+            return
+        self.tracer.phases(track=self.config['instance']['name'], prefix='startup').feed_all(output.contents)
+
+    def wait_until_ready(self, host):
+        """Probe nginx and the Next.js port until both respond healthily"""
+        probe = ReadinessProbe(
+            host,
+            default_endpoints(self.config),
+            timeout=self.config['deployment'].get('readiness_timeout', 900)
+        )
+
+        try:
+            with self.span('readiness', category='local'):
+                timings = probe.wait()
+        except ReadinessTimeoutError as e:
+            logger.error(f"Readiness check failed: {e}")
+            return False
+        finally:
+            self.trace_startup_phases()
+
+        logger.info(f"Application ready after {max(timings.values()):.1f}s")
+        return True
+
     def deploy(self):
-        """Main deployment workflow"""
+        """Main deployment workflow; the phase trace is written either way"""
+        try:
+            return self.run_deploy()
+        finally:
+            self.tracer.export()
+
+    def run_deploy(self):
+        """Provision the instance and wait until it serves"""
         logger.info("=" * 60)
         logger.info("Starting Aathira Trendz Deployment")
         logger.info("=" * 60)
 
-        # Step 1: Setup firewall rules
-        logger.info("\nStep 1: Setting up firewall rules...")
-        self.setup_firewall_rules()
-
-        # Step 2: Create instance
-        logger.info("\nStep 2: Creating Compute Engine instance...")
-        if not self.create_instance():
+        if artifact_mode(self.config):
+            logger.info("\nBuilding release artifact...")
+            with self.span('build release', category='local'):
+                self.prepare_release()
+            log_asset_source(self.config)
+
+        # Step 1: Diff firewall rules and the instance against what exists
+        logger.info("\nStep 1: Planning firewall rules and instance...")
+        reconciler = Reconciler(self, [self])
+        with self.span('plan'):
+            changes = reconciler.plan()
+        logger.info(render_plan(changes, reconciler.unchanged))
+
+        # Step 2: Create or update only what differs
+        logger.info("\nStep 2: Applying changes...")
+        if not apply(changes, self.tracer):
             logger.error("Deployment failed!")
             return False
 
-        # Step 3: Wait for instance to be ready
-        logger.info("\nStep 3: Waiting for instance initialization...")
-        time.sleep(60)  # Wait for startup script to begin
-
-        # Step 4: Get instance IP
-        logger.info("\nStep 4: Retrieving instance IP address...")
-        external_ip = self.get_instance_ip()
-
-        if external_ip:
-            logger.info("\n" + "=" * 60)
-            logger.info("DEPLOYMENT SUCCESSFUL!")
-            logger.info("=" * 60)
-            logger.info(f"\nInstance Name: {self.config['instance']['name']}")
-            logger.info(f"External IP: {external_ip}")
-            logger.info(f"\nAccess your website at:")
-            logger.info(f"  → http://{external_ip}")
-            logger.info(f"  → http://{external_ip}:3000 (Direct Next.js)")
-            logger.info("\nNote: It may take 5-10 minutes for the application to be fully ready.")
-            logger.info("=" * 60)
-        else:
+        # Step 3: Get instance IP
+        logger.info("\nStep 3: Retrieving instance IP address...")
+        with self.span('instance ip'):
+            external_ip = self.get_instance_ip()
+
+        if not external_ip:
             logger.warning("Could not retrieve instance IP. Check GCP Console.")
+            return False
+
+        # Step 4: Wait until nginx and Next.js both serve healthy responses
+        logger.info("\nStep 4: Waiting for the application to become ready...")
+        if not self.wait_until_ready(external_ip):
+            logger.error("Instance did not become ready in time.")
+            logger.info("Check the startup script log: sudo journalctl -u google-startup-scripts")
+            return False
+
+        # Optional gate: fail the deploy when it serves slower than the baseline
+        if loadtest_settings(self.config)['gate']:
+            logger.info("\nStep 5: Load testing against the baseline...")
+            with self.span('loadtest', category='local'):
+                passed = loadtest_gate(self.config, external_ip)
+            if not passed:
+                logger.error("Deployment is serving but regressed against the load test baseline.")
+                return False
+
+        port = self.config['application']['port']
+        logger.info("\n" + "=" * 60)
+        logger.info("DEPLOYMENT SUCCESSFUL!")
+        logger.info("=" * 60)
+        logger.info(f"\nInstance Name: {self.config['instance']['name']}")
+        logger.info(f"External IP: {external_ip}")
+        logger.info(f"\nAccess your website at:")
+        logger.info(f"  → http://{external_ip}")
+        logger.info(f"  → http://{external_ip}:{port} (Direct Next.js)")
+        logger.info("=" * 60)
 
         return True
 
@@ -3,12 +3,19 @@
 Deploy Aathira Trendz to existing GCP instance
 """
 
-import yaml
 import logging
 import time
+import threading
 import subprocess
-from google.cloud import compute_v1
-from google.oauth2 import service_account
+from pathlib import Path
+from artifact import artifact_mode, build_release, release_dir, release_install_script, static_mode
+from delta_transfer import DeltaTransfer, GcloudRemote
+from operations import OperationWaiter
+from provision import firewall_step, nginx_step, provision_script, source_steps, system_steps
+from session import get_session
+from ssh_pool import RemoteCommandError, SSHPool, SSHRemote
+from step_graph import StepGraph
+from tracing import Tracer, phase_preamble
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -16,24 +23,30 @@ logger = logging.getLogger(__name__)
 
 def load_config():
     """Load configuration"""
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
+    return get_session().config
 
 
 def get_instance_ip(config):
     """Get the external IP of the existing instance"""
-    credentials = service_account.Credentials.from_service_account_file(
-        config['gcp']['credentials_path'],
-        scopes=['https://www.googleapis.com/auth/compute', 'https://www.googleapis.com/auth/cloud-platform']
-    )
-
-    client = compute_v1.InstancesClient(credentials=credentials)
-
-    instance = client.get(
-        project=config['gcp']['project_id'],
-        zone=config['gcp']['zone'],
-        instance=config['instance']['name']
-    )
+    session = get_session()
+    client = session.client('InstancesClient')
+    waiter = OperationWaiter(config['gcp']['project_id'], credentials=session.credentials(),
+                             zone_client=session.client('ZoneOperationsClient'),
+                             timeout=config['deployment'].get('operation_timeout', 600))
+    target = {
+        'project': config['gcp']['project_id'],
+        'zone': config['gcp']['zone'],
+        'instance': config['instance']['name'],
+    }
+
+    instance = waiter.call(lambda: client.get(**target), "instance lookup")
+
+    # A stopped instance has no external IP; start it and wait until it is up
+    if instance.status == 'TERMINATED':
+        logger.info(f"Instance {instance.name} is stopped, starting it...")
+        operation = waiter.call(lambda: client.start(**target), "instance start")
+        waiter.wait(operation, description=f"Instance {instance.name} start")
+        instance = waiter.call(lambda: client.get(**target), "instance lookup")
 
     if instance.network_interfaces:
         access_configs = instance.network_interfaces[0].access_configs
@@ -42,9 +55,109 @@ def get_instance_ip(config):
     return None
 
 
+def log_success(external_ip, port):
+    """Print the deployment summary"""
+    logger.info("\n" + "=" * 60)
+    logger.info("✓ DEPLOYMENT SUCCESSFUL!")
+    logger.info("=" * 60)
+    logger.info(f"\nYour website is now live at:")
+    logger.info(f"  → http://{external_ip}")
+    logger.info(f"  → http://{external_ip}:{port}")
+    logger.info("\n" + "=" * 60)
+
+
+def execute_over_ssh(pool, host, script_path, tarball_path, port, tracer, track):
+    """Upload and run the deployment script over one pooled SSH session"""
+    logger.info("\nStep 1: Uploading deployment files over SSH...")
+    try:
+        with tracer.span('upload', track=track):
+            for path in [script_path] + ([tarball_path] if tarball_path else []):
+                pool.put(host, path, f"/tmp/{Path(path).name}")
+        logger.info("✓ Script copied successfully")
+    except Exception as e:
+        logger.error(f"Error copying script: {e}")
+        return False
+
+    logger.info("\nStep 2: Executing deployment script...")
+    phases = tracer.phases(track=track)
+    try:
+        # Output is streamed live, prefixed with the host
+        with tracer.span('remote script', track=track):
+            pool.run(host, 'bash /tmp/deploy_aathira.sh', timeout=600, on_line=phases.feed)
+    except RemoteCommandError as e:
+        logger.error(f"Deployment script failed: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"Error executing deployment: {e}")
+        return False
+    finally:
+        phases.close()
+
+    log_success(host, port)
+    return True
+
+
+def stream_command(cmd, timeout, on_line):
+    """Run a local command, echoing and handing on each output line; return its exit code"""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    expired = threading.Event()
+
+    def kill():
+        expired.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        for line in process.stdout:
+            print(line, end='', flush=True)
+            on_line(line)
+        process.wait()
+    finally:
+        timer.cancel()
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return process.returncode
+
+
 def deploy_to_existing():
-    """Deploy to existing instance using gcloud SSH"""
+    """Deploy to existing instance, tracing each phase"""
     config = load_config()
+    tracer = Tracer('existing', config)
+    try:
+        return run_deploy(config, tracer)
+    finally:
+        tracer.export()
+
+
+def existing_graph(config, release=None, tarball=None):
+    """Step graph run over SSH; every step checks what the instance already has"""
+    app_name = config['application']['name']
+    startup = "pm2 startup systemd -u $USER --hp $HOME"
+
+    graph = StepGraph()
+    system_steps(graph, config, sudo='sudo ')
+    firewall_step(graph, config, sudo='sudo ')
+
+    if release:
+        # The release switch reloads the running app in place, so it keeps serving meanwhile
+        boot = "" if static_mode(config) else f"{startup}\npm2 save"
+        graph.add('release', "Unpacking and starting release...",
+                  f"{release_install_script(config, release, tarball, sudo='sudo ')}{boot}",
+                  needs=['pm2', 'packages'])
+    else:
+        # The old app keeps serving until the new build is ready to start
+        graph.add('stop_app', "Stopping existing application...", f"""if command -v pm2 &> /dev/null; then
+    pm2 stop {app_name} || true
+    pm2 delete {app_name} || true
+fi""", needs=['build', 'variants', 'compress'])
+        source_steps(graph, config, f"/var/www/{app_name}", sudo='sudo ', startup=startup)
+    nginx_step(graph, config, sudo='sudo ')
+    return graph
+
+
+def run_deploy(config, tracer):
+    """Deploy to existing instance using gcloud SSH"""
 
     logger.info("=" * 60)
     logger.info("Deploying to Existing Instance")
@@ -54,8 +167,6 @@ def deploy_to_existing():
     zone = config['gcp']['zone']
     instance_name = config['instance']['name']
     app_name = config['application']['name']
-    github_repo = config['application']['github_repo']
-    branch = config['application']['branch']
     port = config['application']['port']
 
     logger.info(f"\nTarget Instance: {instance_name}")
@@ -63,115 +174,47 @@ def deploy_to_existing():
     logger.info(f"Zone: {zone}")
 
     # Get IP
-    external_ip = get_instance_ip(config)
+    with tracer.span('instance lookup', 'gcp', track=instance_name):
+        external_ip = get_instance_ip(config)
     if external_ip:
         logger.info(f"External IP: {external_ip}")
 
-    # Deployment commands
-    deployment_script = f"""
-#!/bin/bash
-set -e
+    # One pooled SSH session carries every transfer and command when enabled
+    pool = None
+    if config.get('ssh', {}).get('transport', 'gcloud') == 'paramiko' and external_ip:
+        pool = SSHPool.from_config(config)
+
+    # Artifact mode: build once here and ship the tarball instead of building on the VM
+    release = tarball = None
+    if artifact_mode(config):
+        logger.info("\nBuilding release artifact...")
+        with tracer.span('build release'):
+            release = build_release(config)
+        tarball = f"/tmp/{release.filename}"
+
+        if config['artifact'].get('transfer', 'copy') == 'delta':
+            # Only chunks the instance has never seen go over the wire
+            logger.info("Sending release chunks the instance does not have yet...")
+            remote = SSHRemote(pool, external_ip) if pool else GcloudRemote(instance_name, project_id, zone)
+            transfer = DeltaTransfer(remote, store=f"/var/lib/{app_name}/chunks")
+            with tracer.span('delta transfer', track=instance_name):
+                transfer.push(release.path, release_dir(config, release))
+            tarball = None
 
+    # Deployment commands
+    body = f"""echo "=========================================="
+echo "Deploying Aathira Trendz{f' release {release.id}' if release else ''}"
 echo "=========================================="
-echo "Deploying Aathira Trendz"
-echo "=========================================="
-
-# Update system
-echo "[1/8] Updating system..."
-sudo apt-get update
-
-# Install Node.js if not present
-if ! command -v node &> /dev/null; then
-    echo "[2/8] Installing Node.js 20..."
-    curl -fsSL https://deb.nodesource.com/setup_20.x | sudo bash -
-    sudo apt-get install -y nodejs
-else
-    echo "[2/8] Node.js already installed ($(node -v))"
-fi
-
-# Install dependencies
-echo "[3/8] Installing required packages..."
-sudo apt-get install -y build-essential git nginx
-
-# Setup firewall
-echo "[4/8] Configuring firewall..."
-sudo ufw allow 22
-sudo ufw allow 80
-sudo ufw allow 443
-sudo ufw allow {port}
-sudo ufw --force enable
-
-# Stop existing app if running
-echo "[5/8] Stopping existing application..."
-if command -v pm2 &> /dev/null; then
-    pm2 stop {app_name} || true
-    pm2 delete {app_name} || true
-fi
-
-# Clone or update repository
-echo "[6/8] Setting up application..."
-if [ -d "/var/www/{app_name}" ]; then
-    echo "Directory exists, pulling latest changes..."
-    cd /var/www/{app_name}
-    sudo git pull origin {branch} || sudo git reset --hard && sudo git pull origin {branch}
-else
-    echo "Cloning repository..."
-    sudo mkdir -p /var/www/{app_name}
-    sudo git clone {github_repo} /var/www/{app_name}
-    cd /var/www/{app_name}
-fi
-
-# Set permissions
-sudo chown -R $USER:$USER /var/www/{app_name}
-
-# Install dependencies and build
-echo "[7/8] Installing dependencies and building..."
-cd /var/www/{app_name}
-npm install
-npm run build
-
-# Install PM2 if not present
-if ! command -v pm2 &> /dev/null; then
-    echo "Installing PM2..."
-    sudo npm install -g pm2
-fi
-
-# Start application
-echo "[8/8] Starting application..."
-pm2 start npm --name "{app_name}" -- start
-pm2 startup systemd -u $USER --hp $HOME
-pm2 save
-
-# Configure Nginx
-echo "Configuring Nginx..."
-sudo bash -c 'cat > /etc/nginx/sites-available/{app_name} << '"'"'EOF'"'"'
-server {{
-    listen 80;
-    server_name _;
-
-    location / {{
-        proxy_pass http://localhost:{port};
-        proxy_http_version 1.1;
-        proxy_set_header Upgrade \\$http_upgrade;
-        proxy_set_header Connection '"'"'upgrade'"'"';
-        proxy_set_header Host \\$host;
-        proxy_cache_bypass \\$http_upgrade;
-        proxy_set_header X-Real-IP \\$remote_addr;
-        proxy_set_header X-Forwarded-For \\$proxy_add_x_forwarded_for;
-        proxy_set_header X-Forwarded-Proto \\$scheme;
-    }}
-}}
-EOF'
-
-sudo ln -sf /etc/nginx/sites-available/{app_name} /etc/nginx/sites-enabled/
-sudo rm -f /etc/nginx/sites-enabled/default
-sudo nginx -t && sudo systemctl restart nginx
 
+{provision_script(existing_graph(config, release, tarball))}
+phase_done
 echo "=========================================="
 echo "Deployment Complete!"
 echo "=========================================="
-pm2 status
+{'' if static_mode(config) else 'pm2 status'}
 """
+    # Phase markers in the streamed output become trace spans
+    deployment_script = f"#!/bin/bash\nset -e\n\n{phase_preamble(body)}\n{body}"
 
     # Save script to temp file
     import tempfile
@@ -187,18 +230,27 @@ pm2 status
     logger.info("Executing deployment on instance...")
     logger.info("=" * 60)
 
+    if pool:
+        try:
+            return execute_over_ssh(pool, external_ip, script_path, release.path if release and tarball else None, port,
+                                    tracer, instance_name)
+        finally:
+            pool.close()
+
     # Copy script to instance
     logger.info("\nStep 1: Copying deployment script...")
     copy_cmd = [
         'gcloud', 'compute', 'scp',
         script_path,
-        f'{instance_name}:/tmp/deploy_aathira.sh',
+        *([str(release.path)] if release and tarball else []),
+        f'{instance_name}:/tmp/',
         f'--project={project_id}',
         f'--zone={zone}'
     ]
 
     try:
-        result = subprocess.run(copy_cmd, capture_output=True, text=True, timeout=60)
+        with tracer.span('upload', track=instance_name):
+            result = subprocess.run(copy_cmd, capture_output=True, text=True, timeout=300 if release else 60)
         if result.returncode == 0:
             logger.info("✓ Script copied successfully")
         else:
@@ -220,17 +272,13 @@ pm2 status
         '--command', 'bash /tmp/deploy_aathira.sh'
     ]
 
+    phases = tracer.phases(track=instance_name)
     try:
-        result = subprocess.run(exec_cmd, text=True, timeout=600)
+        with tracer.span('remote script', track=instance_name):
+            returncode = stream_command(exec_cmd, 600, phases.feed)
 
-        if result.returncode == 0:
-            logger.info("\n" + "=" * 60)
-            logger.info("✓ DEPLOYMENT SUCCESSFUL!")
-            logger.info("=" * 60)
-            logger.info(f"\nYour website is now live at:")
-            logger.info(f"  → http://{external_ip}")
-            logger.info(f"  → http://{external_ip}:{port}")
-            logger.info("\n" + "=" * 60)
+        if returncode == 0:
+            log_success(external_ip, port)
             return True
         else:
             logger.error("Deployment script failed")
@@ -243,12 +291,19 @@ pm2 status
     except Exception as e:
         logger.error(f"Error executing deployment: {e}")
         return False
+    finally:
+        phases.close()
 
 
-if __name__ == "__main__":
+def main():
+    """Main entry point"""
     try:
         success = deploy_to_existing()
         exit(0 if success else 1)
     except Exception as e:
         logger.error(f"Deployment failed: {e}", exc_info=True)
         exit(1)
+
+
+if __name__ == "__main__":
+    main()
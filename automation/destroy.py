@@ -1,79 +1,262 @@
 #!/usr/bin/env python3
 """
 Destroy deployed GCP resources
+
+Finds everything the tooling created under the names it gives them: the
+instance and fleet members, firewall rules, and the instance group with its
+templates, autoscaler and load balancer (plus the CDN backend bucket). Each
+kind is looked up with one list call, concurrently. Deletes then run in
+parallel, every resource starting as soon as the kinds that reference it are
+gone (forwarding rule before proxy before URL map, ...), and each delete
+waits on its operation. Golden images are only deleted with --images.
+
+    python destroy.py               # confirm, then delete
+    python destroy.py --dry-run     # only list what would be deleted
 """
 
-import yaml
-import logging
 import sys
-from google.cloud import compute_v1
-from google.oauth2 import service_account
+import time
+import logging
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from google.api_core.exceptions import NotFound
+
+from cdn_offload import backend_bucket_name
+from instance_group import group_settings, template_pattern
+from operations import OperationWaiter
+from session import get_session
+from status import list_instances, tracked_names
+from tracing import Tracer
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
+# Kind -> (client, scope, kinds that must be deleted first); the kind is also the delete() argument
+KINDS = {
+    'forwarding_rule': ('GlobalForwardingRulesClient', 'global', []),
+    'target_http_proxy': ('TargetHttpProxiesClient', 'global', ['forwarding_rule']),
+    'url_map': ('UrlMapsClient', 'global', ['target_http_proxy']),
+    'backend_service': ('BackendServicesClient', 'global', ['url_map']),
+    'backend_bucket': ('BackendBucketsClient', 'global', ['url_map']),
+    'health_check': ('HealthChecksClient', 'global', ['backend_service', 'instance_group_manager']),
+    'autoscaler': ('RegionAutoscalersClient', 'region', []),
+    'instance_group_manager': ('RegionInstanceGroupManagersClient', 'region', ['autoscaler', 'backend_service']),
+    'instance_template': ('InstanceTemplatesClient', 'global', ['instance_group_manager']),
+    'instance': ('InstancesClient', 'zone', []),
+    'firewall': ('FirewallsClient', 'global', []),
+    'image': ('ImagesClient', 'global', ['instance_template', 'instance']),
+}
+
 
-def load_config():
-    """Load configuration from YAML file"""
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
+class Resource:
+    """One resource to delete and how its deletion went"""
 
+    def __init__(self, kind, name, location=None):
+        self.kind = kind
+        self.name = name
+        self.location = location
+        self.result = None
+        self.seconds = 0.0
 
-def destroy_instance():
-    """Delete the Compute Engine instance"""
-    config = load_config()
 
-    # Load credentials
-    credentials = service_account.Credentials.from_service_account_file(
-        config['gcp']['credentials_path']
-    )
+def wanted_names(config):
+    """Kind -> matcher for the names this tooling gives its resources"""
+    app = config['application']['name']
+    group = group_settings(config)['group_name']
+    firewalls = {f"{app}-{rule['name']}" for rule in config.get('firewall', [])} | {f"{group}-allow-lb"}
+    return {
+        'forwarding_rule': {f"{group}-frontend"}.__contains__,
+        'target_http_proxy': {f"{group}-proxy"}.__contains__,
+        'url_map': {f"{group}-urlmap"}.__contains__,
+        'backend_service': {f"{group}-backend"}.__contains__,
+        'backend_bucket': {backend_bucket_name(config)}.__contains__,
+        'health_check': {f"{group}-http"}.__contains__,
+        'autoscaler': {group}.__contains__,
+        'instance_group_manager': {group}.__contains__,
+        'instance_template': template_pattern(group).match,
+        'firewall': firewalls.__contains__,
+    }
 
-    # Initialize client
-    client = compute_v1.InstancesClient(credentials=credentials)
 
+def find_resources(session, images=False, max_workers=8, waiter=None):
+    """Look up every kind concurrently; return the resources that exist"""
+    config = session.config
     project_id = config['gcp']['project_id']
-    zone = config['gcp']['zone']
-    instance_name = config['instance']['name']
+    region = config['gcp']['region']
+    family = config.get('golden_image', {}).get('family')
+    # Only its retries are used: a lookup that hits a transient error is repeated
+    waiter = waiter or OperationWaiter(project_id, timeout=config['deployment'].get('operation_timeout', 600))
 
-    # Confirm deletion
-    logger.warning("=" * 60)
-    logger.warning("WARNING: This will DELETE the instance and all its data!")
-    logger.warning("=" * 60)
-    logger.warning(f"Instance: {instance_name}")
-    logger.warning(f"Zone: {zone}")
-    logger.warning(f"Project: {project_id}")
+    def lookup(kind, matches, **filters):
+        client_name, scope, _ = KINDS[kind]
+        location = region if scope == 'region' else None
+        kwargs = {'project': project_id, **({'region': region} if location else {}), **filters}
+        try:
+            found = waiter.call(lambda: list(session.client(client_name).list(**kwargs)), f"{kind} list")
+        except NotFound:
+            return []
+        return [Resource(kind, r.name, location) for r in found if matches(r)]
 
-    confirmation = input("\nType 'DELETE' to confirm: ")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Instances: one aggregated call over every zone, fleet members included
+        instances = pool.submit(list_instances, session, tracked_names(config), waiter)
+        jobs = {kind: pool.submit(lookup, kind, lambda r, m=matches: m(r.name))
+                for kind, matches in wanted_names(config).items()}
+        if images and family:
+            jobs['image'] = pool.submit(lookup, 'image', lambda r: r.family == family, filter=f'family = "{family}"')
 
-    if confirmation != "DELETE":
-        logger.info("Destruction cancelled.")
-        return False
+        resources = [Resource('instance', row['name'], row['zone']) for row in instances.result()]
+        for kind in KINDS:
+            if kind in jobs:
+                resources.extend(jobs[kind].result())
+    return resources
 
-    try:
-        logger.info("\nDeleting instance...")
-        request = compute_v1.DeleteInstanceRequest()
-        request.project = project_id
-        request.zone = zone
-        request.instance = instance_name
 
-        operation = client.delete(request=request)
+class Teardown:
+    """Deletes resources concurrently in dependency order"""
 
-        logger.info("Instance deletion initiated...")
-        logger.info("This may take a few minutes.")
+    def __init__(self, session, tracer=None, max_workers=16):
+        config = session.config
+        self.session = session
+        self.project_id = config['gcp']['project_id']
+        self.tracer = tracer or Tracer('destroy', config)
+        self.max_workers = max_workers
+        self.waiter = OperationWaiter(
+            self.project_id, credentials=session.credentials(),
+            timeout=config['deployment'].get('operation_timeout', 600),
+            zone_client=session.client('ZoneOperationsClient'),
+            region_client=session.client('RegionOperationsClient'),
+            global_client=session.client('GlobalOperationsClient'),
+        )
 
-        logger.info("\n" + "=" * 60)
-        logger.info("INSTANCE DELETED SUCCESSFULLY")
-        logger.info("=" * 60)
-        logger.info("\nAll resources have been removed.")
-        logger.info("Firewall rules may still exist. Remove manually if needed.")
+    def delete(self, resource):
+        """Delete one resource and wait for the operation"""
+        client_name, scope, _ = KINDS[resource.kind]
+        kwargs = {'project': self.project_id, resource.kind: resource.name}
+        if scope != 'global':
+            kwargs[scope] = resource.location
+
+        started = time.monotonic()
+        try:
+            with self.tracer.span(resource.name, 'gcp', track=resource.kind):
+                try:
+                    operation = self.waiter.call(lambda: self.session.client(client_name).delete(**kwargs),
+                                                 f"{resource.kind} {resource.name} deletion")
+                except NotFound:
+                    resource.result = 'gone'
+                    return resource
+                self.waiter.wait(operation, description=f"{resource.kind} {resource.name} deletion")
+            resource.result = 'deleted'
+        except Exception as e:
+            logger.error(f"Error deleting {resource.kind} {resource.name}: {e}")
+            resource.result = f"failed: {e}"
+        finally:
+            resource.seconds = time.monotonic() - started
+        return resource
+
+    def run(self, resources):
+        """Start each resource once every kind it depends on is gone; return the resources"""
+        pending = list(resources)
+        waiting = {kind: sum(r.kind == kind for r in resources) for kind in KINDS}
+        failed = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for resource in list(pending):
+                    deps = KINDS[resource.kind][2]
+                    if any(waiting[d] for d in deps):
+                        continue
+                    pending.remove(resource)
+                    blocked = sorted(failed & set(deps))
+                    if blocked:
+                        # Still referenced by what could not be deleted
+                        resource.result = f"skipped: {', '.join(blocked)} not deleted"
+                        failed.add(resource.kind)
+                        waiting[resource.kind] -= 1
+                        continue
+                    running[pool.submit(self.delete, resource)] = resource
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    resource = running.pop(future)
+                    if resource.result not in ('deleted', 'gone'):
+                        failed.add(resource.kind)
+                    waiting[resource.kind] -= 1
+        return resources
+
+
+def render_report(resources):
+    """Per-resource outcome and timing"""
+    header = f"{'KIND':<24} {'NAME':<32} {'LOCATION':<16} {'TIME':>7}  RESULT"
+    lines = [header, '-' * len(header)]
+    for r in resources:
+        lines.append(f"{r.kind:<24} {r.name:<32} {r.location or 'global':<16} {r.seconds:>6.1f}s  {r.result}")
+    return "\n".join(lines)
 
-        return True
 
+def destroy_resources(images=False, dry_run=False, assume_yes=False):
+    """Find, confirm and delete every resource the tooling created"""
+    session = get_session()
+    config = session.config
+
+    try:
+        resources = find_resources(session, images=images)
     except Exception as e:
-        logger.error(f"Error deleting instance: {e}")
+        logger.error(f"Error listing resources: {e}")
         return False
 
+    if not resources:
+        logger.info("Nothing to delete.")
+        return True
 
-if __name__ == "__main__":
-    success = destroy_instance()
+    # Confirm deletion
+    logger.warning("=" * 60)
+    logger.warning("WARNING: This will DELETE these resources and all their data!")
+    logger.warning("=" * 60)
+    for r in resources:
+        logger.warning(f"  {r.kind:<24} {r.name}" + (f" ({r.location})" if r.location else ""))
+    logger.warning(f"Project: {config['gcp']['project_id']}")
+
+    if dry_run:
+        return True
+    if not assume_yes:
+        confirmation = input("\nType 'DELETE' to confirm: ")
+        if confirmation != "DELETE":
+            logger.info("Destruction cancelled.")
+            return False
+
+    logger.info(f"\nDeleting {len(resources)} resource(s)...")
+    teardown = Teardown(session)
+    started = time.monotonic()
+    try:
+        teardown.run(resources)
+    finally:
+        teardown.tracer.export()
+
+    ok = all(r.result in ('deleted', 'gone') for r in resources)
+    logger.info("\n" + render_report(resources))
+    logger.info("\n" + "=" * 60)
+    logger.info(f"{'ALL RESOURCES DELETED' if ok else 'SOME RESOURCES WERE NOT DELETED'} "
+                f"in {time.monotonic() - started:.1f}s")
+    logger.info("=" * 60)
+    return ok
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Delete the instances, firewall rules and group resources")
+    parser.add_argument('--images', action='store_true', help='also delete the golden image family')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be deleted')
+    parser.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+    args = parser.parse_args()
+
+    success = destroy_resources(images=args.images, dry_run=args.dry_run, assume_yes=args.yes)
     sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Deploy a fleet of Aathira Trendz instances across several zones
+"""
+
+import os
+import sys
+import copy
+import time
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from artifact import artifact_mode
+from cdn_offload import log_asset_source
+from deploy import GCPDeployment
+from reconcile import Reconciler, apply, render_plan
+from session import get_session
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+def fleet_members(config):
+    """Return the instance specs declared under fleet.instances"""
+    members = config.get('fleet', {}).get('instances') or []
+    if not members:
+        # No fleet declared: the single configured instance is a fleet of one
+        members = [{'name': config['instance']['name'], 'zone': config['gcp']['zone']}]
+    return members
+
+
+def member_config(config, member):
+    """Build a per-instance config with the member's name, zone and overrides"""
+    member_cfg = copy.deepcopy(config)
+    member_cfg['gcp']['zone'] = member.get('zone', config['gcp']['zone'])
+    member_cfg['instance']['name'] = member['name']
+    for key in ('machine_type', 'boot_disk_size', 'boot_disk_type'):
+        if key in member:
+            member_cfg['instance'][key] = member[key]
+    return member_cfg
+
+
+class InstanceResult:
+    """Timings and outcome for one fleet member"""
+
+    def __init__(self, name, zone):
+        self.name = name
+        self.zone = zone
+        self.ip = None
+        self.timings = {}
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class FleetDeployment:
+    """Provisions several instances concurrently with per-zone limits"""
+
+    def __init__(self, config_path='config.yaml'):
+        """Members share the session's memoized credentials and clients"""
+        # One trace for the whole fleet, one track per instance
+        self.tracer = Tracer('fleet', get_session(config_path).config)
+        self.base = GCPDeployment(config_path, tracer=self.tracer)
+        self.config = self.base.config
+        fleet = self.config.get('fleet', {})
+        self.max_workers = fleet.get('max_workers', 8)
+        self.per_zone_limit = fleet.get('per_zone_limit', 2)
+        self.members = [
+            GCPDeployment(config=member_config(self.config, m), tracer=self.tracer)
+            for m in fleet_members(self.config)
+        ]
+        self._zone_slots = {}
+        self._zone_lock = threading.Lock()
+
+    def _zone_slot(self, zone):
+        """Return the semaphore bounding concurrent provisioning in a zone"""
+        with self._zone_lock:
+            if zone not in self._zone_slots:
+                self._zone_slots[zone] = threading.BoundedSemaphore(self.per_zone_limit)
+            return self._zone_slots[zone]
+
+    def _timed(self, result, phase, func, *args):
+        """Run one phase and record how long it took"""
+        started = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            result.timings[phase] = time.monotonic() - started
+
+    def deploy_member(self, member, changes=()):
+        """Apply the instance's planned changes, resolve its IP and wait for it to serve"""
+        name = member.config['instance']['name']
+        zone = member.config['gcp']['zone']
+        result = InstanceResult(name, zone)
+        started = time.monotonic()
+
+        try:
+            if not self._timed(result, 'create', apply, changes, self.tracer, 1, self._zone_slot):
+                raise RuntimeError("instance changes failed")
+
+            result.ip = self._timed(result, 'ip', member.get_instance_ip)
+            if not result.ip:
+                raise RuntimeError("no external IP")
+
+            if not self._timed(result, 'ready', member.wait_until_ready, result.ip):
+                raise RuntimeError("not ready before timeout")
+        except Exception as e:
+            logger.error(f"{name}: {e}")
+            result.error = str(e)
+
+        result.timings['total'] = time.monotonic() - started
+        return result
+
+    def deploy(self):
+        """Fan out firewall setup and provisioning, then print a summary"""
+        try:
+            return self.run_deploy()
+        finally:
+            self.tracer.export()
+
+    def run_deploy(self):
+        """Provision every member concurrently"""
+        names = [m.config['instance']['name'] for m in self.members]
+        zones = sorted({m.config['gcp']['zone'] for m in self.members})
+
+        logger.info("=" * 60)
+        logger.info(f"Deploying fleet of {len(names)} instance(s) across {len(zones)} zone(s)")
+        logger.info("=" * 60)
+
+        started = time.monotonic()
+        results = []
+
+        # Build and upload once; every member unpacks the same release
+        if artifact_mode(self.config):
+            logger.info("Building release artifact...")
+            with self.tracer.span('build release'):
+                self.base.prepare_release()
+            log_asset_source(self.config)
+            for member in self.members:
+                member.release = self.base.release
+                member.release_url = self.base.release_url
+
+        # One read of what exists; members only touch what differs
+        reconciler = Reconciler(self.base, self.members)
+        with self.tracer.span('plan', 'gcp'):
+            changes = reconciler.plan()
+        logger.info(render_plan(changes, reconciler.unchanged))
+        by_instance = {c.name: [c] for c in changes if c.kind == 'instance'}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fleet') as pool:
+            # Firewall rules are global and shared by the fleet through instance tags
+            firewall = pool.submit(apply, [c for c in changes if c.kind == 'firewall'], self.tracer)
+            futures = [pool.submit(self.deploy_member, m, by_instance.get(m.config['instance']['name'], []))
+                       for m in self.members]
+
+            for future in as_completed(futures):
+                result = future.result()
+                status = "ready" if result.ok else f"FAILED ({result.error})"
+                logger.info(f"{result.name} ({result.zone}): {status}")
+                results.append(result)
+
+            firewall.result()
+
+        self.print_summary(results, time.monotonic() - started)
+        return all(r.ok for r in results)
+
+    def print_summary(self, results, elapsed):
+        """Log a table of per-instance phase timings"""
+        header = f"{'INSTANCE':<28} {'ZONE':<16} {'IP':<16} {'CREATE':>8} {'READY':>8} {'TOTAL':>8}  STATUS"
+        logger.info("\n" + "=" * len(header))
+        logger.info(header)
+        logger.info("-" * len(header))
+
+        for r in sorted(results, key=lambda r: (r.zone, r.name)):
+            create = r.timings.get('create')
+            ready = r.timings.get('ready')
+            logger.info(
+                f"{r.name:<28} {r.zone:<16} {r.ip or '-':<16} "
+                f"{_seconds(create):>8} {_seconds(ready):>8} {_seconds(r.timings['total']):>8}  "
+                f"{'OK' if r.ok else 'FAILED'}"
+            )
+
+        ok = sum(1 for r in results if r.ok)
+        logger.info("-" * len(header))
+        logger.info(f"{ok}/{len(results)} instance(s) ready in {elapsed:.1f}s wall-clock")
+        logger.info("=" * len(header))
+
+
+def _seconds(value):
+    """Format an optional duration for the summary table"""
+    return f"{value:.1f}s" if value is not None else "-"
+
+
+def main():
+    """Main entry point"""
+    try:
+        os.chdir(Path(__file__).parent)
+        fleet = FleetDeployment()
+        success = fleet.deploy()
+        sys.exit(0 if success else 1)
+
+    except Exception as e:
+        logger.error(f"Fleet deployment failed with error: {e}", exc_info=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
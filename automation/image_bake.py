@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Bake a golden image with Node.js, Nginx and PM2 preinstalled
+
+The image is named after a fingerprint of its inputs (base image, Node.js
+version, package lists), so it is only rebuilt when one of them changes. A
+forced rebuild of unchanged inputs gets a timestamp suffix.
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+from google.cloud import compute_v1
+
+from deploy import GCPDeployment
+from session import get_session
+from tracing import Tracer, phase_preamble
+
+logger = logging.getLogger(__name__)
+
+BAKE_MARKER = "GOLDEN_IMAGE_BAKED"
+
+
+def record_golden_image(config_path, image, fingerprint):
+    """Write the baked image name and fingerprint into the golden_image block of config.yaml"""
+    with open(config_path, 'r') as f:
+        lines = f.read().splitlines(keepends=True)
+
+    start = next((i for i, line in enumerate(lines) if line.startswith('golden_image:')), None)
+    if start is None:
+        raise ValueError(f"No golden_image section in {config_path}")
+
+    for i in range(start + 1, len(lines)):
+        line = lines[i]
+        if line.strip() and not line.startswith((' ', '#')):
+            break
+        for key, value in (('image', image), ('fingerprint', fingerprint)):
+            if re.match(rf'^\s+{key}:', line):
+                indent = line[:len(line) - len(line.lstrip())]
+                lines[i] = f'{indent}{key}: "{value}"\n'
+
+    with open(config_path, 'w') as f:
+        f.writelines(lines)
+
+
+class ImageBaker:
+    """Builds the golden image from a temporary builder instance"""
+
+    def __init__(self, deployment, config_path='config.yaml'):
+        self.deployment = deployment
+        self.config = deployment.config
+        self.config_path = config_path
+        self.project_id = self.config['gcp']['project_id']
+        self.zone = self.config['gcp']['zone']
+        self.family = self.config['golden_image']['family']
+        self.images_client = deployment.session.client('ImagesClient')
+
+    def image_name(self, fingerprint):
+        """Versioned image name derived from the bake fingerprint, suffixed when already taken"""
+        name = f"{self.family}-{fingerprint}"
+        if self.image_exists(name):
+            name += time.strftime('-%Y%m%d%H%M%S', time.gmtime())
+        return name
+
+    def baked_image(self, fingerprint):
+        """Newest image of the family baked from these inputs, if any"""
+        images = [image for image in self.images_client.list(project=self.project_id,
+                                                             filter=f'family = "{self.family}"')
+                  if image.labels.get('bake-fingerprint') == fingerprint]
+        return max(images, key=lambda image: image.creation_timestamp).name if images else None
+
+    def image_exists(self, name):
+        """Check whether an image with this name already exists"""
+        try:
+            self.images_client.get(project=self.project_id, image=name)
+            return True
+        except Exception as e:
+            if getattr(e, 'code', None) == 404:
+                return False
+            raise
+
+    def bake_script(self, fingerprint):
+        """Startup script for the builder: install the system layer, then power off"""
+        base = self.deployment.generate_base_script()
+        return f"""#!/bin/bash
+set -e
+trap 'shutdown -h now' EXIT
+
+{phase_preamble(base)}
+{base}
+apt-get clean
+phase_done
+echo "{BAKE_MARKER} {fingerprint}" > /dev/ttyS0
+"""
+
+    def wait_for_shutdown(self, instance_name, timeout):
+        """Poll the builder until the bake script powers it off"""
+        deadline = time.monotonic() + timeout
+        interval = 5
+
+        while time.monotonic() < deadline:
+            instance = self.deployment.compute_client.get(
+                project=self.project_id,
+                zone=self.zone,
+                instance=instance_name
+            )
+            if instance.status == 'TERMINATED':
+                return
+            time.sleep(interval)
+            interval = min(30, interval * 1.5)
+
+        raise TimeoutError(f"Builder {instance_name} still running after {timeout}s")
+
+    def bake_succeeded(self, instance_name, fingerprint):
+        """Look for the bake marker in the builder's serial console and trace its phases"""
+        output = self.deployment.compute_client.get_serial_port_output(
+            project=self.project_id,
+            zone=self.zone,
+            instance=instance_name
+        )
+        self.deployment.tracer.phases(track=instance_name, prefix='bake').feed_all(output.contents)
+        return f"{BAKE_MARKER} {fingerprint}" in output.contents
+
+    def bake(self, force=False):
+        """Build the image if its inputs changed; return the image name"""
+        fingerprint = self.deployment.bake_fingerprint()
+
+        if not force:
+            image = self.baked_image(fingerprint)
+            if image:
+                logger.info(f"Golden image {image} is up to date, nothing to bake")
+                record_golden_image(self.config_path, image, fingerprint)
+                return image
+
+        image = self.image_name(fingerprint)
+
+        builder = f"{self.family}-builder-{fingerprint}"
+        stock_image = (
+            f"projects/{self.config['instance']['image_project']}/global/images/family/"
+            f"{self.config['instance']['image_family']}"
+        )
+        started = time.monotonic()
+
+        logger.info(f"Step 1: Creating builder instance {builder}...")
+        instance = self.deployment.build_instance(builder, stock_image, self.bake_script(fingerprint))
+        operation = self.deployment.compute_client.insert(
+            project=self.project_id,
+            zone=self.zone,
+            instance_resource=instance
+        )
+        self.deployment.wait_for_operation(operation, f"Builder {builder} creation")
+
+        try:
+            logger.info("Step 2: Installing the system layer...")
+            with self.deployment.span('builder run'):
+                self.wait_for_shutdown(builder, self.config['golden_image'].get('bake_timeout', 1800))
+            if not self.bake_succeeded(builder, fingerprint):
+                raise RuntimeError("Bake script failed, see the builder's serial console output")
+
+            logger.info(f"Step 3: Creating image {image} in family {self.family}...")
+            image_resource = compute_v1.Image()
+            image_resource.name = image
+            image_resource.family = self.family
+            image_resource.source_disk = f"projects/{self.project_id}/zones/{self.zone}/disks/{builder}"
+            image_resource.labels = {
+                'bake-fingerprint': fingerprint,
+                'nodejs': self.config['deployment']['nodejs_version'].replace('.', '-'),
+            }
+            operation = self.images_client.insert(project=self.project_id, image_resource=image_resource)
+            self.deployment.wait_for_operation(operation, f"Image {image} creation")
+        finally:
+            logger.info(f"Step 4: Deleting builder instance {builder}...")
+            operation = self.deployment.compute_client.delete(
+                project=self.project_id,
+                zone=self.zone,
+                instance=builder
+            )
+            self.deployment.wait_for_operation(operation, f"Builder {builder} deletion")
+
+        record_golden_image(self.config_path, image, fingerprint)
+        logger.info(f"Golden image {image} baked in {time.monotonic() - started:.0f}s")
+        return image
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Bake the golden image used by deploy.py")
+    parser.add_argument('--force', action='store_true', help='rebuild even if the inputs are unchanged')
+    args = parser.parse_args()
+
+    tracer = None
+    try:
+        os.chdir(Path(__file__).parent)
+        tracer = Tracer('bake', get_session().config)
+        baker = ImageBaker(GCPDeployment(tracer=tracer))
+        image = baker.bake(force=args.force)
+        tracer.export()
+
+        logger.info("\n" + "=" * 60)
+        logger.info(f"Golden image: {image}")
+        logger.info("New instances will boot from this image family.")
+        logger.info("=" * 60)
+        sys.exit(0)
+
+    except Exception as e:
+        logger.error(f"Image bake failed with error: {e}", exc_info=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
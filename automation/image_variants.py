@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Pre-render next/image variants so Nginx serves them instead of Node
+
+Every image under public/images is encoded once per width, quality and format
+that next/image requests, in parallel across a process pool. Variants are
+stored content-addressed in a cache with a manifest, so unchanged images are
+never re-encoded, and linked into the output directory as
+
+    <out>/<image name>/<width>-<quality>.<format>
+
+which Nginx maps /_next/image?url=/images/<name>&w=<width>&q=<quality> onto.
+Standard library plus Pillow only: deploys also run it on the instance.
+
+    python image_variants.py --src ../public/images --out image-variants
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import base64
+import hashlib
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# next/image deviceSizes: the srcset widths for `fill` and `sizes="100vw"` images
+DEFAULT_WIDTHS = [640, 750, 828, 1080, 1200, 1920, 2048, 3840]
+DEFAULT_QUALITIES = [75, 95]
+DEFAULT_FORMATS = ['avif', 'webp']
+SOURCE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+PIL_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF'}
+VARIANTS_DIR = 'image-variants'
+
+
+def file_digest(path):
+    """sha256 of a source image"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def variant_name(width, quality, fmt):
+    return f"{width}-{quality}.{fmt}"
+
+
+def supported_formats(formats):
+    """Formats the local Pillow can encode"""
+    from PIL import features
+
+    return [fmt for fmt in formats if features.check(fmt)]
+
+
+def encode(src, entry_dir, fmt, widths, qualities):
+    """Write every missing width/quality variant of one image in one format"""
+    from PIL import Image, ImageOps
+
+    written = []
+    with Image.open(src) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            transparent = image.mode in ('P', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+
+        for width in widths:
+            # Like next/image, never upscale past the source width
+            target = min(width, image.width)
+            resized = image if target == image.width else image.resize(
+                (target, round(image.height * target / image.width)), Image.LANCZOS)
+
+            for quality in qualities:
+                path = Path(entry_dir, variant_name(width, quality, fmt))
+                if path.exists():
+                    continue
+                tmp = path.with_suffix('.partial')
+                resized.save(tmp, PIL_FORMATS[fmt], quality=quality)
+                os.replace(tmp, path)
+                written.append(path.name)
+    return written
+
+
+def _link(src, dest):
+    """Hardlink a cached variant into place, copying across filesystems"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def build_variants(src_dir, out_dir, cache_dir, widths=DEFAULT_WIDTHS, qualities=DEFAULT_QUALITIES,
+                   formats=DEFAULT_FORMATS, workers=None):
+    """Encode what the cache lacks, then lay out out_dir; return run stats"""
+    started = time.monotonic()
+    src_dir, out_dir, cache_dir = Path(src_dir), Path(out_dir), Path(cache_dir)
+    formats = supported_formats(formats)
+    wanted = [variant_name(w, q, f) for f in formats for w in widths for q in qualities]
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache_dir / 'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    images = {p.name: file_digest(p) for p in sorted(src_dir.iterdir()) if p.suffix.lower() in SOURCE_SUFFIXES}
+    stale = {name: digest for name, digest in images.items()
+             if not set(wanted) <= set(manifest.get(digest, []))}
+
+    encoded = 0
+    if stale:
+        # fork works from `python3 -c` too, where there is no __main__ file to re-import
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+            jobs = []
+            for name, digest in stale.items():
+                entry_dir = cache_dir / digest[:16]
+                entry_dir.mkdir(exist_ok=True)
+                for fmt in formats:
+                    jobs.append(pool.submit(encode, src_dir / name, entry_dir, fmt, widths, qualities))
+            encoded = sum(len(job.result()) for job in jobs)
+
+        for digest in stale.values():
+            manifest[digest] = sorted(set(manifest.get(digest, [])) | set(wanted))
+        tmp = manifest_path.with_suffix('.partial')
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp, manifest_path)
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    for name, digest in images.items():
+        (out_dir / name).mkdir(parents=True)
+        for variant in wanted:
+            _link(cache_dir / digest[:16] / variant, out_dir / name / variant)
+    (out_dir / 'manifest.json').write_text(json.dumps(images, indent=2, sort_keys=True))
+
+    return {
+        'images': len(images),
+        'reused': len(images) - len(stale),
+        'encoded': encoded,
+        'formats': formats,
+        'seconds': round(time.monotonic() - started, 1),
+    }
+
+
+def image_settings(config):
+    """The images section of config.yaml with defaults filled in"""
+    images = config.get('images') or {}
+    return {
+        'enabled': images.get('enabled', True),
+        'widths': images.get('widths', DEFAULT_WIDTHS),
+        'qualities': images.get('qualities', DEFAULT_QUALITIES),
+        'formats': images.get('formats', DEFAULT_FORMATS),
+        'workers': images.get('workers', 0),
+    }
+
+
+def variants_script(config, app_dir, sudo=''):
+    """Shell steps that render variants on the instance for the app in app_dir"""
+    settings = image_settings(config)
+    if not settings['enabled']:
+        return ""
+
+    cache = f"/var/cache/{config['application']['name']}/images"
+    source = base64.b64encode(Path(__file__).read_bytes()).decode()
+    args = (f"--src {app_dir}/public/images --out {app_dir}/{VARIANTS_DIR} --cache {cache} "
+            f"--widths {' '.join(map(str, settings['widths']))} "
+            f"--qualities {' '.join(map(str, settings['qualities']))} "
+            f"--formats {' '.join(settings['formats'])} --workers {settings['workers']}")
+
+    return f"""# Pre-render next/image variants for Nginx
+{sudo}mkdir -p {cache}
+{sudo}chown $(id -un):$(id -gn) {cache}
+python3 -c "$(echo {source} | base64 -d)" {args}
+"""
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Pre-render next/image variants")
+    parser.add_argument('--src', default='../public/images')
+    parser.add_argument('--out', default=VARIANTS_DIR)
+    parser.add_argument('--cache', default='releases/image-cache')
+    parser.add_argument('--widths', nargs='+', type=int, default=DEFAULT_WIDTHS)
+    parser.add_argument('--qualities', nargs='+', type=int, default=DEFAULT_QUALITIES)
+    parser.add_argument('--formats', nargs='+', default=DEFAULT_FORMATS, choices=sorted(PIL_FORMATS))
+    parser.add_argument('--workers', type=int, default=0, help='processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        # Nginx falls back to Next.js for any variant that does not exist
+        print("IMAGE_VARIANTS skipped: Pillow is not installed")
+        return
+
+    stats = build_variants(args.src, args.out, args.cache, args.widths, args.qualities,
+                           args.formats, args.workers or None)
+    skipped = sorted(set(args.formats) - set(stats['formats']))
+    print(f"IMAGE_VARIANTS images={stats['images']} reused={stats['reused']} encoded={stats['encoded']} "
+          f"formats={','.join(stats['formats'])} took={stats['seconds']}s"
+          + (f" (no encoder for {','.join(skipped)})" if skipped else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
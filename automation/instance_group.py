@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Deploy Aathira Trendz as an autoscaled managed instance group
+
+The instance spec deploy.py creates is turned into an instance template. A
+regional managed instance group runs it behind a global HTTP load balancer,
+scales between min and max replicas on CPU and load balancer utilization,
+and recreates instances that fail the health check. Templates are named by a
+hash of their contents, so re-running with a new release or config rolls the
+group over to it without downtime, and templates older than the last
+keep_templates are deleted. Unchanged resources are left alone, and ones
+that drifted from the config are patched.
+
+    python instance_group.py              # create or update the group
+    python instance_group.py --replace    # also roll every instance over to a fresh boot
+"""
+
+import os
+import re
+import sys
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+from google.cloud import compute_v1
+
+from artifact import artifact_mode
+from cdn_offload import cdn_settings, ensure_backend_bucket, offload_enabled
+from deploy import GCPDeployment
+from readiness import Endpoint, ReadinessProbe, ReadinessTimeoutError
+from session import get_session
+from tracing import Tracer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Source ranges of Google's health checkers and HTTP load balancer proxies
+LB_SOURCE_RANGES = ["130.211.0.0/22", "35.191.0.0/16"]
+
+DEFAULTS = {
+    'group_name': None,
+    'min_replicas': 2,
+    'max_replicas': 10,
+    'cpu_target': 0.6,
+    'lb_utilization_target': 0.8,
+    'cool_down_seconds': 180,
+    'health_check_path': '/',
+    'autohealing_initial_delay': 600,
+    'zones': [],
+    'max_surge': 3,
+    'keep_templates': 2,
+}
+
+
+def group_settings(config):
+    """The autoscaling section merged over the defaults"""
+    settings = {**DEFAULTS, **(config.get('autoscaling') or {})}
+    settings['group_name'] = settings['group_name'] or f"{config['application']['name']}-web"
+    if settings['min_replicas'] > settings['max_replicas']:
+        raise ValueError("autoscaling.min_replicas is larger than max_replicas")
+    return settings
+
+
+def _short(url):
+    """Last path segment of a zonal resource URL (templates take bare names)"""
+    return url.rsplit('/', 1)[-1] if url else url
+
+
+def template_properties(instance):
+    """InstanceProperties for a template, carried over from a compute_v1.Instance spec"""
+    properties = compute_v1.InstanceProperties()
+    properties.machine_type = _short(instance.machine_type)
+    properties.tags = instance.tags
+    properties.network_interfaces = instance.network_interfaces
+    properties.metadata = instance.metadata
+    properties.service_accounts = instance.service_accounts
+
+    disks = []
+    for disk in instance.disks:
+        disk = compute_v1.AttachedDisk(disk)
+        disk.initialize_params.disk_type = _short(disk.initialize_params.disk_type)
+        disks.append(disk)
+    properties.disks = disks
+    return properties
+
+
+def _routes(url_map):
+    """Path rules of a URL map, comparable across the API and a freshly built map"""
+    return sorted((tuple(rule.paths), _short(rule.service))
+                  for matcher in url_map.path_matchers for rule in matcher.path_rules)
+
+
+def template_pattern(group_name):
+    """Matches the names of a group's templates, which end in a digest of their spec"""
+    return re.compile(rf"^{re.escape(group_name)}-[0-9a-f]{{10}}$")
+
+
+def _health_check_key(check):
+    """The fields of a health check the tooling sets"""
+    http = check.http_health_check
+    return (check.check_interval_sec, check.timeout_sec, check.healthy_threshold, check.unhealthy_threshold,
+            http.port, http.request_path)
+
+
+def _service_key(service):
+    """The fields of a backend service the tooling sets"""
+    return {
+        'health_checks': sorted(map(_short, service.health_checks)),
+        'backends': sorted((b.group, b.balancing_mode, round(b.max_utilization, 3), round(b.capacity_scaler, 3))
+                           for b in service.backends),
+        'port_name': service.port_name,
+        'timeout_sec': service.timeout_sec,
+    }
+
+
+def is_conflict(exc):
+    """True when an insert failed because the resource already exists"""
+    return getattr(exc, 'code', None) == 409
+
+
+class ManagedGroupDeployment:
+    """Creates or updates the template, group, autoscaler and load balancer"""
+
+    def __init__(self, config_path='config.yaml'):
+        """Reuses the single-instance deployment for the spec, clients and waiter"""
+        self.session = get_session(config_path)
+        self.tracer = Tracer('group', self.session.config)
+        self.base = GCPDeployment(config_path, tracer=self.tracer)
+        self.config = self.base.config
+        self.settings = group_settings(self.config)
+        self.name = self.settings['group_name']
+        self.project_id = self.config['gcp']['project_id']
+        self.region = self.config['gcp']['region']
+
+    def span(self, name, category='gcp', **attrs):
+        """Trace a step on the group's track"""
+        return self.tracer.span(name, category, track=self.name, **attrs)
+
+    def client(self, name):
+        """Memoized compute_v1 client from the shared session"""
+        return self.session.client(name)
+
+    def _call(self, func, description):
+        """Call an API method, retrying transient errors"""
+        return self.base.waiter.call(func, description)
+
+    def _operation(self, span, description, start):
+        """Start an operation (retrying transient errors) and wait for it"""
+        with self.span(span):
+            operation = self._call(start, description)
+        self.base.wait_for_operation(operation, description)
+
+    def _apply(self, description, insert, get):
+        """Insert a resource, or fetch it when it already exists; return (resource, created)"""
+        try:
+            self._operation(f"{description} insert", description, insert)
+            logger.info(f"{description} created")
+            return self._call(get, description), True
+        except Exception as e:
+            # Also the outcome of an insert retried after it went through
+            if not is_conflict(e):
+                raise
+            logger.info(f"{description} already exists")
+            return self._call(get, description), False
+
+    def build_template(self):
+        """Instance template from the same spec deploy.py uses for a single VM"""
+        instance = self.base.build_instance(self.name, self.base.source_image(), self.base.generate_startup_script())
+        properties = template_properties(instance)
+
+        # Identical specs map to the same template; any change gets a new one
+        digest = hashlib.sha256(compute_v1.InstanceProperties.to_json(properties, sort_keys=True).encode())
+        template = compute_v1.InstanceTemplate()
+        template.name = f"{self.name}-{digest.hexdigest()[:10]}"
+        template.properties = properties
+        return template
+
+    def ensure_firewall(self):
+        """Admit health checks and load balancer traffic to the group's instances"""
+        rule = compute_v1.Firewall()
+        rule.name = f"{self.name}-allow-lb"
+        rule.direction = "INGRESS"
+        rule.priority = 1000
+        rule.allowed = [compute_v1.Allowed(I_p_protocol="tcp", ports=["80"])]
+        rule.source_ranges = LB_SOURCE_RANGES
+        rule.target_tags = [self.name]
+
+        client = self.client('FirewallsClient')
+        self._apply(
+            f"Firewall rule {rule.name}",
+            lambda: client.insert(project=self.project_id, firewall_resource=rule),
+            lambda: client.get(project=self.project_id, firewall=rule.name),
+        )
+
+    def ensure_template(self):
+        """Template for the current spec, created when it is new"""
+        template = self.build_template()
+        client = self.client('InstanceTemplatesClient')
+        resource, _ = self._apply(
+            f"Instance template {template.name}",
+            lambda: client.insert(project=self.project_id, instance_template_resource=template),
+            lambda: client.get(project=self.project_id, instance_template=template.name),
+        )
+        return resource
+
+    def ensure_health_check(self):
+        """HTTP check through Nginx, shared by autohealing and the backend service"""
+        health_check = compute_v1.HealthCheck()
+        health_check.name = f"{self.name}-http"
+        health_check.type_ = "HTTP"
+        health_check.check_interval_sec = 10
+        health_check.timeout_sec = 5
+        health_check.healthy_threshold = 2
+        health_check.unhealthy_threshold = 3
+        health_check.http_health_check = compute_v1.HTTPHealthCheck(
+            port=80, request_path=self.settings['health_check_path']
+        )
+
+        client = self.client('HealthChecksClient')
+        get = lambda: client.get(project=self.project_id, health_check=health_check.name)  # noqa: E731
+        resource, created = self._apply(
+            f"Health check {health_check.name}",
+            lambda: client.insert(project=self.project_id, health_check_resource=health_check),
+            get,
+        )
+        if not created and _health_check_key(resource) != _health_check_key(health_check):
+            self._operation('health check patch', f"Health check {health_check.name} update",
+                            lambda: client.patch(project=self.project_id, health_check=health_check.name,
+                                                 health_check_resource=health_check))
+            resource = self._call(get, f"Health check {health_check.name}")
+        return resource
+
+    def prune_templates(self, current):
+        """Delete the group's templates beyond the newest keep_templates, keeping the current one"""
+        client = self.client('InstanceTemplatesClient')
+        matches = template_pattern(self.name).match
+        templates = self._call(lambda: list(client.list(project=self.project_id)), "Instance template list")
+        older = sorted((t for t in templates if matches(t.name) and t.name != current.name),
+                       key=lambda t: t.creation_timestamp, reverse=True)
+        for template in older[max(0, self.settings['keep_templates'] - 1):]:
+            try:
+                self._operation('template delete', f"Instance template {template.name} deletion",
+                                lambda: client.delete(project=self.project_id, instance_template=template.name))
+            except Exception as e:
+                # Still referenced, e.g. by a group version another deploy is rolling out
+                logger.warning(f"Instance template {template.name} not deleted: {e}")
+
+    def ensure_group(self, template, health_check, replace=False):
+        """Regional group on the template; an existing group is rolled over to it"""
+        version = compute_v1.InstanceGroupManagerVersion()
+        version.instance_template = template.self_link
+        # A new version name makes the group replace instances even on the same template
+        version.name = template.name + (f"-{datetime.now(timezone.utc):%Y%m%d%H%M%S}" if replace else "")
+
+        # Surge new instances in before old ones leave, so capacity never drops
+        update_policy = compute_v1.InstanceGroupManagerUpdatePolicy()
+        update_policy.type_ = "PROACTIVE"
+        update_policy.minimal_action = "REPLACE"
+        update_policy.max_surge = compute_v1.FixedOrPercent(fixed=self.settings['max_surge'])
+        update_policy.max_unavailable = compute_v1.FixedOrPercent(fixed=0)
+
+        manager = compute_v1.InstanceGroupManager()
+        manager.name = self.name
+        manager.base_instance_name = self.name
+        manager.versions = [version]
+        manager.target_size = self.settings['min_replicas']
+        manager.named_ports = [compute_v1.NamedPort(name="http", port=80)]
+        manager.update_policy = update_policy
+        manager.auto_healing_policies = [compute_v1.InstanceGroupManagerAutoHealingPolicy(
+            health_check=health_check.self_link,
+            initial_delay_sec=self.settings['autohealing_initial_delay'],
+        )]
+        if self.settings['zones']:
+            manager.distribution_policy = compute_v1.DistributionPolicy(zones=[
+                compute_v1.DistributionPolicyZoneConfiguration(zone=f"zones/{zone}")
+                for zone in self.settings['zones']
+            ])
+
+        client = self.client('RegionInstanceGroupManagersClient')
+        get = lambda: client.get(project=self.project_id, region=self.region, instance_group_manager=self.name)  # noqa: E731
+        resource, created = self._apply(
+            f"Instance group {self.name}",
+            lambda: client.insert(project=self.project_id, region=self.region,
+                                  instance_group_manager_resource=manager),
+            get,
+        )
+        if created or [v.name for v in resource.versions] == [version.name]:
+            return resource
+
+        # The autoscaler owns the size of an existing group
+        patch = compute_v1.InstanceGroupManager(
+            versions=[version], update_policy=update_policy, auto_healing_policies=manager.auto_healing_policies
+        )
+        self._operation('group patch', f"Rolling update of {self.name} to {version.name}",
+                        lambda: client.patch(project=self.project_id, region=self.region,
+                                             instance_group_manager=self.name, instance_group_manager_resource=patch))
+        return self._call(get, f"Instance group {self.name}")
+
+    def ensure_autoscaler(self, group):
+        """Scale on whichever of CPU and load balancer utilization asks for more"""
+        policy = compute_v1.AutoscalingPolicy()
+        policy.min_num_replicas = self.settings['min_replicas']
+        policy.max_num_replicas = self.settings['max_replicas']
+        # New instances run the startup script before their metrics should count
+        policy.cool_down_period_sec = self.settings['cool_down_seconds']
+        policy.cpu_utilization = compute_v1.AutoscalingPolicyCpuUtilization(
+            utilization_target=self.settings['cpu_target']
+        )
+        policy.load_balancing_utilization = compute_v1.AutoscalingPolicyLoadBalancingUtilization(
+            utilization_target=self.settings['lb_utilization_target']
+        )
+
+        autoscaler = compute_v1.Autoscaler()
+        autoscaler.name = self.name
+        autoscaler.target = group.self_link
+        autoscaler.autoscaling_policy = policy
+
+        client = self.client('RegionAutoscalersClient')
+        _, created = self._apply(
+            f"Autoscaler {self.name}",
+            lambda: client.insert(project=self.project_id, region=self.region, autoscaler_resource=autoscaler),
+            lambda: client.get(project=self.project_id, region=self.region, autoscaler=self.name),
+        )
+        if not created:
+            # Keep replica bounds and targets in step with the config
+            self._operation('autoscaler update', f"Autoscaler {self.name} update",
+                            lambda: client.update(project=self.project_id, region=self.region,
+                                                  autoscaler_resource=autoscaler))
+
+    def build_url_map(self, service):
+        """Everything to the group, except offloaded assets, which go to the CDN backend bucket"""
+        url_map = compute_v1.UrlMap(name=f"{self.name}-urlmap", default_service=service.self_link)
+        if offload_enabled(self.config):
+            with self.span('backend bucket'):
+                assets = ensure_backend_bucket(self.session, self.base.waiter)
+            prefix = cdn_settings(self.config)['prefix'].strip('/')
+            url_map.host_rules = [compute_v1.HostRule(hosts=['*'], path_matcher='assets')]
+            url_map.path_matchers = [compute_v1.PathMatcher(
+                name='assets',
+                default_service=service.self_link,
+                path_rules=[compute_v1.PathRule(paths=[f"/{prefix}/*"], service=assets.self_link)],
+            )]
+        return url_map
+
+    def ensure_load_balancer(self, group, health_check):
+        """Backend service, URL map, HTTP proxy and forwarding rule; return the frontend IP"""
+        backend = compute_v1.Backend()
+        backend.group = group.instance_group
+        # Utilization balancing is what the autoscaler's load balancing signal reads
+        backend.balancing_mode = "UTILIZATION"
+        backend.max_utilization = self.settings['lb_utilization_target']
+        backend.capacity_scaler = 1.0
+
+        service = compute_v1.BackendService()
+        service.name = f"{self.name}-backend"
+        service.protocol = "HTTP"
+        service.port_name = "http"
+        service.load_balancing_scheme = "EXTERNAL"
+        service.timeout_sec = 30
+        service.health_checks = [health_check.self_link]
+        service.backends = [backend]
+        desired_service = service
+        services = self.client('BackendServicesClient')
+        get = lambda: services.get(project=self.project_id, backend_service=desired_service.name)  # noqa: E731
+        service, created = self._apply(
+            f"Backend service {desired_service.name}",
+            lambda: services.insert(project=self.project_id, backend_service_resource=desired_service),
+            get,
+        )
+        if not created and _service_key(service) != _service_key(desired_service):
+            desired_service.fingerprint = service.fingerprint
+            self._operation('backend service patch', f"Backend service {desired_service.name} update",
+                            lambda: services.patch(project=self.project_id, backend_service=desired_service.name,
+                                                   backend_service_resource=desired_service))
+            service = self._call(get, f"Backend service {desired_service.name}")
+
+        desired = self.build_url_map(service)
+        url_maps = self.client('UrlMapsClient')
+        url_map, created = self._apply(
+            f"URL map {desired.name}",
+            lambda: url_maps.insert(project=self.project_id, url_map_resource=desired),
+            lambda: url_maps.get(project=self.project_id, url_map=desired.name),
+        )
+        if not created and _routes(url_map) != _routes(desired):
+            desired.fingerprint = url_map.fingerprint
+            self._operation('url map patch', f"URL map {desired.name} update",
+                            lambda: url_maps.patch(project=self.project_id, url_map=desired.name,
+                                                   url_map_resource=desired))
+            url_map = self._call(lambda: url_maps.get(project=self.project_id, url_map=desired.name),
+                                 f"URL map {desired.name}")
+
+        proxy = compute_v1.TargetHttpProxy(name=f"{self.name}-proxy", url_map=url_map.self_link)
+        proxies = self.client('TargetHttpProxiesClient')
+        proxy, _ = self._apply(
+            f"HTTP proxy {proxy.name}",
+            lambda: proxies.insert(project=self.project_id, target_http_proxy_resource=proxy),
+            lambda: proxies.get(project=self.project_id, target_http_proxy=proxy.name),
+        )
+
+        rule = compute_v1.ForwardingRule()
+        rule.name = f"{self.name}-frontend"
+        rule.target = proxy.self_link
+        rule.port_range = "80"
+        rule.I_p_protocol = "TCP"
+        rule.load_balancing_scheme = "EXTERNAL"
+        rules = self.client('GlobalForwardingRulesClient')
+        rule, _ = self._apply(
+            f"Forwarding rule {rule.name}",
+            lambda: rules.insert(project=self.project_id, forwarding_rule_resource=rule),
+            lambda: rules.get(project=self.project_id, forwarding_rule=rule.name),
+        )
+        return rule.I_p_address
+
+    def deploy(self, replace=False):
+        """Create or update everything; the phase trace is written either way"""
+        try:
+            return self.run_deploy(replace)
+        finally:
+            self.tracer.export()
+
+    def run_deploy(self, replace=False):
+        """Provision the group behind the load balancer and wait until it serves"""
+        logger.info("=" * 60)
+        logger.info(f"Deploying managed instance group {self.name} in {self.region}")
+        logger.info(f"Replicas: {self.settings['min_replicas']}-{self.settings['max_replicas']}")
+        logger.info("=" * 60)
+
+        if artifact_mode(self.config):
+            logger.info("\nBuilding release artifact...")
+            with self.span('build release', category='local'):
+                self.base.prepare_release()
+
+        # Instances only take traffic through the load balancer
+        logger.info("\nStep 1: Setting up the firewall rule...")
+        self.ensure_firewall()
+
+        logger.info("\nStep 2: Creating the instance template and health check...")
+        template = self.ensure_template()
+        health_check = self.ensure_health_check()
+
+        logger.info("\nStep 3: Creating the managed instance group and autoscaler...")
+        group = self.ensure_group(template, health_check, replace)
+        self.ensure_autoscaler(group)
+        self.prune_templates(template)
+
+        logger.info("\nStep 4: Creating the HTTP load balancer...")
+        address = self.ensure_load_balancer(group, health_check)
+
+        # New load balancers take a few minutes to start routing
+        logger.info(f"\nStep 5: Waiting for the load balancer at {address} to serve...")
+        probe = ReadinessProbe(
+            address,
+            [Endpoint('load balancer', 80, self.settings['health_check_path'])],
+            timeout=self.config['deployment'].get('readiness_timeout', 900)
+        )
+        try:
+            with self.span('readiness', category='http'):
+                probe.wait()
+        except ReadinessTimeoutError as e:
+            logger.error(f"Load balancer is not serving yet: {e}")
+            logger.info("Instance health: GCP Console > Compute Engine > Instance groups")
+            return False
+
+        logger.info("\n" + "=" * 60)
+        logger.info("MANAGED INSTANCE GROUP DEPLOYED!")
+        logger.info("=" * 60)
+        logger.info(f"\nGroup: {self.name} ({self.region}), template {template.name}")
+        logger.info(f"\nAccess your website at:")
+        logger.info(f"  → http://{address}")
+        logger.info("=" * 60)
+        return True
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Deploy an autoscaled managed instance group behind an HTTP load balancer")
+    parser.add_argument('--replace', action='store_true', help='replace every instance even if the template is unchanged')
+    args = parser.parse_args()
+
+    try:
+        os.chdir(Path(__file__).parent)
+        success = ManagedGroupDeployment().deploy(replace=args.replace)
+        sys.exit(0 if success else 1)
+
+    except Exception as e:
+        logger.error(f"Group deployment failed with error: {e}", exc_info=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Load test a deployed instance and gate deploys on latency regressions
+
+Replays a weighted mix of storefront pages, image variants and static assets
+over keep-alive connections, either closed-loop at a fixed concurrency or
+open-loop at a target request rate. Latencies go into an HDR-style histogram
+(log-linear buckets, two significant digits), and p50/p95/p99 are compared
+with a stored baseline.
+
+    python loadtest.py 34.12.0.7 --concurrency 32 --duration 30
+    python loadtest.py 34.12.0.7 --rps 200 --save-baseline
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+
+from session import get_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUTES = [
+    {'path': '/', 'weight': 6},
+    {'path': '/_next/image?url=%2Fimages%2Fhero1.jpg&w=1920&q=95', 'weight': 2,
+     'accept': 'image/avif,image/webp,*/*'},
+    {'path': '/_next/image?url=%2Fimages%2FWEB_BANNER_02_1.jpg&w=640&q=75', 'weight': 2,
+     'accept': 'image/avif,image/webp,*/*'},
+    {'path': '/images/hero4.jpg', 'weight': 1},
+]
+
+STATIC_ASSET = re.compile(r'/_next/static/[^"\'\s]+\.(?:js|css)')
+
+
+class Histogram:
+    """HDR-style latency histogram in microseconds
+
+    Values are bucketed by power of two, and each power of two is split into
+    linear sub-buckets, so every recorded value keeps two significant digits
+    whatever its magnitude, in constant memory.
+    """
+
+    def __init__(self, significant_figures=2):
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _key(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return shift, value >> shift
+
+    def record(self, seconds):
+        value = max(1, int(seconds * 1_000_000))
+        key = self._key(value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def percentile(self, p):
+        """Highest value equivalent to the p-th percentile, in milliseconds"""
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(p / 100 * self.total))
+        seen = 0
+        for shift, sub in sorted(self.counts, key=lambda k: k[1] << k[0]):
+            seen += self.counts[(shift, sub)]
+            if seen >= target:
+                return min(((sub + 1) << shift) - 1, self.max) / 1000
+        return self.max / 1000
+
+    def summary(self):
+        return {
+            'p50': round(self.percentile(50), 2),
+            'p95': round(self.percentile(95), 2),
+            'p99': round(self.percentile(99), 2),
+            'max': round(self.max / 1000, 2),
+            'mean': round(self.sum / self.total / 1000, 2) if self.total else 0.0,
+        }
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, path, accept='*/*'):
+        """Send a GET and read the whole response; return (status, body bytes)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+
+        self.writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: {accept}\r\n"
+            f"Accept-Encoding: gzip, br\r\nUser-Agent: aathira-loadtest\r\n\r\n".encode())
+        try:
+            return await asyncio.wait_for(self._read_response(), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            size = 0
+            while True:
+                chunk = int((await self.reader.readline()).split(b';')[0], 16)
+                if chunk == 0:
+                    await self.reader.readline()
+                    break
+                await self.reader.readexactly(chunk + 2)
+                size += chunk
+        else:
+            size = int(headers.get('content-length', 0))
+            await self.reader.readexactly(size)
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, size
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadTest:
+    """Drive a weighted route mix against one host and collect latencies"""
+
+    def __init__(self, host, port=80, routes=None, concurrency=16, rps=None, duration=30.0,
+                 warmup=2.0, timeout=10.0, seed=None):
+        self.host = host
+        self.port = port
+        self.routes = list(routes or DEFAULT_ROUTES)
+        self.concurrency = concurrency
+        self.rps = rps
+        self.duration = duration
+        self.warmup = warmup
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.histograms = {}
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+
+    def pick(self):
+        return self.random.choices(self.routes, weights=[r.get('weight', 1) for r in self.routes])[0]
+
+    async def discover_static(self, weight=2):
+        """Add the hashed JS/CSS assets the home page references to the mix"""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+            writer.write(f"GET / HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n\r\n".encode())
+            page = (await asyncio.wait_for(reader.read(), self.timeout)).decode(errors='replace')
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            return []
+
+        assets = sorted(set(STATIC_ASSET.findall(page)))
+        self.routes += [{'path': path, 'weight': weight / len(assets)} for path in assets]
+        return assets
+
+    def _record(self, route, started, outcome):
+        """Count one response; latency runs from started (send or scheduled time)"""
+        if started < self.measure_from:
+            return
+        path = route['path']
+        if isinstance(outcome, Exception):
+            name = type(outcome).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return
+        status, size = outcome
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+        self.histograms.setdefault(path, Histogram()).record(time.monotonic() - started)
+
+    async def _send(self, conn, route):
+        try:
+            return await conn.request(route['path'], route.get('accept', '*/*'))
+        except (OSError, asyncio.TimeoutError, ValueError, asyncio.IncompleteReadError) as e:
+            return e
+
+    async def _closed_loop_worker(self, deadline):
+        conn = Connection(self.host, self.port, self.timeout)
+        while time.monotonic() < deadline:
+            route = self.pick()
+            started = time.monotonic()
+            self._record(route, started, await self._send(conn, route))
+        conn.close()
+
+    async def _open_loop(self, deadline):
+        """Issue requests on a fixed schedule; latency counts from the scheduled time
+
+        Measuring from the schedule rather than the send keeps queueing delay
+        in the numbers when the server falls behind (no coordinated omission).
+        """
+        idle = asyncio.Queue()
+        for _ in range(self.concurrency):
+            idle.put_nowait(Connection(self.host, self.port, self.timeout))
+
+        async def fire(route, scheduled):
+            conn = await idle.get()
+            try:
+                self._record(route, scheduled, await self._send(conn, route))
+            finally:
+                idle.put_nowait(conn)
+
+        interval = 1.0 / self.rps
+        scheduled = time.monotonic()
+        tasks = set()
+        while scheduled < deadline:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(fire(self.pick(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += interval
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.timeout)
+        while not idle.empty():
+            idle.get_nowait().close()
+
+    async def run(self):
+        started = time.monotonic()
+        self.measure_from = started + self.warmup
+        deadline = self.measure_from + self.duration
+
+        if self.rps:
+            await self._open_loop(deadline)
+        else:
+            await asyncio.gather(*(self._closed_loop_worker(deadline) for _ in range(self.concurrency)))
+        return self.result(time.monotonic() - self.measure_from)
+
+    def result(self, elapsed):
+        overall = Histogram()
+        for histogram in self.histograms.values():
+            overall.merge(histogram)
+        requests = overall.total + sum(self.errors.values())
+        non_2xx = sum(count for status, count in self.statuses.items() if status >= 400)
+
+        return {
+            'host': self.host,
+            'mode': f"{self.rps} rps" if self.rps else f"{self.concurrency} connections",
+            'duration': round(elapsed, 1),
+            'requests': requests,
+            'rps': round(overall.total / elapsed, 1) if elapsed > 0 else 0.0,
+            'mb_per_s': round(self.bytes / elapsed / 1_000_000, 2) if elapsed > 0 else 0.0,
+            'error_rate': round((sum(self.errors.values()) + non_2xx) / requests, 4) if requests else 1.0,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'errors': self.errors,
+            'latency_ms': overall.summary(),
+            'routes': {path: dict(h.summary(), count=h.total) for path, h in sorted(self.histograms.items())},
+        }
+
+
+def render_report(result):
+    """Human-readable report of a run"""
+    lat = result['latency_ms']
+    lines = [
+        f"{result['host']}: {result['requests']} requests in {result['duration']}s ({result['mode']})",
+        f"throughput {result['rps']} req/s, {result['mb_per_s']} MB/s, error rate {result['error_rate'] * 100:.2f}%",
+        f"latency ms  p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}",
+        "",
+        f"{'ROUTE':<60} {'COUNT':>7} {'P50':>8} {'P95':>8} {'P99':>8}",
+    ]
+    for path, r in result['routes'].items():
+        label = path if len(path) <= 60 else path[:57] + '...'
+        lines.append(f"{label:<60} {r['count']:>7} {r['p50']:>8} {r['p95']:>8} {r['p99']:>8}")
+    if result['errors']:
+        lines.append(f"errors: {result['errors']}")
+    return "\n".join(lines)
+
+
+def compare(result, baseline, latency_tolerance=0.25, throughput_tolerance=0.2, max_error_rate=0.01):
+    """Regressions of result against baseline, as human-readable strings"""
+    regressions = []
+    for key in ('p50', 'p95', 'p99'):
+        now, before = result['latency_ms'][key], baseline['latency_ms'][key]
+        if before and now > before * (1 + latency_tolerance):
+            regressions.append(f"{key} latency {now}ms vs baseline {before}ms (+{(now / before - 1) * 100:.0f}%)")
+    if baseline['rps'] and result['rps'] < baseline['rps'] * (1 - throughput_tolerance):
+        regressions.append(f"throughput {result['rps']} req/s vs baseline {baseline['rps']} req/s")
+    if result['error_rate'] > max_error_rate:
+        regressions.append(f"error rate {result['error_rate'] * 100:.2f}% above {max_error_rate * 100:.2f}%")
+    return regressions
+
+
+def loadtest_settings(config):
+    """The loadtest section of config.yaml with defaults filled in"""
+    return {
+        'gate': False,
+        'concurrency': 16,
+        'rps': None,
+        'duration': 20,
+        'warmup': 3,
+        'routes': DEFAULT_ROUTES,
+        'discover_static': True,
+        'baseline_file': 'loadtest-baseline.json',
+        'latency_tolerance': 0.25,
+        'throughput_tolerance': 0.2,
+        'max_error_rate': 0.01,
+        **(config.get('loadtest') or {}),
+    }
+
+
+def run_loadtest(host, settings, port=80):
+    """Run one load test from settings; return the result dict"""
+    test = LoadTest(host, port, routes=settings['routes'], concurrency=settings['concurrency'],
+                    rps=settings['rps'], duration=settings['duration'], warmup=settings['warmup'])
+
+    async def go():
+        if settings['discover_static']:
+            await test.discover_static()
+        return await test.run()
+
+    return asyncio.run(go())
+
+
+def check_baseline(result, settings):
+    """Compare a run with the stored baseline; return regressions (none without a baseline)"""
+    baseline_path = Path(settings['baseline_file'])
+    if not baseline_path.exists():
+        return []
+    regressions = compare(result, json.loads(baseline_path.read_text()), settings['latency_tolerance'],
+                          settings['throughput_tolerance'], settings['max_error_rate'])
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    return regressions
+
+
+def save_baseline(result, settings):
+    Path(settings['baseline_file']).write_text(json.dumps(result, indent=2))
+    logger.info(f"Saved baseline to {settings['baseline_file']}")
+
+
+def gate(config, host, port=80):
+    """Post-deploy gate: load test and compare with the baseline; True when no regression"""
+    settings = loadtest_settings(config)
+
+    logger.info(f"Load testing {host} for {settings['duration']}s...")
+    result = run_loadtest(host, settings, port)
+    logger.info(render_report(result))
+
+    if not Path(settings['baseline_file']).exists():
+        # The first gated deploy sets the bar for the following ones
+        save_baseline(result, settings)
+        return result['error_rate'] <= settings['max_error_rate']
+    return not check_baseline(result, settings)
+
+
+def main():
+    """Main entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Load test a deployed instance")
+    parser.add_argument('host', nargs='?', help='instance address (default: the configured instance)')
+    parser.add_argument('--port', type=int, default=80)
+    parser.add_argument('--concurrency', type=int, help='connections (closed loop), or the pool size with --rps')
+    parser.add_argument('--rps', type=float, help='open loop at this request rate')
+    parser.add_argument('--duration', type=float)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--no-compare', action='store_true', help='do not compare with the baseline')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+
+    session = get_session()
+    settings = loadtest_settings(session.config)
+    for key in ('concurrency', 'rps', 'duration'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+
+    host = args.host
+    if not host:
+        from update import get_instance_ip
+        host = get_instance_ip(session)
+        if not host:
+            logger.error("Instance has no external IP; pass the host explicitly")
+            sys.exit(1)
+
+    result = run_loadtest(host, settings, args.port)
+    print(json.dumps(result, indent=2) if args.json else render_report(result))
+
+    if args.save_baseline:
+        save_baseline(result, settings)
+    elif not args.no_compare and Path(settings['baseline_file']).exists():
+        if check_baseline(result, settings):
+            sys.exit(1)
+        logger.info("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
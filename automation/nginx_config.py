@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Generate the tuned Nginx site for the application from config.yaml
+
+The site proxies to a keepalive upstream pool, micro-caches storefront pages
+for a few seconds (serving stale while one request refreshes), and serves
+hashed Next.js assets from disk with immutable cache headers, using the .gz
+and .br siblings written by precompress.py. Deploys purge the cache.
+In static mode there is no upstream: the export is served from disk with
+sendfile and an open file cache.
+
+    python nginx_config.py            # print the site config
+    python nginx_config.py --check    # validate it with the local nginx -t
+"""
+
+import re
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from image_variants import VARIANTS_DIR, image_settings
+from precompress import compression_settings
+from session import get_session
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'worker_connections': 4096,
+    'worker_rlimit_nofile': 16384,
+    'keepalive_connections': 32,
+    'keepalive_timeout': 65,
+    'micro_cache_seconds': 5,
+    'cache_size': '256m',
+    'cache_bypass_paths': ['/api/'],
+    'assets_max_age': 604800,
+}
+
+
+def nginx_settings(config):
+    """The nginx section of config.yaml with defaults filled in"""
+    return {**DEFAULTS, **(config.get('nginx') or {})}
+
+
+def _ident(config):
+    """Application name usable in nginx identifiers"""
+    return re.sub(r'[^A-Za-z0-9_]', '_', config['application']['name'])
+
+
+def cache_path(config):
+    """Directory holding the proxy micro-cache"""
+    return f"/var/cache/nginx/{config['application']['name']}"
+
+
+def site_path(config):
+    """Location of the generated site on the instance"""
+    return f"/etc/nginx/sites-available/{config['application']['name']}"
+
+
+def brotli_snippet(config):
+    """Include holding brotli_static, filled in when the nginx brotli module is loaded"""
+    return f"/etc/nginx/snippets/{config['application']['name']}-brotli.conf"
+
+
+def _compression(config):
+    """Server directives serving the pre-compressed siblings of files on disk"""
+    if not compression_settings(config)['enabled']:
+        return ""
+    return f"""
+    # .gz/.br siblings written at deploy time (precompress.py): no per-request compression
+    gzip_static on;
+    gzip_vary on;
+    include {brotli_snippet(config)};
+"""
+
+
+def _proxy_headers(ident):
+    return f"""        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection ${ident}_connection;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;"""
+
+
+def _image_maps(ident):
+    """Maps resolving a /_next/image request to a pre-rendered variant file"""
+    return f"""
+# Pre-rendered next/image variants: best format the client accepts, then webp
+map $http_accept ${ident}_image_ext {{
+    default      none;
+    ~image/avif  avif;
+    ~image/webp  webp;
+}}
+
+map $http_accept ${ident}_image_alt {{
+    default      none;
+    ~image/webp  webp;
+}}
+
+map $arg_url ${ident}_image_name {{
+    default  "";
+    ~^%2Fimages%2F(?<image>[A-Za-z0-9._-]+)$  $image;
+}}
+
+map "$arg_w-$arg_q" ${ident}_image_size {{
+    default  "";
+    ~^[0-9]+-[0-9]+$  "$arg_w-$arg_q";
+}}
+"""
+
+
+def _image_location(config, ident, fallback):
+    """Serve pre-rendered variants from disk, handing anything missing to the fallback location"""
+    # releases imports this module for purge_script
+    from releases import release_root
+
+    return f"""    location = /_next/image {{
+        root {release_root(config)}/current/{VARIANTS_DIR};
+        types {{ image/avif avif; image/webp webp; }}
+        try_files /${ident}_image_name/${ident}_image_size.${ident}_image_ext
+                  /${ident}_image_name/${ident}_image_size.${ident}_image_alt
+                  @{fallback};
+        add_header Vary Accept always;
+        add_header Cache-Control "public, max-age={nginx_settings(config)['assets_max_age']}" always;
+    }}
+"""
+
+
+def generate_static_site(config):
+    """Render the site for a static export: files only, no upstream"""
+    # releases imports this module for purge_script
+    from releases import release_root
+
+    settings = nginx_settings(config)
+    ident = _ident(config)
+    server_name = config['deployment'].get('domain') or '_'
+    max_age = settings['assets_max_age']
+
+    images = image_maps = ""
+    if image_settings(config)['enabled']:
+        image_maps = _image_maps(ident)
+        images = f"""    # Pre-rendered variants, else the original image at full size
+{_image_location(config, ident, f'{ident}_original_image')}
+    location @{ident}_original_image {{
+        try_files /images/${ident}_image_name =404;
+        add_header Cache-Control "public, max-age={max_age}" always;
+    }}
+
+"""
+
+    return f"""# Generated by automation/nginx_config.py - edit config.yaml instead
+# deployment.mode "static": the export is served from disk, no Node server
+{image_maps}
+server {{
+    listen 80;
+    server_name {server_name};
+    root {release_root(config)}/current;
+
+    keepalive_timeout {settings['keepalive_timeout']};
+    sendfile on;
+    tcp_nopush on;
+    tcp_nodelay on;
+    open_file_cache max=10000 inactive=60s;
+    open_file_cache_valid 30s;
+    open_file_cache_errors on;
+{_compression(config)}
+    # Hashed build output never changes under the same URL
+    location /_next/static/ {{
+        try_files $uri =404;
+        add_header Cache-Control "public, max-age=31536000, immutable" always;
+    }}
+
+    location /images/ {{
+        try_files $uri =404;
+        add_header Cache-Control "public, max-age={max_age}" always;
+    }}
+
+{images}    # Pages are revalidated so a deploy shows up on the next request
+    location / {{
+        try_files $uri $uri.html $uri/index.html =404;
+        add_header Cache-Control "public, max-age=0, must-revalidate" always;
+    }}
+
+    error_page 404 /404.html;
+}}
+"""
+
+
+def generate_site(config):
+    """Render the site: upstream, cache zone and server block"""
+    # artifact imports this module through releases
+    from artifact import static_mode
+
+    if static_mode(config):
+        return generate_static_site(config)
+
+    # releases imports this module for purge_script
+    from releases import release_root
+
+    settings = nginx_settings(config)
+    ident = _ident(config)
+    port = config['application']['port']
+    server_name = config['deployment'].get('domain') or '_'
+    micro = settings['micro_cache_seconds']
+    headers = _proxy_headers(ident)
+
+    bypass = "\n".join(
+        f"""    location {path} {{
+        proxy_pass http://{ident}_upstream;
+{headers}
+    }}
+""" for path in settings['cache_bypass_paths'])
+
+    images = ""
+    image_maps = ""
+    if image_settings(config)['enabled']:
+        image_maps = _image_maps(ident)
+        images = f"""    # Serve pre-rendered variants from disk; Next.js renders anything missing
+{_image_location(config, ident, f'{ident}_next_image')}
+    location @{ident}_next_image {{
+        proxy_pass http://{ident}_upstream;
+{headers}
+        proxy_cache {ident}_cache;
+        proxy_cache_key "$request_uri$http_accept";
+        proxy_cache_valid 200 1d;
+        add_header X-Cache-Status $upstream_cache_status always;
+    }}
+
+"""
+
+    page_cache = ""
+    if micro:
+        # Responses that set cookies are never stored
+        page_cache = f"""        proxy_cache {ident}_cache;
+        proxy_cache_valid 200 301 302 {micro}s;
+        proxy_ignore_headers Cache-Control Expires;
+        proxy_cache_bypass $http_authorization $http_upgrade;
+        proxy_no_cache $http_authorization;
+        proxy_cache_use_stale error timeout updating http_500 http_502 http_503 http_504;
+        proxy_cache_background_update on;
+        proxy_cache_lock on;
+        add_header X-Cache-Status $upstream_cache_status always;
+"""
+
+    return f"""# Generated by automation/nginx_config.py - edit config.yaml instead
+upstream {ident}_upstream {{
+    server 127.0.0.1:{port};
+    keepalive {settings['keepalive_connections']};
+}}
+
+# Keep upstream connections open unless the client asks for a WebSocket upgrade
+map $http_upgrade ${ident}_connection {{
+    default upgrade;
+    ''      '';
+}}
+{image_maps}
+proxy_cache_path {cache_path(config)} levels=1:2 keys_zone={ident}_cache:10m
+                 max_size={settings['cache_size']} inactive=10m use_temp_path=off;
+
+server {{
+    listen 80;
+    server_name {server_name};
+
+    keepalive_timeout {settings['keepalive_timeout']};
+{_compression(config)}
+    # Hashed build output never changes under the same URL. It is served from the
+    # release on disk; Next.js answers for anything missing there
+    location ~ ^/_next/static/(?<{ident}_asset>.+)$ {{
+        root {release_root(config)}/current/.next/static;
+        try_files /${ident}_asset @{ident}_next_static;
+        add_header Cache-Control "public, max-age=31536000, immutable" always;
+    }}
+
+    location @{ident}_next_static {{
+        proxy_pass http://{ident}_upstream;
+{headers}
+        proxy_cache {ident}_cache;
+        proxy_cache_valid 200 365d;
+        proxy_hide_header Cache-Control;
+        add_header Cache-Control "public, max-age=31536000, immutable" always;
+        add_header X-Cache-Status $upstream_cache_status always;
+    }}
+
+    location /images/ {{
+        root {release_root(config)}/current/public;
+        try_files $uri @{ident}_next_images;
+        add_header Cache-Control "public, max-age={settings['assets_max_age']}" always;
+    }}
+
+    location @{ident}_next_images {{
+        proxy_pass http://{ident}_upstream;
+{headers}
+        proxy_cache {ident}_cache;
+        proxy_cache_valid 200 1d;
+        proxy_hide_header Cache-Control;
+        add_header Cache-Control "public, max-age={settings['assets_max_age']}" always;
+        add_header X-Cache-Status $upstream_cache_status always;
+    }}
+
+{images}{bypass}
+    location / {{
+        proxy_pass http://{ident}_upstream;
+{headers}
+{page_cache}    }}
+}}
+"""
+
+
+def site_install_script(config, sudo=''):
+    """Shell steps that tune nginx.conf, write the site, purge the cache and restart nginx"""
+    settings = nginx_settings(config)
+    site = site_path(config)
+
+    return f"""# Tune worker limits in the main nginx.conf
+{sudo}sed -i -E 's/^(\\s*)worker_connections\\s+[0-9]+;/\\1worker_connections {settings['worker_connections']};/' /etc/nginx/nginx.conf
+grep -q '^worker_rlimit_nofile' /etc/nginx/nginx.conf || {sudo}sed -i '/^worker_processes/a worker_rlimit_nofile {settings['worker_rlimit_nofile']};' /etc/nginx/nginx.conf
+
+# Write the generated site
+{sudo}mkdir -p {cache_path(config)}
+{sudo}chown www-data:www-data {cache_path(config)}
+{sudo}tee {site} > /dev/null << 'NGINX_EOF'
+{generate_site(config)}NGINX_EOF
+
+{sudo}ln -sf {site} /etc/nginx/sites-enabled/
+{sudo}rm -f /etc/nginx/sites-enabled/default
+
+# brotli_static needs the nginx brotli module (libnginx-mod-http-brotli-static)
+{sudo}mkdir -p /etc/nginx/snippets
+if grep -qs brotli_static /etc/nginx/modules-enabled/*; then
+    echo "brotli_static on;" | {sudo}tee {brotli_snippet(config)} > /dev/null
+else
+    {sudo}truncate -s 0 {brotli_snippet(config)}
+fi
+
+{purge_script(config)}{sudo}nginx -t && {sudo}systemctl restart nginx
+"""
+
+
+def purge_script(config):
+    """Shell steps that drop every cached response after a deploy"""
+    # The cache belongs to www-data, so this runs privileged whoever runs the script.
+    # Nginx may add or expire entries meanwhile, and a rerun on an empty cache is a no-op
+    return f"""# Purge the Nginx micro-cache so the new release is served immediately
+if sudo test -d {cache_path(config)}; then
+    sudo find {cache_path(config)} -mindepth 1 -ignore_readdir_race -delete
+fi
+"""
+
+
+def validate(config):
+    """Run nginx -t on the generated site inside a throwaway prefix; return (ok, output)"""
+    nginx = shutil.which('nginx')
+    if not nginx:
+        return None, "nginx is not installed locally"
+
+    with tempfile.TemporaryDirectory() as prefix:
+        site = (generate_site(config).replace(cache_path(config), f"{prefix}/cache")
+                .replace(brotli_snippet(config), f"{prefix}/brotli.conf"))
+        Path(prefix, 'brotli.conf').write_text("")
+        Path(prefix, 'logs').mkdir()
+        Path(prefix, 'site.conf').write_text(site)
+        Path(prefix, 'nginx.conf').write_text(f"""pid {prefix}/nginx.pid;
+error_log {prefix}/logs/error.log;
+events {{ worker_connections {nginx_settings(config)['worker_connections']}; }}
+http {{
+    access_log off;
+    include {prefix}/site.conf;
+}}
+""")
+        result = subprocess.run([nginx, '-t', '-p', prefix, '-c', f"{prefix}/nginx.conf"],
+                                capture_output=True, text=True)
+        return result.returncode == 0, (result.stdout + result.stderr).strip()
+
+
+def main():
+    """Main entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Generate the tuned Nginx site config")
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--check', action='store_true', help='validate with the local nginx -t')
+    args = parser.parse_args()
+
+    config = get_session(args.config).config
+
+    if not args.check:
+        print(generate_site(config), end='')
+        return
+
+    ok, output = validate(config)
+    if ok is None:
+        logger.warning(f"Skipped: {output}")
+        sys.exit(2)
+    logger.info(output)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Wait for Compute Engine operations to complete
+"""
+
+import time
+import random
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying while polling an operation
+TRANSIENT_CODES = {429, 500, 502, 503, 504}
+
+# The server-side wait() call returns after at most ~2 minutes
+MAX_SERVER_WAIT = 120
+
+# Added to the RPC deadline of wait() so it outlasts the server-side wait
+RPC_HEADROOM = 15
+
+
+class OperationError(Exception):
+    """Raised when a GCP operation finishes with errors"""
+
+    def __init__(self, operation, errors):
+        self.operation = operation
+        self.errors = errors
+        details = "; ".join(f"{code}: {message}" for code, message in errors)
+        super().__init__(f"Operation {operation_name(operation)} failed: {details}")
+
+
+class OperationTimeoutError(Exception):
+    """Raised when a GCP operation does not finish before its deadline"""
+
+    def __init__(self, operation, timeout):
+        self.operation = operation
+        self.timeout = timeout
+        super().__init__(f"Operation {operation_name(operation)} did not finish within {timeout}s")
+
+
+def operation_name(operation):
+    """Return the name of an operation (plain or extended)"""
+    return getattr(operation, 'name', None) or '<unknown>'
+
+
+def is_done(operation):
+    """Check whether an operation has reached the DONE state"""
+    status = getattr(operation, 'status', None)
+    return getattr(status, 'name', status) == 'DONE'
+
+
+def operation_errors(operation):
+    """Collect (code, message) pairs from a finished operation"""
+    error = getattr(operation, 'error', None)
+    errors = [(e.code, e.message) for e in (getattr(error, 'errors', None) or [])]
+
+    if not errors and getattr(operation, 'http_error_status_code', 0):
+        errors.append((
+            operation.http_error_status_code,
+            getattr(operation, 'http_error_message', '') or 'HTTP error'
+        ))
+    return errors
+
+
+def _last_segment(url):
+    """Return the trailing path segment of a resource URL"""
+    return url.rstrip('/').split('/')[-1] if url else None
+
+
+def _is_transient(exc):
+    """Check whether an API error is worth retrying"""
+    # The REST transport raises requests' own exceptions, which are not the builtins
+    if isinstance(exc, (ConnectionError, TimeoutError, requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout)):
+        return True
+    return getattr(exc, 'code', None) in TRANSIENT_CODES
+
+
+class OperationWaiter:
+    """Tracks zonal, regional and global operations until they finish"""
+
+    def __init__(self, project_id, credentials=None, zone_client=None, region_client=None,
+                 global_client=None, timeout=600, initial_delay=1.0, max_delay=15.0,
+                 multiplier=2.0, jitter=0.5, sleep=time.sleep, clock=time.monotonic):
+        """Initialize the waiter; clients are created lazily when not supplied"""
+        self.project_id = project_id
+        self.credentials = credentials
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.sleep = sleep
+        self.clock = clock
+        self._clients = {
+            'zone': zone_client,
+            'region': region_client,
+            'global': global_client,
+        }
+
+    def _client(self, scope):
+        """Return (and lazily create) the operations client for a scope"""
+        if self._clients[scope] is None:
+            from google.cloud import compute_v1
+
+            client_class = {
+                'zone': compute_v1.ZoneOperationsClient,
+                'region': compute_v1.RegionOperationsClient,
+                'global': compute_v1.GlobalOperationsClient,
+            }[scope]
+            self._clients[scope] = client_class(credentials=self.credentials)
+        return self._clients[scope]
+
+    def _poll(self, operation, timeout):
+        """Block server-side until the operation is done or the wait expires"""
+        kwargs = {'project': self.project_id, 'operation': operation_name(operation)}
+        zone = _last_segment(getattr(operation, 'zone', None))
+        region = _last_segment(getattr(operation, 'region', None))
+
+        if zone:
+            kwargs['zone'] = zone
+            client = self._client('zone')
+        elif region:
+            kwargs['region'] = region
+            client = self._client('region')
+        else:
+            client = self._client('global')
+
+        # The server may hold the call for the whole wait; the RPC deadline must not expire first
+        return client.wait(**kwargs, timeout=timeout + RPC_HEADROOM)
+
+    def _backoff(self, attempt):
+        """Exponential backoff delay with jitter for the given attempt"""
+        delay = min(self.max_delay, self.initial_delay * (self.multiplier ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, func, description=None):
+        """Call an API method, retrying transient errors with the polling backoff"""
+        deadline = self.clock() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if not _is_transient(e) or self.clock() >= deadline:
+                    raise
+                logger.warning(f"Transient error in {description or 'API call'}: {e}")
+            self.sleep(min(self._backoff(attempt), max(0.0, deadline - self.clock())))
+            attempt += 1
+
+    def wait(self, operation, timeout=None, description=None):
+        """Wait for an operation, raising on error or when the deadline passes"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = self.clock() + timeout
+        description = description or operation_name(operation)
+        started = self.clock()
+        attempt = 0
+
+        while not is_done(operation):
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise OperationTimeoutError(operation, timeout)
+
+            try:
+                polled = self._poll(operation, min(remaining, MAX_SERVER_WAIT))
+            except Exception as e:
+                if not _is_transient(e):
+                    raise
+                logger.warning(f"Transient error while waiting for {description}: {e}")
+                polled = None
+
+            if polled is not None:
+                operation = polled
+                if is_done(operation):
+                    break
+
+            # wait() can return early (or fail); back off before asking again
+            delay = min(self._backoff(attempt), max(0.0, deadline - self.clock()))
+            self.sleep(delay)
+            attempt += 1
+
+        errors = operation_errors(operation)
+        if errors:
+            raise OperationError(operation, errors)
+
+        logger.info(f"{description} finished in {self.clock() - started:.1f}s")
+        return operation
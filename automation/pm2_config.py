@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+PM2 ecosystem file sized to the instance's machine type
+
+The Next.js server runs in PM2 cluster mode with one worker per vCPU of
+instance.machine_type, looked up in a table of GCE machine types. The RAM
+left after a reserve for the OS and Nginx is split between the workers: each
+gets a V8 heap limit and a max_memory_restart guard. Reloads are graceful:
+a new worker must be listening before the old one is sent SIGINT.
+
+    python pm2_config.py                          # plan and ecosystem file for the configured machine
+    python pm2_config.py --machine-type n2-standard-8
+"""
+
+import re
+import json
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+# Shared-core types list the vCPUs they can sustain, rounded up
+SHARED_CORE = {
+    'f1-micro': (1, 614),
+    'g1-small': (1, 1740),
+    'e2-micro': (1, 1024),
+    'e2-small': (1, 2048),
+    'e2-medium': (2, 4096),
+}
+
+# MB of memory per vCPU and the predefined sizes of each family
+FAMILIES = {
+    'e2-standard': (4096, [2, 4, 8, 16, 32]),
+    'e2-highmem': (8192, [2, 4, 8, 16]),
+    'e2-highcpu': (1024, [2, 4, 8, 16, 32]),
+    'n1-standard': (3840, [1, 2, 4, 8, 16, 32, 64, 96]),
+    'n1-highmem': (6656, [2, 4, 8, 16, 32, 64, 96]),
+    'n1-highcpu': (921, [2, 4, 8, 16, 32, 64, 96]),
+    'n2-standard': (4096, [2, 4, 8, 16, 32, 48, 64, 80, 96, 128]),
+    'n2-highmem': (8192, [2, 4, 8, 16, 32, 48, 64, 80, 96, 128]),
+    'n2-highcpu': (1024, [2, 4, 8, 16, 32, 48, 64, 80, 96]),
+    'n2d-standard': (4096, [2, 4, 8, 16, 32, 48, 64, 80, 96, 128, 224]),
+    'n2d-highmem': (8192, [2, 4, 8, 16, 32, 48, 64, 80, 96]),
+    'n2d-highcpu': (1024, [2, 4, 8, 16, 32, 48, 64, 80, 96, 128, 224]),
+    't2d-standard': (4096, [1, 2, 4, 8, 16, 32, 48, 60]),
+    'c2-standard': (4096, [4, 8, 16, 30, 60]),
+    'c2d-standard': (4096, [2, 4, 8, 16, 32, 56, 112]),
+    'c3-standard': (4096, [4, 8, 22, 44, 88, 176]),
+}
+
+MACHINE_TYPES = {
+    **SHARED_CORE,
+    **{f"{family}-{n}": (n, per_cpu * n) for family, (per_cpu, sizes) in FAMILIES.items() for n in sizes},
+}
+
+# e2-custom-4-8192, n2-custom-8-16384-ext, custom-2-7680 (N1)
+CUSTOM_TYPE = re.compile(r'(?:^|-)custom-(\d+)-(\d+)(?:-ext)?$')
+
+DEFAULTS = {
+    'instances': 'auto',
+    'reserve_mb': 768,
+    'min_worker_mb': 512,
+    'heap_ratio': 0.75,
+    'listen_timeout': 10000,
+    'kill_timeout': 8000,
+}
+
+
+def pm2_settings(config):
+    """The pm2 section merged over the defaults"""
+    return {**DEFAULTS, **(config.get('pm2') or {})}
+
+
+def machine_shape(machine_type):
+    """(vCPUs, memory MB) of a machine type, or None when it is not known"""
+    if machine_type in MACHINE_TYPES:
+        return MACHINE_TYPES[machine_type]
+    custom = CUSTOM_TYPE.search(machine_type)
+    if custom:
+        return int(custom.group(1)), int(custom.group(2))
+    return None
+
+
+def worker_plan(config):
+    """Worker count and per-worker memory limits for the configured machine type"""
+    settings = pm2_settings(config)
+    machine_type = config['instance']['machine_type']
+    shape = machine_shape(machine_type)
+
+    if shape is None:
+        # PM2 falls back to the instance's own CPU count; memory is left unguarded
+        logger.warning(f"Unknown machine type {machine_type}; running one worker per CPU without memory limits")
+        return {'machine_type': machine_type, 'vcpus': None, 'memory_mb': None,
+                'workers': 'max', 'heap_mb': None, 'max_memory_mb': None}
+
+    vcpus, memory_mb = shape
+    usable = max(memory_mb - settings['reserve_mb'], settings['min_worker_mb'])
+    if settings['instances'] == 'auto':
+        # Never more workers than the memory can hold at min_worker_mb each
+        workers = max(1, min(vcpus, usable // settings['min_worker_mb']))
+    else:
+        workers = int(settings['instances'])
+
+    budget = usable // workers
+    return {
+        'machine_type': machine_type,
+        'vcpus': vcpus,
+        'memory_mb': memory_mb,
+        'workers': workers,
+        'heap_mb': int(budget * settings['heap_ratio']),
+        'max_memory_mb': budget,
+    }
+
+
+def ecosystem(config, script, args, cwd, env=None):
+    """PM2 ecosystem definition for the app"""
+    settings = pm2_settings(config)
+    plan = worker_plan(config)
+
+    app = {
+        'name': config['application']['name'],
+        'script': script,
+        'args': args,
+        'cwd': cwd,
+        'exec_mode': 'cluster',
+        'instances': plan['workers'],
+        'env': {'NODE_ENV': 'production', **(env or {})},
+        # Reload starts a new worker, waits for it to listen, then stops the old one
+        'listen_timeout': settings['listen_timeout'],
+        'kill_timeout': settings['kill_timeout'],
+        'max_restarts': 10,
+        'exp_backoff_restart_delay': 200,
+    }
+    if plan['heap_mb']:
+        app['node_args'] = f"--max-old-space-size={plan['heap_mb']}"
+        app['max_memory_restart'] = f"{plan['max_memory_mb']}M"
+    return {'apps': [app]}
+
+
+def ecosystem_js(config, script, args, cwd, env=None):
+    """Contents of ecosystem.config.js"""
+    return f"module.exports = {json.dumps(ecosystem(config, script, args, cwd, env), indent=2)};\n"
+
+
+def ecosystem_script(config, path, script, args, cwd, env=None, sudo=''):
+    """Shell step writing the ecosystem file to path on the instance"""
+    return f"""{sudo}tee {path} > /dev/null <<'PM2_EOF'
+{ecosystem_js(config, script, args, cwd, env)}PM2_EOF
+"""
+
+
+def main():
+    """Main entry point"""
+    from releases import pm2_app
+    from session import get_session
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Show the PM2 worker plan and ecosystem file")
+    parser.add_argument('--machine-type', help='plan for this machine type instead of instance.machine_type')
+    parser.add_argument('--artifact', action='store_true', help='ecosystem for artifact (standalone) releases')
+    args = parser.parse_args()
+
+    config = get_session().config
+    if args.machine_type:
+        config = {**config, 'instance': {**config['instance'], 'machine_type': args.machine_type}}
+
+    plan = worker_plan(config)
+    if plan['vcpus']:
+        logger.info(f"{plan['machine_type']}: {plan['vcpus']} vCPU, {plan['memory_mb']} MB -> "
+                    f"{plan['workers']} worker(s), heap {plan['heap_mb']} MB, restart above {plan['max_memory_mb']} MB\n")
+    print(ecosystem_js(config, **pm2_app(config, args.artifact)), end='')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Pre-compress static assets so Nginx serves them with gzip_static/brotli_static
+
+Every text asset (JS, CSS, HTML, SVG, JSON...) under the given directories is
+compressed once at the highest level, gzip and (when the brotli module is
+importable) brotli, in parallel across a process pool. Results are stored
+content-addressed in a cache, so files unchanged since an earlier release are
+never compressed again, and linked in beside each file as
+
+    <file>.gz   <file>.br
+
+Nginx sends the sibling matching Accept-Encoding instead of compressing on
+every request. A sibling is only written when it is smaller than the file.
+Standard library plus the optional brotli module: deploys also run it on the
+instance.
+
+    python precompress.py ../.next/static ../public --cache releases/compress-cache
+"""
+
+import os
+import gzip
+import time
+import shutil
+import base64
+import hashlib
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+SUFFIXES = {'.html', '.css', '.js', '.mjs', '.json', '.svg', '.txt', '.xml', '.map', '.ico', '.webmanifest'}
+DEFAULT_ENCODINGS = ['gz', 'br']
+MIN_SIZE = 256
+
+
+def available_encodings(encodings):
+    """Encodings this Python can produce"""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return [e for e in encodings if e != 'br']
+    return list(encodings)
+
+
+def compress(path, digest, cache_dir, encodings):
+    """Write the missing cache entries of one file; return how many were written"""
+    data = Path(path).read_bytes()
+    written = 0
+    for encoding in encodings:
+        entry = Path(cache_dir, digest[:2], f"{digest}.{encoding}")
+        if entry.exists():
+            continue
+        if encoding == 'br':
+            import brotli
+            body = brotli.compress(data, quality=11)
+        else:
+            body = gzip.compress(data, compresslevel=9, mtime=0)
+        entry.parent.mkdir(exist_ok=True)
+        tmp = entry.with_suffix('.partial')
+        tmp.write_bytes(body)
+        os.replace(tmp, entry)
+        written += 1
+    return written
+
+
+def _link(src, dest):
+    """Hardlink a cached file into place, copying across filesystems"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def assets(roots, min_size=MIN_SIZE):
+    """Compressible files under roots, by path"""
+    for root in map(Path, roots):
+        if not root.exists():
+            continue
+        for path in sorted(root.rglob('*')):
+            if path.suffix.lower() in SUFFIXES and path.is_file() and path.stat().st_size >= min_size:
+                yield path
+
+
+def precompress(roots, cache_dir, encodings=DEFAULT_ENCODINGS, workers=None, min_size=MIN_SIZE):
+    """Compress what the cache lacks, then place the siblings; return run stats"""
+    started = time.monotonic()
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    encodings = available_encodings(encodings)
+
+    files = {path: hashlib.sha256(path.read_bytes()).hexdigest() for path in assets(roots, min_size)}
+    stale = {path: digest for path, digest in files.items()
+             if not all(Path(cache_dir, digest[:2], f"{digest}.{e}").exists() for e in encodings)}
+
+    compressed = 0
+    if stale:
+        # fork works from `python3 -c` too, where there is no __main__ file to re-import
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+            # Identical files (the same digest) are compressed once
+            unique = {digest: path for path, digest in stale.items()}
+            jobs = [pool.submit(compress, path, digest, cache_dir, encodings) for digest, path in unique.items()]
+            compressed = sum(job.result() for job in jobs)
+
+    raw = {'': 0, **{e: 0 for e in encodings}}
+    for path, digest in files.items():
+        size = path.stat().st_size
+        raw[''] += size
+        for encoding in encodings:
+            entry = Path(cache_dir, digest[:2], f"{digest}.{encoding}")
+            sibling = path.with_name(f"{path.name}.{encoding}")
+            if sibling.exists():
+                sibling.unlink()
+            if entry.stat().st_size < size:
+                _link(entry, sibling)
+                raw[encoding] += entry.stat().st_size
+            else:
+                raw[encoding] += size
+
+    return {
+        'files': len(files),
+        'reused': len(files) - len(stale),
+        'compressed': compressed,
+        'encodings': encodings,
+        'ratios': {e: round(raw[e] / raw[''], 3) if raw[''] else 1.0 for e in encodings},
+        'seconds': round(time.monotonic() - started, 1),
+    }
+
+
+def compression_settings(config):
+    """The compression section of config.yaml with defaults filled in"""
+    compression = config.get('compression') or {}
+    return {
+        'enabled': compression.get('enabled', True),
+        'encodings': compression.get('encodings', DEFAULT_ENCODINGS),
+        'min_size': compression.get('min_size', MIN_SIZE),
+        'workers': compression.get('workers', 0),
+    }
+
+
+def release_roots(staging, static):
+    """Directories of a release that Nginx serves from disk"""
+    staging = Path(staging)
+    return [staging] if static else [staging / '.next' / 'static', staging / 'public']
+
+
+def precompress_script(config, app_dir, sudo=''):
+    """Shell steps that pre-compress the built assets of the app in app_dir on the instance"""
+    settings = compression_settings(config)
+    if not settings['enabled']:
+        return ""
+
+    cache = f"/var/cache/{config['application']['name']}/compress"
+    source = base64.b64encode(Path(__file__).read_bytes()).decode()
+    args = (f"{app_dir}/.next/static {app_dir}/public --cache {cache} "
+            f"--encodings {' '.join(settings['encodings'])} --min-size {settings['min_size']} "
+            f"--workers {settings['workers']}")
+
+    return f"""# Pre-compress static assets for gzip_static/brotli_static
+{sudo}mkdir -p {cache}
+{sudo}chown $(id -un):$(id -gn) {cache}
+python3 -c "$(echo {source} | base64 -d)" {args}
+"""
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Pre-compress static assets")
+    parser.add_argument('roots', nargs='+', help='directories to walk')
+    parser.add_argument('--cache', default='releases/compress-cache')
+    parser.add_argument('--encodings', nargs='+', default=DEFAULT_ENCODINGS, choices=DEFAULT_ENCODINGS)
+    parser.add_argument('--min-size', type=int, default=MIN_SIZE, help='bytes below which files stay as they are')
+    parser.add_argument('--workers', type=int, default=0, help='processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    stats = precompress(args.roots, args.cache, args.encodings, args.workers or None, args.min_size)
+    skipped = sorted(set(args.encodings) - set(stats['encodings']))
+    ratios = " ".join(f"{e}={r}" for e, r in stats['ratios'].items())
+    print(f"PRECOMPRESS files={stats['files']} reused={stats['reused']} compressed={stats['compressed']} "
+          f"ratio {ratios} took={stats['seconds']}s"
+          + (f" (brotli module missing, no {','.join(skipped)})" if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
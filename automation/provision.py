@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Provisioning steps shared by the startup script, the image bake and deploys
+to an existing instance
+
+Each builder adds steps to a StepGraph (see step_graph.py). The apt steps
+queue on the dpkg lock; the git clone and the npm cache warm-up do not need
+it, so they overlap with the package installs. Every step carries a check
+that skips it when its outcome is already on the machine, so re-running a
+script on a provisioned instance only does what is missing.
+
+    python provision.py             # print the startup script's step graph
+    python provision.py --existing  # the graph run by deploy_to_existing.py
+"""
+
+import logging
+import argparse
+
+from build_cache import build_script
+from dependency_cache import install_script, warm_script
+from image_variants import variants_script
+from nginx_config import site_install_script
+from precompress import precompress_script
+from releases import pm2_ecosystem_script, pm2_start_command, release_root
+
+logger = logging.getLogger(__name__)
+
+# Wait for unattended-upgrades instead of failing on the dpkg lock
+APT = "DEBIAN_FRONTEND=noninteractive apt-get -o DPkg::Lock::Timeout=600"
+
+DEFAULT_PACKAGES = ['build-essential', 'git', 'nginx', 'python3-pil', 'python3-brotli']
+
+
+def node_major(config):
+    """Node.js major version from deployment.nodejs_version ("20.x")"""
+    return str(config['deployment']['nodejs_version']).split('.')[0]
+
+
+def system_steps(graph, config, sudo=''):
+    """Node.js repository, apt packages and global npm packages"""
+    golden = config.get('golden_image', {})
+    packages = golden.get('packages', DEFAULT_PACKAGES)
+    npm_packages = " ".join(golden.get('global_npm_packages', ['pm2']))
+    major = node_major(config)
+    sources = "/etc/apt/sources.list.d/nodesource.list"
+
+    has_node = f'node -v 2>/dev/null | grep -q "^v{major}\\."'
+    has_packages = (f"[ \"$(dpkg-query -W -f='${{db:Status-Status}}\\n' {' '.join(packages)} 2>/dev/null "
+                    f"| grep -cx installed)\" -eq {len(packages)} ]")
+
+    # The NodeSource repository is added by hand: its setup script runs its own apt-get update
+    graph.add('node_repo', "Adding the Node.js repository...", f"""{sudo}mkdir -p /etc/apt/keyrings
+curl -fsSL https://deb.nodesource.com/gpgkey/nodesource-repo.gpg.key | {sudo}gpg --dearmor --yes -o /etc/apt/keyrings/nodesource.gpg
+echo "deb [signed-by=/etc/apt/keyrings/nodesource.gpg] https://deb.nodesource.com/node_{major}.x nodistro main" | {sudo}tee {sources} > /dev/null""",
+              skip_if=f'grep -qs "node_{major}.x" {sources}')
+
+    upgrade = golden.get('apt_upgrade', False)
+    graph.add('apt_update', "Updating package lists...", f"{sudo}{APT} update",
+              needs=['node_repo'],
+              skip_if=None if upgrade else f"{has_node} && {has_packages}")
+    if upgrade:
+        graph.add('apt_upgrade', "Upgrading system packages...", f"{sudo}{APT} upgrade -y",
+                  needs=['apt_update'])
+
+    graph.add('nodejs', "Installing Node.js...", f"{sudo}{APT} install -y nodejs",
+              needs=['apt_update'], after=['apt_upgrade'], skip_if=has_node)
+    graph.add('packages', "Installing packages...", f"{sudo}{APT} install -y {' '.join(packages)}",
+              needs=['apt_update'], after=['nodejs'], skip_if=has_packages)
+    graph.add('pm2', "Installing PM2...", f"{sudo}npm install -g {npm_packages}",
+              needs=['nodejs'], skip_if=f"npm ls -g --depth=0 {npm_packages}")
+
+
+def firewall_step(graph, config, sudo=''):
+    """Host firewall for SSH, HTTP(S) and the app port"""
+    port = config['application']['port']
+    ports = [22, 80, 443, port]
+    rules = "\n".join(f"{sudo}ufw allow {p}" for p in ports)
+    present = " && ".join(f'grep -Eq "^{p}(/tcp)? +ALLOW" <<< "$UFW"' for p in ports)
+
+    graph.add('firewall', "Configuring firewall...", f"{rules}\n{sudo}ufw --force enable",
+              skip_if=f'UFW=$({sudo}ufw status) && grep -q "^Status: active" <<< "$UFW" && {present}')
+
+
+def source_steps(graph, config, app_dir, sudo='', startup="pm2 startup systemd"):
+    """Clone, install, build and start the app from a git checkout in app_dir"""
+    repo = config['application']['github_repo']
+    branch = config['application']['branch']
+    root = release_root(config)
+    owner = f"\n{sudo}chown -R $(id -un):$(id -gn) {app_dir}" if sudo else ""
+
+    # git ships with the stock images, so the clone does not wait for the packages
+    graph.add('clone', "Cloning repository...", f"""if [ -d {app_dir}/.git ]; then
+    {sudo}git -C {app_dir} fetch origin {branch}
+    {sudo}git -C {app_dir} reset --hard FETCH_HEAD
+else
+    {sudo}mkdir -p {app_dir}
+    {sudo}git clone --branch {branch} {repo} {app_dir}
+fi{owner}""")
+
+    graph.add('npm_warm', "Warming the npm cache...", warm_script(config, app_dir),
+              needs=['clone'], after=['nodejs'])
+    graph.add('deps', "Installing dependencies...", install_script(config, app_dir, sudo),
+              needs=['npm_warm'], after=['packages'])
+    graph.add('build', "Building application...", build_script(config, app_dir, sudo=sudo),
+              needs=['deps'])
+    graph.add('variants', "Rendering image variants...", variants_script(config, app_dir, sudo=sudo),
+              needs=['clone'], after=['packages'])
+    graph.add('compress', "Pre-compressing assets...", precompress_script(config, app_dir, sudo=sudo),
+              needs=['build'], after=['packages'])
+
+    graph.add('start', "Starting application...", f"""# Nginx serves image variants through the release path
+{sudo}mkdir -p {root}
+{sudo}ln -sfn {app_dir} {root}/current
+{pm2_ecosystem_script(config, artifact=False, sudo=sudo)}{pm2_start_command(config)}
+{startup}
+pm2 save""", needs=['build', 'variants', 'compress'], after=['pm2', 'stop_app'])
+
+
+def nginx_step(graph, config, sudo=''):
+    """Nginx site for the app"""
+    graph.add('nginx', "Configuring Nginx...", site_install_script(config, sudo=sudo), after=['packages'])
+
+
+def provision_script(graph, label="Provisioning..."):
+    """The rendered graph as a single traced phase"""
+    return f'phase "{label}"\n{graph.render()}'
+
+
+def main():
+    """Main entry point"""
+    from deploy import GCPDeployment
+    from deploy_to_existing import existing_graph
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Show a provisioning step graph")
+    parser.add_argument('--existing', action='store_true', help='the graph deploy_to_existing.py runs')
+    args = parser.parse_args()
+
+    deployment = GCPDeployment()
+    graph = existing_graph(deployment.config) if args.existing else deployment.startup_graph()
+    for step in graph.order():
+        needs = f" <- {', '.join(step.needs)}" if step.needs else ""
+        logger.info(f"{step.name:<12} {step.label}{needs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Poll a deployed instance over HTTP until it serves healthy responses
+"""
+
+import time
+import logging
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from artifact import static_mode
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessTimeoutError(Exception):
+    """Raised when endpoints are not healthy before the deadline"""
+
+    def __init__(self, host, pending, timeout):
+        self.host = host
+        self.pending = pending
+        self.timeout = timeout
+        names = ", ".join(pending)
+        super().__init__(f"{host}: {names} not ready after {timeout}s")
+
+
+class Endpoint:
+    """An HTTP endpoint to probe on the target host"""
+
+    def __init__(self, name, port, path='/'):
+        self.name = name
+        self.port = port
+        self.path = path
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r}, {self.port}, {self.path!r})"
+
+
+def default_endpoints(config):
+    """Nginx on port 80 and the Next.js server on the application port (none in static mode)"""
+    if static_mode(config):
+        return [Endpoint('nginx', 80)]
+    return [
+        Endpoint('nginx', 80),
+        Endpoint('nextjs', config['application']['port']),
+    ]
+
+
+def is_healthy(status):
+    """Treat any 2xx/3xx response as healthy"""
+    return 200 <= status < 400
+
+
+def probe_once(host, endpoint, timeout=3.0):
+    """One GET against an endpoint; return {'status', 'ms', 'error'}"""
+    conn = http.client.HTTPConnection(host, endpoint.port, timeout=timeout)
+    started = time.monotonic()
+    try:
+        conn.request('GET', endpoint.path)
+        response = conn.getresponse()
+        response.read()
+        return {'status': response.status, 'ms': round((time.monotonic() - started) * 1000), 'error': None}
+    except (OSError, http.client.HTTPException) as e:
+        return {'status': None, 'ms': None, 'error': type(e).__name__}
+    finally:
+        conn.close()
+
+
+class ReadinessProbe:
+    """Probes several endpoints concurrently with keep-alive connections"""
+
+    def __init__(self, host, endpoints, timeout=900, initial_interval=1.0, max_interval=15.0,
+                 backoff=1.5, request_timeout=5.0, clock=time.monotonic):
+        """Initialize the probe for a host and its endpoints"""
+        self.host = host
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.request_timeout = request_timeout
+        self.clock = clock
+        self._stop = threading.Event()
+
+    def _check(self, conn, endpoint):
+        """Issue one GET over the kept-alive connection and return the status"""
+        conn.request('GET', endpoint.path, headers={'Connection': 'keep-alive'})
+        response = conn.getresponse()
+        response.read()
+        if response.will_close:
+            conn.close()
+        return response.status
+
+    def _probe(self, endpoint, started):
+        """Poll one endpoint until it is healthy or the probe is stopped"""
+        conn = http.client.HTTPConnection(self.host, endpoint.port, timeout=self.request_timeout)
+        interval = self.initial_interval
+        last_state = None
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    status = self._check(conn, endpoint)
+                    state = status
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    status = None
+                    state = type(e).__name__
+
+                if status is not None and is_healthy(status):
+                    elapsed = self.clock() - started
+                    logger.info(f"  ✓ {self.host} {endpoint.name} (:{endpoint.port}) healthy after {elapsed:.1f}s")
+                    return elapsed
+
+                # Poll quickly right after the endpoint changes state, slow down while it is stable
+                if state != last_state:
+                    logger.info(f"  … {self.host} {endpoint.name} (:{endpoint.port}): {state}")
+                    interval = self.initial_interval
+                else:
+                    interval = min(self.max_interval, interval * self.backoff)
+                last_state = state
+
+                self._stop.wait(interval)
+        finally:
+            conn.close()
+        return None
+
+    def wait(self):
+        """Block until every endpoint is healthy; return per-endpoint seconds"""
+        self._stop.clear()
+        started = self.clock()
+
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as pool:
+            futures = {pool.submit(self._probe, ep, started): ep for ep in self.endpoints}
+            done, pending = wait_futures(futures, timeout=self.timeout)
+            self._stop.set()
+
+        if pending:
+            raise ReadinessTimeoutError(self.host, [futures[f].name for f in pending], self.timeout)
+
+        return {futures[f].name: f.result() for f in done}
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Plan and apply the firewall rules and instances config.yaml describes
+
+The actual state is read in one pass: a single aggregated call for the
+instances in every zone and a single list call for the firewall rules, run
+concurrently. It is diffed against the desired state, and only the
+differences become changes: missing rules or instances are created, rules
+whose ports, sources or targets drifted are patched, and instances get their
+metadata or machine type updated, or are started. A running instance whose
+startup script changed runs the new one over SSH, since it would otherwise
+only run at the next boot. Changes to different resources are independent
+and applied concurrently. With nothing to change, a deploy costs two reads.
+
+    python reconcile.py                  # plan for the configured instance
+    python reconcile.py --fleet --apply  # plan and apply for the fleet
+"""
+
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from google.cloud import compute_v1
+
+from artifact import artifact_mode
+from status import aggregated_instances, tracked_names
+
+logger = logging.getLogger(__name__)
+
+
+class Change:
+    """Planned change to one resource, applied as a sequence of steps"""
+
+    def __init__(self, kind, name, action, details, steps, location=None):
+        self.kind = kind
+        self.name = name
+        self.action = action
+        self.details = details
+        self.steps = steps
+        self.location = location
+        self.seconds = None
+        self.error = None
+
+    def apply(self, tracer=None):
+        """Run the steps in order; return True when all of them succeeded"""
+        started = time.monotonic()
+        try:
+            with tracer.span(f"{self.kind} {self.action}", 'gcp', track=self.name) if tracer else nullcontext():
+                for step in self.steps:
+                    step()
+        except Exception as e:
+            logger.error(f"Error applying {self.action} {self.kind} {self.name}: {e}")
+            self.error = str(e)
+        self.seconds = time.monotonic() - started
+        return self.error is None
+
+
+def _firewall_key(rule):
+    """The fields of a firewall rule the tooling sets"""
+    return {
+        'allowed': sorted((a.I_p_protocol, tuple(sorted(a.ports))) for a in rule.allowed),
+        'source_ranges': sorted(rule.source_ranges),
+        'target_tags': sorted(rule.target_tags),
+        'direction': rule.direction,
+        'priority': rule.priority,
+    }
+
+
+def _metadata(instance):
+    """Metadata items of a compute_v1.Instance or instance JSON"""
+    if isinstance(instance, dict):
+        return {item['key']: item.get('value') for item in instance.get('metadata', {}).get('items', [])}
+    return {item.key: item.value for item in instance.metadata.items}
+
+
+class Reconciler:
+    """Diffs the members' desired instances and the shared firewall rules against GCP"""
+
+    def __init__(self, base, members):
+        """base supplies the project-wide clients, members are per-instance GCPDeployments"""
+        self.base = base
+        self.members = members
+        self.config = base.config
+        self.project_id = self.config['gcp']['project_id']
+        self.unchanged = []
+
+    def read(self):
+        """Actual instances by name and firewall rules by name, in one concurrent pass"""
+        names = {m.config['instance']['name'] for m in self.members}
+        call = self.base.waiter.call
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            instances = pool.submit(call, lambda: {i['name']: (zone, i) for zone, i in
+                                                   aggregated_instances(self.base.session, names)}, "instance read")
+            firewalls = pool.submit(call, lambda: list(self.base.firewall_client.list(project=self.project_id)),
+                                    "firewall read")
+            return instances.result(), {rule.name: rule for rule in firewalls.result()}
+
+    def plan(self):
+        """Changes that bring GCP in line with config.yaml"""
+        instances, firewalls = self.read()
+        self.unchanged = []
+        changes = []
+
+        # Rules are global and target every instance the tooling manages by its tag
+        targets = sorted(tracked_names(self.config) | {m.config['instance']['name'] for m in self.members})
+        for rule in self.config['firewall']:
+            desired = self.base.build_firewall_rule(rule, targets)
+            change = self.plan_firewall(desired, firewalls.get(desired.name))
+            if change:
+                changes.append(change)
+            else:
+                self.unchanged.append(('firewall', desired.name))
+
+        for member in self.members:
+            change = self.plan_instance(member, instances.get(member.config['instance']['name']))
+            if change:
+                changes.append(change)
+            else:
+                self.unchanged.append(('instance', member.config['instance']['name']))
+        return changes
+
+    def plan_firewall(self, desired, actual):
+        """Create a missing rule or patch one that drifted"""
+        client = self.base.firewall_client
+
+        def insert():
+            _run(self.base, lambda: client.insert(project=self.project_id, firewall_resource=desired),
+                 f"Firewall rule {desired.name} creation", insert=True)
+
+        def patch():
+            _run(self.base, lambda: client.patch(project=self.project_id, firewall=desired.name,
+                                                 firewall_resource=desired),
+                 f"Firewall rule {desired.name} update")
+
+        if actual is None:
+            return Change('firewall', desired.name, 'create', [], [insert])
+
+        want, have = _firewall_key(desired), _firewall_key(actual)
+        drift = [f"{field}: {have[field]} -> {want[field]}" for field in want if want[field] != have[field]]
+        return Change('firewall', desired.name, 'update', drift, [patch]) if drift else None
+
+    def plan_instance(self, member, found):
+        """Create a missing instance; otherwise update what differs and start it if stopped"""
+        config = member.config
+        name = config['instance']['name']
+        zone = config['gcp']['zone']
+
+        def create():
+            if not member.create_instance():
+                raise RuntimeError("instance creation failed")
+
+        if found is None:
+            return Change('instance', name, 'create', [], [create], zone)
+
+        actual_zone, actual = found
+        if actual_zone != zone:
+            logger.warning(f"{name} runs in {actual_zone}, config.yaml says {zone}; "
+                           f"destroy it to recreate it there")
+            zone = actual_zone
+
+        client = member.compute_client
+        where = {'project': self.project_id, 'zone': zone, 'instance': name}
+        status = actual['status']
+        details, steps, stale = [], [], []
+
+        # In artifact mode the startup script names the release, known once it is built
+        if member.release is not None or not artifact_mode(config):
+            desired = _metadata(member.build_instance(name, member.source_image(), member.generate_startup_script()))
+            current = _metadata(actual)
+            stale = sorted(key for key, value in desired.items() if current.get(key) != value)
+            if stale:
+                details.append(f"metadata {', '.join(stale)}")
+                # set_metadata replaces all items: keep the ones the tooling does not manage
+                items = [compute_v1.Items(key=k, value=v) for k, v in {**current, **desired}.items()]
+                metadata = compute_v1.Metadata(fingerprint=actual.get('metadata', {}).get('fingerprint'), items=items)
+                steps.append(lambda: _run(member, lambda: client.set_metadata(**where, metadata_resource=metadata),
+                                          f"Instance {name} metadata"))
+
+        machine_type = config['instance']['machine_type']
+        current_type = actual['machineType'].rsplit('/', 1)[-1]
+        if current_type != machine_type:
+            details.append(f"machine_type: {current_type} -> {machine_type} (stops the instance)")
+            if status == 'RUNNING':
+                steps.append(lambda: _run(member, lambda: client.stop(**where), f"Instance {name} stop"))
+                status = 'TERMINATED'
+            request = compute_v1.InstancesSetMachineTypeRequest(
+                machine_type=f"zones/{zone}/machineTypes/{machine_type}")
+            steps.append(lambda: _run(
+                member, lambda: client.set_machine_type(**where, instances_set_machine_type_request_resource=request),
+                f"Instance {name} machine type"))
+
+        if status in ('TERMINATED', 'STOPPED', 'SUSPENDED'):
+            details.append("start")
+            steps.append(lambda: _run(member, lambda: client.start(**where), f"Instance {name} start"))
+
+        # Startup scripts run at boot: a running instance would keep serving the old build
+        if stale and status == 'RUNNING':
+            details.append("rerun the startup script over SSH")
+            steps.append(lambda: rerun_startup_script(member, _external_ip(actual)))
+
+        return Change('instance', name, 'update', details, steps, zone) if steps else None
+
+
+def _run(deployment, call, description, insert=False):
+    """Start an operation, retrying transient API errors, and wait for it"""
+    try:
+        operation = deployment.waiter.call(call, description)
+    except Exception as e:
+        # An insert retried after a transient error may have gone through the first time
+        if insert and getattr(e, 'code', None) == 409:
+            logger.info(f"{description}: already exists")
+            return
+        raise
+    deployment.wait_for_operation(operation, description)
+
+
+def _external_ip(instance):
+    """NAT IP from instance JSON, if any"""
+    for interface in instance.get('networkInterfaces', []):
+        for access_config in interface.get('accessConfigs', []):
+            if access_config.get('natIP'):
+                return access_config['natIP']
+    return None
+
+
+def rerun_startup_script(member, host):
+    """Run the instance's startup script now, as a boot would, streaming its phases to the trace"""
+    # update imports the deploy stack this module is part of
+    from update import open_remote
+
+    config = member.config
+    name = config['instance']['name']
+    if not host:
+        raise RuntimeError(f"{name} has no external IP to rerun its startup script over SSH")
+
+    logger.info(f"Running the new startup script on {name}...")
+    remote, close = open_remote(config, host)
+    phases = member.tracer.phases(track=name, prefix='startup')
+    try:
+        with member.span('startup script rerun'):
+            remote.run("sudo google_metadata_script_runner startup",
+                       timeout=config['deployment'].get('readiness_timeout', 900), echo=True, on_line=phases.feed)
+    finally:
+        phases.close()
+        close()
+
+
+def apply(changes, tracer=None, max_workers=8, zone_slot=None):
+    """Apply independent changes concurrently; zone_slot(zone) bounds instance changes per zone"""
+    def run(change):
+        slot = zone_slot(change.location) if zone_slot and change.kind == 'instance' else nullcontext()
+        with slot:
+            return change.apply(tracer)
+
+    if not changes:
+        return True
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return all(list(pool.map(run, changes)))
+
+
+def render_plan(changes, unchanged=()):
+    """Terraform-style summary of the planned changes"""
+    marks = {'create': '+', 'update': '~'}
+    lines = []
+    for c in changes:
+        where = f" ({c.location})" if c.location else ""
+        lines.append(f"  {marks[c.action]} {c.kind:<9} {c.name}{where}")
+        lines.extend(f"      {detail}" for detail in c.details)
+    creates = sum(c.action == 'create' for c in changes)
+    lines.append(f"Plan: {creates} to create, {len(changes) - creates} to update, {len(unchanged)} unchanged")
+    return "\n".join(lines)
+
+
+def main():
+    """Main entry point"""
+    from deploy import GCPDeployment
+    from fleet import fleet_members, member_config
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Plan (and apply) firewall rules and instances")
+    parser.add_argument('--fleet', action='store_true', help='every instance under fleet.instances')
+    parser.add_argument('--apply', action='store_true', help='apply the plan')
+    args = parser.parse_args()
+
+    base = GCPDeployment()
+    members = [base]
+    if args.fleet:
+        members = [GCPDeployment(config=member_config(base.config, m), tracer=base.tracer)
+                   for m in fleet_members(base.config)]
+
+    # New instances and startup scripts need the release
+    if args.apply and artifact_mode(base.config):
+        base.prepare_release()
+        for member in members:
+            member.release, member.release_url = base.release, base.release_url
+
+    reconciler = Reconciler(base, members)
+    changes = reconciler.plan()
+    logger.info(render_plan(changes, reconciler.unchanged))
+    if not args.apply or not changes:
+        return
+
+    started = time.monotonic()
+    ok = apply(changes, base.tracer)
+    logger.info(f"{'Applied' if ok else 'FAILED to apply'} {len(changes)} change(s) in {time.monotonic() - started:.1f}s")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Release layout on the instance and the shell steps that switch between releases
+
+    /opt/<app>/releases/<id>/   one directory per release, newest kept
+    /opt/<app>/current          symlink to the release being served
+    /opt/<app>/repo.git         bare mirror used to prepare source releases
+
+PM2 runs the app from the current symlink in cluster mode (see pm2_config.py
+for the ecosystem file), so switching is a rename of the symlink followed by a
+graceful `pm2 reload`: new workers start from the new release before the old
+ones are stopped. Static releases (deployment.mode "static") have no server:
+switching the symlink is the whole deploy, and Nginx serves the new files.
+"""
+
+from build_cache import build_script
+from dependency_cache import install_script
+from image_variants import variants_script
+from nginx_config import purge_script
+from precompress import precompress_script
+from pm2_config import ecosystem_script, worker_plan
+
+
+def release_root(config):
+    """Directory on the instance holding releases"""
+    return f"/opt/{config['application']['name']}"
+
+
+def ecosystem_path(config):
+    """PM2 ecosystem file on the instance, shared by every release"""
+    return f"{release_root(config)}/ecosystem.config.js"
+
+
+def pm2_app(config, artifact):
+    """Entry point, arguments, working directory and environment of the app under PM2"""
+    port = config['application']['port']
+    current = f"{release_root(config)}/current"
+
+    if artifact:
+        # Standalone output ships its own server entry point
+        return {'script': 'server.js', 'args': '', 'cwd': current,
+                'env': {'PORT': str(port), 'HOSTNAME': '0.0.0.0'}}
+    return {'script': 'node_modules/next/dist/bin/next', 'args': f'start -p {port}', 'cwd': current}
+
+
+def pm2_ecosystem_script(config, artifact, sudo=''):
+    """Write the ecosystem file for the configured machine type"""
+    root = release_root(config)
+    return f"{sudo}mkdir -p {root}\n" + ecosystem_script(config, ecosystem_path(config), sudo=sudo,
+                                                            **pm2_app(config, artifact))
+
+
+def pm2_start_command(config):
+    """Start the app from the current symlink under PM2 cluster mode"""
+    return f"pm2 start {ecosystem_path(config)}"
+
+
+def pm2_exec_path(config, artifact):
+    """Script path PM2 records for the app when started by pm2_start_command"""
+    current = f"{release_root(config)}/current"
+    return f"{current}/server.js" if artifact else f"{current}/node_modules/next/dist/bin/next"
+
+
+def pm2_switch_script(config, artifact, sudo=''):
+    """Gracefully reload PM2 onto the current release, or start it there"""
+    app_name = config['application']['name']
+    # Reload keeps the running worker count; follow a machine type change
+    workers = worker_plan(config)['workers']
+    scale = f"\n    pm2 scale {app_name} {workers}" if workers != 'max' else ""
+
+    return f"""{pm2_ecosystem_script(config, artifact, sudo)}
+# Graceful reload when PM2 already serves this entry point through the symlink,
+# otherwise (first switch, or a change of deployment mode) start it there
+PM2_EXEC=$(pm2 jlist 2>/dev/null | python3 -c 'import json,sys; print(next((p["pm2_env"].get("pm_exec_path","") for p in json.load(sys.stdin) if p["name"]=="{app_name}"), ""))' || true)
+if [ "$PM2_EXEC" = "{pm2_exec_path(config, artifact)}" ]; then
+    pm2 reload {ecosystem_path(config)} --update-env{scale}
+else
+    pm2 delete {app_name} 2>/dev/null || true
+    {pm2_start_command(config)}
+fi
+pm2 save
+"""
+
+
+def pm2_stop_script(config):
+    """Remove the app from PM2 if it runs there, e.g. after moving to static mode"""
+    app_name = config['application']['name']
+    return f"""# Nginx serves the static release; free the memory of a Node server left from another mode
+if command -v pm2 > /dev/null && pm2 describe {app_name} > /dev/null 2>&1; then
+    pm2 delete {app_name}
+    pm2 save --force
+fi
+"""
+
+
+def switch_script(config, release_dir, artifact, sudo='', keep=None):
+    """Atomically point current at release_dir, then reload (or first start) PM2 unless static"""
+    # artifact imports this module for switch_script
+    from artifact import static_mode
+
+    root = release_root(config)
+    keep = keep or config['deployment'].get('keep_releases', 5)
+    serve = pm2_stop_script(config) if static_mode(config) else pm2_switch_script(config, artifact, sudo)
+
+    return f"""# Switch the current symlink atomically (rename over the old link)
+{sudo}ln -sfn {release_dir} {root}/current.next
+{sudo}mv -T {root}/current.next {root}/current
+{sudo}chown -h $(id -un):$(id -gn) {root}/current
+
+{serve}
+{purge_script(config)}
+# Keep the newest {keep} releases (never the one being served)
+ACTIVE=$(readlink -f {root}/current)
+ls -1dt {root}/releases/*/ | tail -n +{keep + 1} | while read -r OLD; do
+    [ "$(readlink -f "$OLD")" = "$ACTIVE" ] || {sudo}rm -rf "$OLD"
+done
+"""
+
+
+def prepare_source_script(config, release_id, sudo=''):
+    """Build a release from git in its own directory while the current one keeps serving"""
+    root = release_root(config)
+    repo = config['application']['github_repo']
+    branch = config['application']['branch']
+
+    return f"""NEW_RELEASE={root}/releases/{release_id}
+{sudo}mkdir -p {root}/releases
+{sudo}chown $(id -un):$(id -gn) {root} {root}/releases
+
+# Refresh the bare mirror and export the branch head into the new release
+if [ ! -d {root}/repo.git ]; then
+    git clone --mirror {repo} {root}/repo.git
+fi
+git -C {root}/repo.git fetch --prune origin
+mkdir -p $NEW_RELEASE
+git -C {root}/repo.git archive {branch} | tar -x -C $NEW_RELEASE
+
+{install_script(config, '$NEW_RELEASE', sudo=sudo)}{build_script(config, '$NEW_RELEASE', git_dir=f'{root}/repo.git', rev=branch, sudo=sudo)}{variants_script(config, '$NEW_RELEASE', sudo=sudo)}{precompress_script(config, '$NEW_RELEASE', sudo=sudo)}"""
+
+
+def rollback_script(config, sudo=''):
+    """Point current at the newest release older than the active one"""
+    root = release_root(config)
+    return f"""ACTIVE=$(readlink -f {root}/current)
+PREVIOUS=""
+FOUND=""
+for DIR in $(ls -1dt {root}/releases/*/); do
+    DIR=$(readlink -f "$DIR")
+    if [ -n "$FOUND" ]; then PREVIOUS=$DIR; break; fi
+    [ "$DIR" = "$ACTIVE" ] && FOUND=1
+done
+if [ -z "$PREVIOUS" ]; then
+    echo "No older release to roll back to" >&2
+    exit 1
+fi
+echo "Rolling back to $PREVIOUS"
+"""
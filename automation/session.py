@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Shared session: config, credentials, access tokens and API clients
+
+Everything here is loaded on first use and memoized for the process. OAuth
+access tokens are also cached on disk until shortly before they expire, so
+short commands such as status can call the Compute REST API without
+importing the Google client libraries or minting a new token.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    'https://www.googleapis.com/auth/compute',
+    'https://www.googleapis.com/auth/cloud-platform'
+]
+COMPUTE_API = 'https://compute.googleapis.com/compute/v1'
+TOKEN_CACHE_DIR = os.path.expanduser('~/.cache/aathira-trendz')
+
+# Treat tokens this close to expiry as expired
+EXPIRY_MARGIN = timedelta(minutes=5)
+
+
+class ApiError(Exception):
+    """Raised when a REST call returns an HTTP error"""
+
+    def __init__(self, status, message, url):
+        self.status = status
+        self.url = url
+        super().__init__(f"HTTP {status}: {message}")
+
+
+class Session:
+    """Lazily loaded, memoized config, credentials and clients"""
+
+    def __init__(self, config_path='config.yaml'):
+        self.config_path = config_path
+        self._config = None
+        self._credentials = None
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        """Parsed config.yaml"""
+        if self._config is None:
+            logger.debug(f"Loading configuration from {self.config_path}")
+            with open(self.config_path, 'r') as f:
+                self._config = yaml.safe_load(f)
+        return self._config
+
+    @property
+    def project_id(self):
+        return self.config['gcp']['project_id']
+
+    def _token_cache_path(self):
+        """Cache file keyed by the service account file and scopes"""
+        creds_path = os.path.abspath(self.config['gcp']['credentials_path'])
+        key = hashlib.sha256((creds_path + ' '.join(SCOPES)).encode()).hexdigest()[:16]
+        return os.path.join(TOKEN_CACHE_DIR, f"token-{key}.json")
+
+    def _read_cached_token(self):
+        """Return (token, expiry) from disk if still valid"""
+        try:
+            with open(self._token_cache_path(), 'r') as f:
+                cached = json.load(f)
+            expiry = datetime.fromisoformat(cached['expiry'])
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+        if expiry - EXPIRY_MARGIN <= datetime.utcnow():
+            return None, None
+        return cached['token'], expiry
+
+    def _write_cached_token(self, token, expiry):
+        """Persist a token with owner-only permissions"""
+        os.makedirs(TOKEN_CACHE_DIR, mode=0o700, exist_ok=True)
+        path = self._token_cache_path()
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'token': token, 'expiry': expiry.isoformat()}, f)
+        os.replace(path + '.tmp', path)
+
+    def credentials(self):
+        """Service account credentials, primed with a cached token when possible"""
+        with self._lock:
+            if self._credentials is None:
+                from google.oauth2 import service_account
+
+                creds_path = self.config['gcp']['credentials_path']
+                logger.debug(f"Loading GCP credentials from {creds_path}")
+                credentials = service_account.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+
+                token, expiry = self._read_cached_token()
+                if token:
+                    credentials.token = token
+                    credentials.expiry = expiry
+                self._credentials = credentials
+            return self._credentials
+
+    def access_token(self, force_refresh=False):
+        """Bearer token for REST calls; only loads credentials on a cache miss"""
+        if not force_refresh and self._credentials is None:
+            token, _ = self._read_cached_token()
+            if token:
+                return token
+
+        credentials = self.credentials()
+        with self._lock:
+            if force_refresh or not credentials.valid:
+                from google.auth.transport.requests import Request
+
+                credentials.refresh(Request())
+                self._write_cached_token(credentials.token, credentials.expiry)
+        return credentials.token
+
+    def client(self, name):
+        """Memoized compute_v1 client by class name, e.g. 'InstancesClient'"""
+        with self._lock:
+            if name in self._clients:
+                return self._clients[name]
+
+        credentials = self.credentials()
+        from google.cloud import compute_v1
+
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = getattr(compute_v1, name)(credentials=credentials)
+            return self._clients[name]
+
+    def compute_api(self, path, method='GET', body=None, timeout=30):
+        """Call the Compute REST API directly and return the decoded JSON"""
+        url = path if path.startswith('https://') else f"{COMPUTE_API}/{path.lstrip('/')}"
+        data = json.dumps(body).encode() if body is not None else None
+
+        for attempt in range(2):
+            request = urllib.request.Request(url, data=data, method=method)
+            request.add_header('Authorization', f"Bearer {self.access_token(force_refresh=attempt > 0)}")
+            if data is not None:
+                request.add_header('Content-Type', 'application/json')
+
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    return json.loads(response.read() or b'{}')
+            except urllib.error.HTTPError as e:
+                # A revoked or stale cached token gets one refresh and retry
+                if e.code == 401 and attempt == 0:
+                    continue
+                message = e.read().decode(errors='replace')
+                try:
+                    message = json.loads(message)['error']['message']
+                except (ValueError, KeyError, TypeError):
+                    pass
+                raise ApiError(e.code, message, url) from None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(config_path='config.yaml'):
+    """Return the process-wide session for a config file"""
+    key = os.path.abspath(config_path)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = Session(config_path)
+        return _sessions[key]
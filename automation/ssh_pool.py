@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Persistent SSH sessions to instances, shared across commands and transfers
+
+One authenticated transport is kept per host. Every command opens a new
+channel on it, so commands to the same host run concurrently without new
+handshakes, and their output is streamed line by line as it arrives.
+"""
+
+import os
+import getpass
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY = os.path.expanduser('~/.ssh/google_compute_engine')
+
+
+class RemoteCommandError(Exception):
+    """Raised when a remote command exits non-zero"""
+
+    def __init__(self, host, command, exit_status, stderr):
+        self.host = host
+        self.command = command
+        self.exit_status = exit_status
+        self.stderr = stderr
+        super().__init__(f"[{host}] command exited with {exit_status}: {stderr.strip()[-500:]}")
+
+
+class SSHPool:
+    """Keeps one SSH transport per host and multiplexes channels over it"""
+
+    def __init__(self, username=None, key_filename=DEFAULT_KEY, port=22, connect_timeout=20,
+                 strict_host_keys=False, keepalive=30):
+        self.username = username or getpass.getuser()
+        self.key_filename = key_filename
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.strict_host_keys = strict_host_keys
+        self.keepalive = keepalive
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a pool from the ssh section of config.yaml"""
+        ssh = config.get('ssh', {})
+        return cls(
+            username=ssh.get('username'),
+            key_filename=os.path.expanduser(ssh.get('key_file', DEFAULT_KEY)),
+            port=ssh.get('port', 22),
+            strict_host_keys=ssh.get('strict_host_keys', False),
+        )
+
+    def _host_lock(self, host):
+        with self._lock:
+            return self._locks.setdefault(host, threading.Lock())
+
+    def transport(self, host):
+        """Return the live transport for a host, connecting on first use"""
+        with self._host_lock(host):
+            client = self._clients.get(host)
+            if client and client.get_transport() and client.get_transport().is_active():
+                return client.get_transport()
+
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            if not self.strict_host_keys:
+                # Fresh instances present host keys we have not seen yet
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+            logger.info(f"[{host}] opening SSH session as {self.username}")
+            client.connect(
+                host,
+                port=self.port,
+                username=self.username,
+                key_filename=self.key_filename,
+                timeout=self.connect_timeout,
+                allow_agent=True,
+                look_for_keys=False,
+            )
+            client.get_transport().set_keepalive(self.keepalive)
+            self._clients[host] = client
+            return client.get_transport()
+
+    def _pump(self, stream, host, label, sink, echo, on_line=None):
+        """Collect a channel stream and log each line as it arrives"""
+        for line in iter(stream.readline, b''):
+            sink.append(line)
+            if on_line:
+                on_line(line)
+            if echo:
+                text = line.decode(errors='replace').rstrip()
+                (logger.warning if label == 'err' else logger.info)(f"[{host}] {text}")
+
+    def run(self, host, command, stdin=None, echo=True, check=True, timeout=None, on_line=None):
+        """Run a command on its own channel; return (exit_status, stdout, stderr)
+
+        on_line, if given, is called with each stdout line as it arrives.
+        """
+        channel = self.transport(host).open_session(timeout=self.connect_timeout)
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+
+        if stdin is not None:
+            channel.sendall(stdin)
+        channel.shutdown_write()
+
+        stdout, stderr = [], []
+        err_reader = threading.Thread(
+            target=self._pump,
+            args=(channel.makefile_stderr('rb'), host, 'err', stderr, echo),
+            daemon=True
+        )
+        err_reader.start()
+        self._pump(channel.makefile('rb'), host, 'out', stdout, echo, on_line)
+        err_reader.join()
+
+        exit_status = channel.recv_exit_status()
+        channel.close()
+
+        out, err = b''.join(stdout), b''.join(stderr)
+        if check and exit_status != 0:
+            raise RemoteCommandError(host, command, exit_status, err.decode(errors='replace'))
+        return exit_status, out, err
+
+    def run_many(self, commands, max_workers=8, **kwargs):
+        """Run (host, command) pairs concurrently; return results in input order"""
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(self.run, host, command, **kwargs) for host, command in commands]
+            return [f.result() for f in futures]
+
+    def put(self, host, local_path, remote_path):
+        """Upload a file over SFTP on the host's existing transport"""
+        with paramiko.SFTPClient.from_transport(self.transport(host)) as sftp:
+            sftp.put(str(local_path), remote_path)
+
+    def close(self):
+        """Close every pooled session"""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SSHRemote:
+    """Remote adapter for delta_transfer backed by a pooled session"""
+
+    def __init__(self, pool, host):
+        self.pool = pool
+        self.host = host
+
+    def run(self, command, stdin=b'', timeout=600, echo=False, on_line=None):
+        """Run a command remotely, feeding stdin; return its stdout"""
+        _, out, _ = self.pool.run(self.host, command, stdin=stdin, echo=echo, timeout=timeout, on_line=on_line)
+        return out
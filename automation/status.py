@@ -1,72 +1,207 @@
 #!/usr/bin/env python3
 """
-Check status of deployed Aathira Trendz instance
+Check status of deployed Aathira Trendz instances
+
+One aggregated-list call covers every zone; nginx and Next.js health is then
+probed on all instances concurrently. --watch keeps refreshing and only
+re-probes instances whose state changed or whose last check went stale.
 """
 
-import yaml
+import sys
+import json
+import time
 import logging
-from google.cloud import compute_v1
-from google.oauth2 import service_account
+import argparse
+from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+from operations import OperationWaiter
+from readiness import default_endpoints, is_healthy, probe_once
+from session import get_session
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
 
-def load_config():
-    """Load configuration from YAML file"""
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
-
-
-def check_instance_status():
-    """Check instance status and display information"""
-    config = load_config()
-
-    # Load credentials
-    credentials = service_account.Credentials.from_service_account_file(
-        config['gcp']['credentials_path']
-    )
-
-    # Initialize client
-    client = compute_v1.InstancesClient(credentials=credentials)
-
-    project_id = config['gcp']['project_id']
-    zone = config['gcp']['zone']
-    instance_name = config['instance']['name']
+def tracked_names(config):
+    """Instance names this tooling manages: the single instance plus any fleet"""
+    names = {config['instance']['name']}
+    names.update(m['name'] for m in config.get('fleet', {}).get('instances') or [])
+    return names
+
+
+def aggregated_instances(session, names=None):
+    """(zone, instance JSON) across all zones from one (paginated) aggregated call"""
+    config = session.config
+    path = f"projects/{config['gcp']['project_id']}/aggregated/instances?returnPartialSuccess=true"
+    if names:
+        expr = " OR ".join(f'(name = "{n}")' for n in sorted(names))
+        path += f"&filter={quote(expr)}"
+
+    page_token = None
+    while True:
+        page = session.compute_api(path + (f"&pageToken={page_token}" if page_token else ""))
+        for scope, scoped in page.get('items', {}).items():
+            for instance in scoped.get('instances', []):
+                yield scope.split('/')[-1], instance
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def list_instances(session, names=None, waiter=None):
+    """Dashboard rows for instances across all zones, retrying transient API errors"""
+    config = session.config
+    waiter = waiter or OperationWaiter(config['gcp']['project_id'],
+                                       timeout=config['deployment'].get('operation_timeout', 600))
+    # A page that fails restarts the listing: a partial one would drop instances
+    found = waiter.call(lambda: list(aggregated_instances(session, names)), "instance list")
+    rows = [instance_row(instance, zone) for zone, instance in found]
+    return sorted(rows, key=lambda r: (r['zone'], r['name']))
+
+
+def instance_row(instance, zone):
+    """Flatten the fields the dashboard shows"""
+    external_ip = None
+    interfaces = instance.get('networkInterfaces', [])
+    if interfaces and interfaces[0].get('accessConfigs'):
+        external_ip = interfaces[0]['accessConfigs'][0].get('natIP')
+
+    return {
+        'name': instance['name'],
+        'zone': zone,
+        'status': instance['status'],
+        'machine_type': instance['machineType'].split('/')[-1],
+        'external_ip': external_ip,
+        'health': {},
+        'checked_at': None,
+    }
+
+
+def check_health(rows, config, max_workers=16):
+    """Probe nginx and Next.js on every given instance concurrently"""
+    endpoints = default_endpoints(config)
+    targets = [(row, ep) for row in rows if row['external_ip'] and row['status'] == 'RUNNING' for ep in endpoints]
+
+    for row in rows:
+        row['health'] = {}
+    if not targets:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as pool:
+        results = pool.map(lambda t: probe_once(t[0]['external_ip'], t[1]), targets)
+        for (row, endpoint), result in zip(targets, results):
+            row['health'][endpoint.name] = result
+            row['checked_at'] = time.time()
+
+
+def _health_cell(result):
+    """Compact text for one endpoint check"""
+    if not result:
+        return '-'
+    if result['status'] is None:
+        return {'ConnectionRefusedError': 'refused', 'TimeoutError': 'timeout'}.get(result['error'], result['error'])
+    mark = 'ok' if is_healthy(result['status']) else 'FAIL'
+    return f"{mark} {result['status']} {result['ms']}ms"
+
+
+def render_table(rows):
+    """Format instances as a fixed-width table"""
+    header = f"{'NAME':<28} {'ZONE':<16} {'STATUS':<12} {'IP':<16} {'NGINX':<18} {'NEXTJS':<18}"
+    lines = [header, '-' * len(header)]
+    for r in rows:
+        lines.append(
+            f"{r['name']:<28} {r['zone']:<16} {r['status']:<12} {r['external_ip'] or '-':<16} "
+            f"{_health_cell(r['health'].get('nginx')):<18} {_health_cell(r['health'].get('nextjs')):<18}"
+        )
+    if not rows:
+        lines.append("(no instances found - run deploy.py to create one)")
+    return "\n".join(lines)
+
+
+def snapshot(rows):
+    """The --json document: one per refresh in watch mode, the same shape otherwise"""
+    return {'time': datetime.now().isoformat(timespec='seconds'), 'instances': rows}
+
+
+def _state_key(row):
+    """What must change for an instance to be re-probed"""
+    return (row['status'], row['external_ip'])
+
+
+def watch(session, names, config, interval, health_interval, as_json):
+    """Refresh the dashboard, re-probing only changed or stale instances"""
+    known = {}
+    last_output = None
+
+    while True:
+        try:
+            rows = list_instances(session, names)
+        except Exception as e:
+            # Keep watching: the next refresh may well succeed
+            logger.error(f"Error refreshing instance status: {e}")
+            time.sleep(interval)
+            continue
+
+        stale = []
+        for row in rows:
+            previous = known.get(row['name'])
+            if (previous is None or _state_key(previous) != _state_key(row)
+                    or time.time() - (previous['checked_at'] or 0) >= health_interval):
+                stale.append(row)
+            else:
+                row['health'], row['checked_at'] = previous['health'], previous['checked_at']
+
+        check_health(stale, config)
+        known = {row['name']: row for row in rows}
+
+        if as_json:
+            print(json.dumps(snapshot(rows)), flush=True)
+        else:
+            output = render_table(rows)
+            if output != last_output:
+                # Redraw only when something visible changed
+                if sys.stdout.isatty():
+                    print("\033[2J\033[H", end='')
+                print(f"{datetime.now():%H:%M:%S}  {len(rows)} instance(s), {len(stale)} re-probed\n")
+                print(output, flush=True)
+                last_output = output
+
+        time.sleep(interval)
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Show status and health of deployed instances")
+    parser.add_argument('--watch', nargs='?', type=float, const=5.0, metavar='SECONDS',
+                        help='keep refreshing (default every 5s)')
+    parser.add_argument('--health-interval', type=float, default=30.0, metavar='SECONDS',
+                        help='in watch mode, re-probe unchanged instances this often')
+    parser.add_argument('--json', action='store_true', help='print JSON for scrapers')
+    parser.add_argument('--all', action='store_true', help='show every instance in the project')
+    args = parser.parse_args()
+
+    # Plain REST with a cached token: no client library import, no token round trip
+    session = get_session()
+    config = session.config
+    names = None if args.all else tracked_names(config)
 
     try:
-        # Get instance details
-        instance = client.get(
-            project=project_id,
-            zone=zone,
-            instance=instance_name
-        )
+        if args.watch:
+            watch(session, names, config, args.watch, args.health_interval, args.json)
+            return
 
-        # Display information
-        logger.info("=" * 60)
-        logger.info("INSTANCE STATUS")
-        logger.info("=" * 60)
-        logger.info(f"Name: {instance.name}")
-        logger.info(f"Status: {instance.status}")
-        logger.info(f"Machine Type: {instance.machine_type.split('/')[-1]}")
-        logger.info(f"Zone: {zone}")
-
-        # Get external IP
-        if instance.network_interfaces:
-            access_configs = instance.network_interfaces[0].access_configs
-            if access_configs:
-                external_ip = access_configs[0].nat_i_p
-                logger.info(f"External IP: {external_ip}")
-                logger.info(f"\nWebsite URLs:")
-                logger.info(f"  → http://{external_ip}")
-                logger.info(f"  → http://{external_ip}:3000")
-
-        logger.info("=" * 60)
+        rows = list_instances(session, names)
+        check_health(rows, config)
+        print(json.dumps(snapshot(rows), indent=2) if args.json else render_table(rows))
 
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         logger.error(f"Error retrieving instance status: {e}")
-        logger.info("\nInstance may not exist. Run deploy.py to create it.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    check_instance_status()
+    main()
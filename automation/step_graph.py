@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Remote provisioning scripts generated from a graph of dependent steps
+
+Each step is a shell snippet with the steps it needs and an optional check
+that, when it succeeds, shows the step's outcome is already in place so the
+step is skipped. The rendered script starts every step as soon as everything
+it needs has finished, running independent steps concurrently in the
+background (`wait -n -p`, bash 5.1+). Step output is collected per step and
+printed when the step ends. Steps print `[step start|done|skip|fail] @<epoch>`
+markers, which tracing.py turns into overlapping spans.
+"""
+
+import re
+
+STEP_NAME = re.compile(r'^[a-z][a-z0-9_]*$')
+
+
+class Step:
+    """One provisioning step"""
+
+    def __init__(self, name, label, run, needs=(), skip_if=None):
+        self.name = name
+        self.label = label
+        self.run = run
+        self.needs = list(needs)
+        self.skip_if = skip_if
+
+
+class StepGraph:
+    """Steps with dependencies, rendered as a concurrent bash runner"""
+
+    def __init__(self):
+        self.steps = {}
+
+    def add(self, name, label, run, needs=(), after=(), skip_if=None):
+        """Add a step; needs must exist, after only orders against steps that do"""
+        if not STEP_NAME.match(name):
+            raise ValueError(f"Step name {name!r} is not a shell identifier")
+        if name in self.steps:
+            raise ValueError(f"Step {name} added twice")
+        needs = list(needs) + [a for a in after if a in self.steps]
+        self.steps[name] = Step(name, label, run, needs, skip_if)
+        return self.steps[name]
+
+    def order(self):
+        """Steps in a dependency order, stable with respect to insertion"""
+        for step in self.steps.values():
+            missing = [n for n in step.needs if n not in self.steps]
+            if missing:
+                raise ValueError(f"Step {step.name} needs unknown step(s): {', '.join(missing)}")
+
+        ordered, placed = [], set()
+        while len(ordered) < len(self.steps):
+            ready = [s for s in self.steps.values() if s.name not in placed and set(s.needs) <= placed]
+            if not ready:
+                stuck = sorted(set(self.steps) - placed)
+                raise ValueError(f"Steps depend on each other in a cycle: {', '.join(stuck)}")
+            for step in ready:
+                ordered.append(step)
+                placed.add(step.name)
+        return ordered
+
+    def render(self):
+        """Bash that defines every step and runs the graph to completion"""
+        ordered = self.order()
+        functions = "\n".join(
+            f"step_{s.name}() {{\n{s.run.rstrip()}\n}}\n"
+            f"skip_{s.name}() {{ {s.skip_if.strip() if s.skip_if else 'false'}; }}\n"
+            for s in ordered
+        )
+        needs = "\n".join(f"STEP_NEEDS[{s.name}]=\"{' '.join(s.needs)}\"" for s in ordered)
+        labels = "\n".join(f"STEP_LABEL[{s.name}]={_quote(s.label)}" for s in ordered)
+        names = " ".join(s.name for s in ordered)
+
+        return f"""{functions}
+declare -A STEP_NEEDS STEP_LABEL STEP_PID
+{needs}
+{labels}
+STEP_LOGS=$(mktemp -d /tmp/steps.XXXXXX)
+
+step_mark() {{ echo "[step $1] @$(date +%s.%N) $2${{3:+ $3}}"; }}
+
+run_steps() {{
+    local pending="$1" finished=" " next name dep ready pid status
+    while [ -n "${{pending// /}}" ] || [ ${{#STEP_PID[@]}} -gt 0 ]; do
+        # Start (or skip) every pending step whose needs have all finished
+        next=""
+        for name in $pending; do
+            ready=1
+            for dep in ${{STEP_NEEDS[$name]}}; do
+                [[ "$finished" == *" $dep "* ]] || ready=0
+            done
+            if [ $ready = 0 ]; then
+                next="$next $name"
+            elif skip_$name >/dev/null 2>&1; then
+                step_mark skip $name "${{STEP_LABEL[$name]}}"
+                finished="$finished$name "
+            else
+                step_mark start $name "${{STEP_LABEL[$name]}}"
+                ( set -e; step_$name ) > "$STEP_LOGS/$name.log" 2>&1 &
+                STEP_PID[$!]=$name
+            fi
+        done
+        pending=$next
+        if [ ${{#STEP_PID[@]}} -eq 0 ]; then
+            [ -z "${{pending// /}}" ] && break
+            echo "Steps cannot start: $pending" >&2
+            return 1
+        fi
+
+        # Collect whichever running step ends first
+        status=0
+        wait -n -p pid || status=$?
+        name=${{STEP_PID[$pid]}}
+        unset "STEP_PID[$pid]"
+        sed "s/^/  [$name] /" "$STEP_LOGS/$name.log"
+        if [ $status -ne 0 ]; then
+            step_mark fail $name "exit $status"
+            kill ${{!STEP_PID[@]}} 2>/dev/null || true
+            wait 2>/dev/null || true
+            return $status
+        fi
+        step_mark done $name
+        finished="$finished$name "
+    done
+    rm -rf "$STEP_LOGS"
+}}
+
+run_steps "{names}"
+"""
+
+
+def _quote(text):
+    """Single-quote text for bash"""
+    return "'" + text.replace("'", "'\\''") + "'"
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Time each deploy phase and export the trace
+
+Local steps are recorded as spans. Phases of remote scripts are recovered
+from their `[n/N] @<epoch> <label>` marker lines: a phase runs from its marker
+to the next one (or `[done]`), timed by the instance clock. Concurrent steps
+(step_graph.py) mark their own start and end and get one track each. Every
+run is written to traces/ as JSON and as a Chrome trace (open in
+chrome://tracing or ui.perfetto.dev), and summarized in traces/history.jsonl.
+
+    python tracing.py history              # recent runs
+    python tracing.py compare              # last two runs of the latest command
+    python tracing.py compare 3 1          # runs by history index (1 = latest)
+"""
+
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PHASE_MARKER = re.compile(r'\[(\d+)/(\d+)\] @(\d+(?:\.\d+)?) (.*?)\s*$')
+DONE_MARKER = re.compile(r'\[done\] @(\d+(?:\.\d+)?)')
+STEP_MARKER = re.compile(r'\[step (start|done|skip|fail)\] @(\d+(?:\.\d+)?) (\w+)(?: (.*?))?\s*$')
+
+
+def phase_preamble(script):
+    """Shell function printing phase markers, numbered out of the phases in script"""
+    total = len(re.findall(r'^\s*phase "', script, re.MULTILINE))
+    return f"""PHASE=0
+phase() {{ PHASE=$((PHASE+1)); echo "[$PHASE/{total}] @$(date +%s.%N) $1"; }}
+phase_done() {{ echo "[done] @$(date +%s.%N)"; }}
+"""
+
+
+class Span:
+    """One timed step"""
+
+    def __init__(self, name, category, start, end, track, attrs):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = end
+        self.track = track
+        self.attrs = attrs
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'category': self.category,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6),
+            'track': self.track,
+            **({'attrs': self.attrs} if self.attrs else {}),
+        }
+
+
+class Tracer:
+    """Collects spans from any thread and exports them at the end of a run"""
+
+    def __init__(self, command, config=None):
+        settings = (config or {}).get('tracing') or {}
+        self.command = command
+        self.enabled = settings.get('enabled', True)
+        self.directory = Path(settings.get('dir', 'traces'))
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, category='local', track=None, **attrs):
+        """Record a span with explicit epoch start and end times"""
+        span = Span(name, category, start, end, track or threading.current_thread().name, attrs)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, category='local', track=None, **attrs):
+        """Time the enclosed block; failed blocks are kept and marked"""
+        start = time.time()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            self.add(name, start, time.time(), category, track, **attrs)
+
+    def phases(self, track=None, prefix='remote'):
+        """Parser turning streamed remote output into phase spans"""
+        return PhaseParser(self, track, prefix)
+
+    def summary(self):
+        """Seconds per span name, summed over repeats"""
+        totals = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            totals[span.name] = round(totals.get(span.name, 0.0) + span.duration, 3)
+        return totals
+
+    def chrome_trace(self):
+        """Spans in the Chrome trace event format"""
+        tracks = {}
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            tid = tracks.setdefault(span.track, len(tracks) + 1)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': int((span.start - self.started) * 1_000_000),
+                'dur': int(span.duration * 1_000_000),
+                'pid': 1,
+                'tid': tid,
+                'args': span.attrs,
+            })
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': track}}
+                   for track, tid in tracks.items()]
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': self.command}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self):
+        """Write the JSON and Chrome traces and append to the history; return the JSON path"""
+        if not self.enabled or not self.spans:
+            return None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.fromtimestamp(self.started).strftime('%Y%m%d-%H%M%S')
+        path = self.directory / f"{self.command}-{stamp}.json"
+        total = max(s.end for s in self.spans) - self.started
+
+        path.write_text(json.dumps({
+            'command': self.command,
+            'started': self.started,
+            'total': round(total, 3),
+            'spans': [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start)],
+        }, indent=2))
+        path.with_suffix('.chrome.json').write_text(json.dumps(self.chrome_trace()))
+
+        with open(self.directory / 'history.jsonl', 'a') as f:
+            f.write(json.dumps({
+                'command': self.command,
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'total': round(total, 3),
+                'trace': path.name,
+                'phases': self.summary(),
+            }) + "\n")
+
+        logger.info(f"Trace written to {path} ({total:.1f}s total)")
+        return path
+
+
+class PhaseParser:
+    """Turns `[n/N] @<epoch> label` lines into consecutive phase spans, and step markers into step spans"""
+
+    def __init__(self, tracer, track=None, prefix='remote'):
+        self.tracer = tracer
+        self.track = track or threading.current_thread().name
+        self.prefix = prefix
+        self.current = None
+        self.steps = {}
+
+    def step(self, event, at, name, detail):
+        """Open, close or record (when skipped) one concurrent step"""
+        if event == 'start':
+            self.steps[name] = (detail or name, at)
+            return
+        label, start = self.steps.pop(name, (detail or name, at))
+        attrs = {'step': name}
+        if event == 'skip':
+            attrs['skipped'] = True
+        elif event == 'fail':
+            attrs['error'] = detail or 'failed'
+        label = label.rstrip('.').strip()
+        self.tracer.add(f"{self.prefix}: {label}", start, at, 'remote', f"{self.track}/{name}", **attrs)
+
+    def feed(self, line):
+        """Inspect one output line; return True when it was a phase or step marker"""
+        if isinstance(line, bytes):
+            line = line.decode(errors='replace')
+        step = STEP_MARKER.search(line)
+        if step:
+            self.step(step.group(1), float(step.group(2)), step.group(3), step.group(4))
+            return True
+        done = DONE_MARKER.search(line)
+        if done:
+            self.close(float(done.group(1)))
+            return True
+        match = PHASE_MARKER.search(line)
+        if not match:
+            return False
+
+        at = float(match.group(3))
+        self.close(at)
+        label = match.group(4).rstrip('.').strip() or f"phase {match.group(1)}"
+        self.current = (f"{self.prefix}: {label}", at, match.group(1), match.group(2))
+        return True
+
+    def close(self, end=None):
+        """End the open phase, and any unfinished steps, at end (now by default)"""
+        for name in list(self.steps):
+            self.step('fail', end or time.time(), name, 'unfinished')
+        if self.current:
+            name, start, index, total = self.current
+            self.tracer.add(name, start, end or time.time(), 'remote', self.track, phase=f"{index}/{total}")
+            self.current = None
+
+    def feed_all(self, text, end=None):
+        """Parse a complete log (e.g. serial console output) after the fact"""
+        for line in text.splitlines():
+            self.feed(line)
+        self.close(end)
+
+
+def load_history(directory):
+    path = Path(directory) / 'history.jsonl'
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def _seconds(value):
+    return f"{value:.1f}s" if value is not None else '-'
+
+
+def render_compare(before, after):
+    """Per-phase durations of two runs side by side"""
+    names = list(before['phases']) + [n for n in after['phases'] if n not in before['phases']]
+    width = max([len(n) for n in names] + [20])
+    lines = [
+        f"{'PHASE':<{width}} {before['started']:>20} {after['started']:>20} {'DELTA':>9}",
+    ]
+    for name in names + ['total']:
+        a = before['total'] if name == 'total' else before['phases'].get(name)
+        b = after['total'] if name == 'total' else after['phases'].get(name)
+        delta = f"{b - a:+.1f}s" if a is not None and b is not None else ''
+        lines.append(f"{name:<{width}} {_seconds(a):>20} {_seconds(b):>20} {delta:>9}")
+    return "\n".join(lines)
+
+
+def main():
+    """Main entry point"""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Inspect and compare deploy traces")
+    parser.add_argument('--dir', default='traces')
+    sub = parser.add_subparsers(dest='action', required=True)
+    history_parser = sub.add_parser('history', help='list recent runs')
+    history_parser.add_argument('--limit', type=int, default=20)
+    compare_parser = sub.add_parser('compare', help='compare two runs phase by phase')
+    compare_parser.add_argument('runs', nargs='*', type=int, help='history indexes, 1 = latest (default: 2 1)')
+    compare_parser.add_argument('--command', help='only consider runs of this command')
+    args = parser.parse_args()
+    if args.action == 'compare' and (len(args.runs) not in (0, 2) or any(i < 1 for i in args.runs)):
+        compare_parser.error("give two history indexes, 1 = latest")
+
+    history = load_history(args.dir)
+    if args.action == 'history':
+        for index, run in reversed(list(enumerate(reversed(history), 1))[:args.limit]):
+            print(f"{index:>3}  {run['started']}  {run['command']:<10} {run['total']:>8.1f}s  {run['trace']}")
+        return
+
+    command = args.command or (history[-1]['command'] if history else None)
+    runs = [r for r in history if r['command'] == command]
+    older, newer = args.runs or [2, 1]
+    if len(runs) < max(older, newer):
+        logger.error(f"Need at least {max(older, newer)} traced runs of '{command}', found {len(runs)}")
+        sys.exit(1)
+    print(render_compare(runs[-older], runs[-newer]))
+
+
+if __name__ == "__main__":
+    main()
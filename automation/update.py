@@ -1,95 +1,168 @@
 #!/usr/bin/env python3
 """
-Update deployed application by pulling latest changes and rebuilding
+Update deployed application without downtime
+
+The new release is prepared in its own directory while the current one keeps
+serving. The current symlink is then switched atomically and PM2 reloads
+gracefully. Old releases are kept, so --rollback is instant.
 """
 
-import yaml
+import sys
+import shlex
 import logging
-import time
-from google.cloud import compute_v1
-from google.oauth2 import service_account
+import argparse
+from datetime import datetime, timezone
+
+from artifact import artifact_mode, build_release, release_dir
+from delta_transfer import DeltaTransfer, GcloudRemote
+from loadtest import gate as loadtest_gate, loadtest_settings
+from operations import OperationWaiter
+from readiness import ReadinessProbe, ReadinessTimeoutError, default_endpoints
+from releases import prepare_source_script, release_root, rollback_script, switch_script
+from session import get_session
+from tracing import Tracer, phase_preamble
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def load_config():
-    """Load configuration from YAML file"""
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
-
-
-def update_application():
-    """Update the deployed application"""
-    config = load_config()
-
-    # Load credentials
-    credentials = service_account.Credentials.from_service_account_file(
-        config['gcp']['credentials_path']
-    )
-
-    # Initialize client
-    client = compute_v1.InstancesClient(credentials=credentials)
+def get_instance_ip(session):
+    """External IP of the configured instance"""
+    config = session.config
+    # Only its retries are used: a lookup that hits a transient error is repeated
+    waiter = OperationWaiter(config['gcp']['project_id'], timeout=config['deployment'].get('operation_timeout', 600))
+    instance = waiter.call(lambda: session.compute_api(
+        f"projects/{config['gcp']['project_id']}/zones/{config['gcp']['zone']}"
+        f"/instances/{config['instance']['name']}"
+    ), "instance lookup")
+    for interface in instance.get('networkInterfaces', []):
+        for access_config in interface.get('accessConfigs', []):
+            if access_config.get('natIP'):
+                return access_config['natIP']
+    return None
 
-    project_id = config['gcp']['project_id']
-    zone = config['gcp']['zone']
-    instance_name = config['instance']['name']
 
-    # Update script
-    update_script = f"""#!/bin/bash
-set -e
+def open_remote(config, host):
+    """Pooled SSH session when configured, gcloud compute ssh otherwise"""
+    if config.get('ssh', {}).get('transport', 'gcloud') == 'paramiko':
+        from ssh_pool import SSHPool, SSHRemote
 
-cd /var/www/{config['application']['name']}
+        pool = SSHPool.from_config(config)
+        return SSHRemote(pool, host), pool.close
 
-# Stop the application
-pm2 stop {config['application']['name']}
+    remote = GcloudRemote(config['instance']['name'], config['gcp']['project_id'], config['gcp']['zone'])
+    return remote, lambda: None
 
-# Pull latest changes
-git pull origin {config['application']['branch']}
 
-# Install dependencies
-npm install
+def run_script(remote, script, tracer, track, timeout=1200):
+    """Run a bash script remotely with live output, tracing its phases"""
+    script = f"{phase_preamble(script)}{script}phase_done\n"
+    phases = tracer.phases(track=track)
+    try:
+        with tracer.span('remote script', track=track):
+            remote.run(f"bash -c {shlex.quote('set -e' + chr(10) + script)}", timeout=timeout, echo=True,
+                       on_line=phases.feed)
+    finally:
+        phases.close()
 
-# Build application
-npm run build
 
-# Restart application
-pm2 restart {config['application']['name']}
+def update_application(rollback=False):
+    """Update (or roll back) the deployed application, tracing each phase"""
+    session = get_session()
+    tracer = Tracer('rollback' if rollback else 'update', session.config)
+    try:
+        return run_update(session, tracer, rollback)
+    finally:
+        tracer.export()
 
-echo "Application updated successfully!"
-"""
 
-    logger.info("Updating deployed application...")
-    logger.info("This will:")
-    logger.info("  1. Pull latest changes from GitHub")
-    logger.info("  2. Install new dependencies")
-    logger.info("  3. Rebuild the application")
-    logger.info("  4. Restart the server")
+def run_update(session, tracer, rollback=False):
+    """Update (or roll back) the deployed application"""
+    config = session.config
+    artifact = artifact_mode(config)
+    track = config['instance']['name']
 
-    # Create metadata for running the update script
-    metadata = compute_v1.Metadata()
-    metadata_items = compute_v1.Items()
-    metadata_items.key = "startup-script"
-    metadata_items.value = update_script
-    metadata.items = [metadata_items]
+    with tracer.span('instance lookup', 'gcp', track=track):
+        host = get_instance_ip(session)
+    if not host:
+        logger.error("Instance has no external IP. Is it running? Check: python status.py")
+        return False
 
+    remote, close = open_remote(config, host)
     try:
-        # Note: In practice, you'd want to use SSH or Cloud Run to execute this
-        logger.info("\nTo manually update, SSH into the instance and run:")
-        logger.info(f"\ncd /var/www/{config['application']['name']}")
-        logger.info("git pull")
-        logger.info("npm install")
-        logger.info("npm run build")
-        logger.info(f"pm2 restart {config['application']['name']}")
-
-        logger.info("\n" + "=" * 60)
-        logger.info("For automated updates, this script sets up the update command.")
-        logger.info("SSH into your instance to execute the update.")
-        logger.info("=" * 60)
+        if rollback:
+            logger.info("Switching back to the previous release...")
+            run_script(remote, 'phase "Switching release..."\n' + rollback_script(config)
+                       + switch_script(config, '$PREVIOUS', artifact, sudo='sudo '), tracer, track)
+
+        elif artifact:
+            logger.info("Step 1: Building release artifact...")
+            with tracer.span('build release'):
+                release = build_release(config)
+
+            logger.info("Step 2: Sending release to the instance...")
+            target = release_dir(config, release)
+            transfer = DeltaTransfer(remote, store=f"/var/lib/{config['application']['name']}/chunks")
+            with tracer.span('delta transfer', track=track):
+                transfer.push(release.path, target)
+
+            logger.info("Step 3: Switching to the new release...")
+            root = release_root(config)
+            run_script(remote, 'phase "Switching release..."\n'
+                               f"sudo chown -R $(id -un):$(id -gn) {root}\n"
+                               + switch_script(config, target, artifact=True, sudo='sudo '), tracer, track)
+
+        else:
+            release_id = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+            logger.info(f"Step 1: Preparing release {release_id} (the current release keeps serving)...")
+            logger.info("Step 2: Switching to the new release...")
+            run_script(remote, 'phase "Preparing release..."\n'
+                               + prepare_source_script(config, release_id, sudo='sudo ')
+                               + 'phase "Switching release..."\n'
+                               + switch_script(config, '$NEW_RELEASE', artifact=False, sudo='sudo '), tracer, track)
 
     except Exception as e:
         logger.error(f"Error updating application: {e}")
+        # The switch may have failed after the symlink moved; say what to check instead of guessing
+        logger.info(f"Check the served release with: readlink {release_root(config)}/current; pm2 status")
+        return False
+    finally:
+        close()
+
+    logger.info("Verifying the application responds...")
+    probe = ReadinessProbe(host, default_endpoints(config), timeout=120)
+    try:
+        with tracer.span('readiness', 'http', track=track):
+            probe.wait()
+    except ReadinessTimeoutError as e:
+        logger.error(f"Release switched but not healthy: {e}")
+        logger.info("Roll back with: python update.py --rollback")
+        return False
+
+    passed = True
+    if not rollback and loadtest_settings(config)['gate']:
+        with tracer.span('loadtest', 'http', track=track):
+            passed = loadtest_gate(config, host)
+    if not passed:
+        logger.error("Release regressed against the load test baseline.")
+        logger.info("Roll back with: python update.py --rollback")
+        return False
+
+    logger.info("\n" + "=" * 60)
+    logger.info("✓ ROLLED BACK" if rollback else "✓ APPLICATION UPDATED")
+    logger.info("=" * 60)
+    return True
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(description="Update the deployed application without downtime")
+    parser.add_argument('--rollback', action='store_true', help='switch back to the previous release')
+    args = parser.parse_args()
+
+    success = update_application(rollback=args.rollback)
+    sys.exit(0 if success else 1)
 
 
 if __name__ == "__main__":
-    update_application()
+    main()
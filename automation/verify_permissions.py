@@ -3,25 +3,17 @@
 Verify GCP service account permissions
 """
 
-import yaml
 import logging
-from google.oauth2 import service_account
-from googleapiclient import discovery
-from googleapiclient.errors import HttpError
+from session import ApiError, get_session
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
 
-def load_config():
-    """Load configuration"""
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
-
-
 def verify_permissions():
     """Verify service account has required permissions"""
-    config = load_config()
+    session = get_session()
+    config = session.config
 
     logger.info("=" * 60)
     logger.info("GCP SERVICE ACCOUNT PERMISSION VERIFICATION")
@@ -29,15 +21,7 @@ def verify_permissions():
 
     # Load credentials
     try:
-        scopes = [
-            'https://www.googleapis.com/auth/compute',
-            'https://www.googleapis.com/auth/cloud-platform'
-        ]
-
-        credentials = service_account.Credentials.from_service_account_file(
-            config['gcp']['credentials_path'],
-            scopes=scopes
-        )
+        credentials = session.credentials()
 
         logger.info(f"\n✓ Credentials loaded successfully")
         logger.info(f"  Service Account: {credentials.service_account_email}")
@@ -49,7 +33,6 @@ def verify_permissions():
 
     # Test Compute Engine API access
     try:
-        compute = discovery.build('compute', 'v1', credentials=credentials)
         project_id = config['gcp']['project_id']
         zone = config['gcp']['zone']
 
@@ -57,7 +40,7 @@ def verify_permissions():
 
         # Try to list instances (read permission)
         logger.info(f"  → Testing list instances permission...")
-        result = compute.instances().list(project=project_id, zone=zone).execute()
+        result = session.compute_api(f"projects/{project_id}/zones/{zone}/instances")
         logger.info(f"  ✓ List instances: SUCCESS")
 
         if 'items' in result:
@@ -65,7 +48,7 @@ def verify_permissions():
 
         # Try to get project info
         logger.info(f"\n  → Testing project access...")
-        project = compute.projects().get(project=project_id).execute()
+        project = session.compute_api(f"projects/{project_id}")
         logger.info(f"  ✓ Project access: SUCCESS")
         logger.info(f"    Project Name: {project.get('name', 'N/A')}")
 
@@ -77,12 +60,12 @@ def verify_permissions():
 
         return True
 
-    except HttpError as e:
+    except ApiError as e:
         logger.error("\n" + "=" * 60)
         logger.error("✗ PERMISSION ERROR")
         logger.error("=" * 60)
 
-        if e.resp.status == 401:
+        if e.status == 401:
             logger.error("\nError 401: Unauthorized")
             logger.error("\nPossible causes:")
             logger.error("1. Permissions were just added - wait 2-5 minutes for propagation")
@@ -97,7 +80,7 @@ def verify_permissions():
             logger.error("3. Verify permissions in IAM console:")
             logger.error(f"   https://console.cloud.google.com/iam-admin/iam?project={project_id}")
 
-        elif e.resp.status == 403:
+        elif e.status == 403:
             logger.error("\nError 403: Forbidden")
             logger.error("\nThe service account exists but lacks required permissions.")
             logger.error("\nAdd these roles in GCP IAM Console:")
@@ -105,7 +88,7 @@ def verify_permissions():
             logger.error("  • Service Account User")
 
         else:
-            logger.error(f"\nHTTP Error {e.resp.status}: {e}")
+            logger.error(f"\nHTTP Error {e.status}: {e}")
 
         logger.error("\n" + "=" * 60)
         logger.error("See TROUBLESHOOTING.md for detailed solutions")
@@ -118,5 +101,10 @@ def verify_permissions():
         return False
 
 
-if __name__ == "__main__":
+def main():
+    """Main entry point"""
     verify_permissions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import type { ImageLoaderProps } from "next/image";
+
+// Set by automation/cdn_offload.py when images are offloaded to a bucket
+const assetBase = process.env.NEXT_PUBLIC_ASSET_BASE;
+const manifest: {
+  widths: number[];
+  qualities: number[];
+  format: string | null;
+  images: Record<string, string>;
+} = JSON.parse(process.env.NEXT_PUBLIC_IMAGE_MANIFEST || '{"widths":[],"qualities":[],"format":null,"images":{}}');
+
+// Offloaded images resolve to objects keyed by content hash: a rendered
+// variant when one matches, else the original. Otherwise the URLs are those
+// of the built-in optimizer, which Nginx answers from the variants
+// rendered by automation/image_variants.py, falling back to the original
+export default function imageLoader({ src, width, quality }: ImageLoaderProps) {
+  const q = quality || 75;
+  const name = src.startsWith("/images/") ? src.slice("/images/".length) : "";
+  const digest = assetBase ? manifest.images[name] : undefined;
+
+  if (digest) {
+    if (manifest.format && manifest.widths.includes(width) && manifest.qualities.includes(q)) {
+      return `${assetBase}/image-variants/${digest}/${width}-${q}.${manifest.format}`;
+    }
+    return `${assetBase}/images/${digest}/${name}`;
+  }
+  return `/_next/image?url=${encodeURIComponent(src)}&w=${width}&q=${q}`;
+}
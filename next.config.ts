@@ -1,7 +1,17 @@
 import type { NextConfig } from "next";
 
+// automation/artifact.py sets NEXT_OUTPUT: "standalone" for release tarballs,
+// "export" for the static build that Nginx serves without a Node server
+const output = process.env.NEXT_OUTPUT;
+// automation/cdn_offload.py: hashed assets and images are served from a bucket
+const assetBase = process.env.NEXT_PUBLIC_ASSET_BASE;
+
 const nextConfig: NextConfig = {
-  /* config options here */
+  output: output === "standalone" || output === "export" ? output : undefined,
+  assetPrefix: assetBase || undefined,
+  // A static export has no image optimizer, and offloaded images live in the
+  // bucket; either way image-loader.ts points at pre-rendered variants
+  images: output === "export" || assetBase ? { loader: "custom", loaderFile: "./image-loader.ts" } : undefined,
 };
 
 export default nextConfig;